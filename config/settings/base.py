@@ -51,6 +51,8 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 MIDDLEWARE = [
+    # 他のミドルウェアを含めたリクエスト全体を計測するため先頭に置く
+    'income_and_expense.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -82,6 +84,24 @@ TEMPLATES = [
 WSGI_APPLICATION = 'config.wsgi.application'
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# 既定はプロセス内メモリ。複数プロセスで動かす場合は変更時の破棄が
+# 他プロセスに伝わらないため、DJANGO_CACHE_BACKEND / DJANGO_CACHE_LOCATION で
+# Redis 等の共有キャッシュを指定する。
+# 例: django.core.cache.backends.redis.RedisCache / redis://127.0.0.1:6379
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'DJANGO_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', ''),
+    }
+}
+
+
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
 
@@ -2,24 +2,30 @@ from django.contrib import admin
 
 from .models import *
 
+from income_and_expense import transitions
 from income_and_expense.const import const_data
 
+def _update_state(request, queryset, state):
+    transitions.apply(
+        queryset, state, transitions.SOURCE_ADMIN, request.user.get_username()
+    )
+
 def set_undecided(modeladmin, request, queryset):
-    queryset.update(state=StateChoices.UNDECIDED)
+    _update_state(request, queryset, StateChoices.UNDECIDED)
 set_undecided.short_description = (
     const_data.const.SHOWN_NAME_UNDECIDED +
     const_data.const.SHOWN_NAME_CHANGE_TO
 )
 
 def set_decided(modeladmin, request, queryset):
-    queryset.update(state=StateChoices.DECIDED)
+    _update_state(request, queryset, StateChoices.DECIDED)
 set_decided.short_description = (
     const_data.const.SHOWN_NAME_DECIDED +
     const_data.const.SHOWN_NAME_CHANGE_TO
 )
 
 def set_done(modeladmin, request, queryset):
-    queryset.update(state=StateChoices.DONE)
+    _update_state(request, queryset, StateChoices.DONE)
 set_done.short_description = (
     const_data.const.SHOWN_NAME_DONE +
     const_data.const.SHOWN_NAME_CHANGE_TO
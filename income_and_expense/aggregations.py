@@ -0,0 +1,102 @@
+"""必要金額(未完了支出の合計)と、口座別の日々の収支の集計。
+
+支払方法・口座・ユーザー・銀行のいずれの軸でも、支出の月別集計を1回の
+GROUP BY で集計し、軸側の一覧とメモリ上で突き合わせる。
+"""
+import collections
+
+from django.db.models import F, Sum
+
+from income_and_expense.models import (
+    Account, Bank, Expense, ExpenseMonthSummary, Income, Method,
+    StateChoices, User,
+)
+
+# 集計軸: (支出から辿るキー, 軸のモデル, select_related, 表示順)
+REQUIRE_DIMENSIONS = {
+    'method': (
+        'method', Method,
+        ('account__user', 'account__bank'),
+        ('account__user__name', 'name', 'account__bank__name'),
+    ),
+    'account': (
+        'method__account', Account,
+        ('user', 'bank'),
+        ('user__name', 'bank__name'),
+    ),
+    'user': ('method__account__user', User, (), ('name',)),
+    'bank': ('method__account__bank', Bank, (), ('name',)),
+}
+
+
+def require_queryset(dimension, first_date, last_date):
+    """require_by の集計の QuerySet(集計軸のキー, total)。"""
+    key = REQUIRE_DIMENSIONS[dimension][0]
+    return (
+        ExpenseMonthSummary.objects
+        .filter(month__gte=first_date.replace(day=1), month__lte=last_date)
+        .exclude(state=StateChoices.DONE)
+        .values(key)
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+
+
+def require_by(dimension, first_date, last_date):
+    """期間内の未完了支出の合計を集計軸ごとに1クエリで集計する。
+
+    月別集計から求めるため、期間は月単位(first_date を含む月から
+    last_date を含む月まで)として扱う。
+
+    Returns
+    -------
+    dict
+        集計軸の id をキー、必要金額を値とする辞書(支出のないものは含まない)
+    """
+    key = REQUIRE_DIMENSIONS[dimension][0]
+    rows = require_queryset(dimension, first_date, last_date)
+    return {r[key]: r['total'] or 0 for r in rows}
+
+
+def require_rows(dimension, first_date, last_date):
+    """集計軸の全オブジェクトと必要金額の組を表示順に返す。
+
+    集計1クエリ + 一覧1クエリで完結する。
+
+    Returns
+    -------
+    list of tuple
+        (集計軸のオブジェクト, 必要金額) のリスト
+    """
+    _, model, related, ordering = REQUIRE_DIMENSIONS[dimension]
+    requires = require_by(dimension, first_date, last_date)
+    objs = model.objects.select_related(*related).order_by(*ordering)
+    return [(obj, requires.get(obj.pk, 0)) for obj in objs]
+
+
+def pending_daily_flows(first_date, last_date):
+    """期間内の未完了の収支の、口座・日ごとの増減(収入 - 支出)。
+
+    収入・支出それぞれの GROUP BY を UNION ALL でつないだ1クエリで、
+    口座・日付順に取得する。
+
+    Returns
+    -------
+    dict
+        口座IDをキー、{日付: 増減} を値とする辞書
+    """
+    def grouped(model, sign):
+        return (
+            model.objects
+            .filter(pay_date__gte=first_date, pay_date__lte=last_date)
+            .exclude(state=StateChoices.DONE)
+            .values(account_id=F('method__account'), date=F('pay_date'))
+            .annotate(delta=Sum('amount') * sign)
+            .order_by()
+        )
+
+    rows = grouped(Income, 1).union(grouped(Expense, -1), all=True)
+    flows = collections.defaultdict(lambda: collections.defaultdict(int))
+    for r in rows.order_by('account_id', 'date'):
+        flows[r['account_id']][r['date']] += r['delta']
+    return flows
@@ -10,6 +10,7 @@ router.register(r'incomes', api_views.IncomeViewSet, basename='income')
 router.register(r'expenses', api_views.ExpenseViewSet, basename='expense')
 router.register(r'accounts', api_views.AccountViewSet, basename='account')
 router.register(r'loans', api_views.LoanViewSet, basename='loan')
+router.register(r'jobs', api_views.JobViewSet, basename='job')
 router.register(
     r'default_incomes',
     api_views.DefaultIncomeViewSet,
@@ -36,14 +37,22 @@ urlpatterns = [
     ),
     path('balance/', api_views.BalanceAPIView.as_view(), name='balance'),
     path('trends/', api_views.TrendAPIView.as_view(), name='trends'),
+    path('forecast/', api_views.ForecastAPIView.as_view(), name='forecast'),
+    path('search/', api_views.SearchAPIView.as_view(), name='search'),
     path(
         'account_require/',
         api_views.AccountRequireAPIView.as_view(),
         name='account-require',
     ),
+    path(
+        'account_shortfall/',
+        api_views.AccountShortfallAPIView.as_view(),
+        name='account-shortfall',
+    ),
     path(
         'method_require/',
         api_views.MethodRequireAPIView.as_view(),
         name='method-require',
     ),
+    path('_metrics/', api_views.MetricsAPIView.as_view(), name='metrics'),
 ]
@@ -1,25 +1,47 @@
 import datetime
 
 from dateutil.relativedelta import relativedelta
-from django.db.models import Q, Sum
-from django.db.models.functions import TruncMonth
-from django.utils import timezone
-from rest_framework import generics, status, views, viewsets
+from django.db.models import Q
+from django.http import Http404
+from django.urls import reverse
+from django.utils import dateparse, timezone
+from rest_framework import (
+    generics, parsers, permissions, status, views, viewsets,
+)
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
+from income_and_expense import (
+    aggregations, balances, batches, defaults, exports, forecast, imports,
+    jobs, journal, ledger, loans, metrics, search, transitions, trends,
+    versions,
+)
 from income_and_expense.models import (
-    Account, DefaultExpense, DefaultExpenseMonth, DefaultIncome,
-    DefaultIncomeMonth, Expense, Income, Loan, Method, StateChoices,
-    TemplateExpense,
+    Account, AccountLedger, DefaultExpense, DefaultIncome, Expense, Income,
+    Job, Loan, Method, StateChoices, TemplateExpense,
+)
+from income_and_expense.pagination import (
+    INEX_ORDERING, InexKeysetPagination,
 )
 from income_and_expense.serializers import (
-    AccountSerializer, DefaultExpenseSerializer, DefaultIncomeSerializer,
-    ExpenseSerializer, IncomeSerializer, LoanSerializer, MethodSerializer,
+    AccountSerializer, CompactInexSerializer, DefaultExpenseSerializer,
+    DefaultIncomeSerializer, ExpenseSerializer, IncomeSerializer,
+    JobSerializer, LoanSerializer, MethodSerializer,
+    StatementImportSerializer, StateTransitionSerializer,
     TemplateExpenseSerializer,
 )
 
+# add_defaults_range で一度に生成できる最大月数
+_MAX_DEFAULT_RANGE_MONTHS = 60
+
+# ジョブの一覧で返す最大件数
+_MAX_JOB_LIST = 100
+
+# ローンの返済額を一度に集計できる最大月数
+_MAX_LOAN_RANGE_MONTHS = 600
+
 
 def _month_range(year, month):
     first_date = datetime.date(year, month, 1)
@@ -38,6 +60,125 @@ def _parse_year_month(request):
         raise ValidationError('year, month は整数で指定してください')
 
 
+def _parse_year_month_range(request, max_months):
+    """start_year/start_month 〜 end_year/end_month の期間を4つ組で返す。"""
+    keys = ('start_year', 'start_month', 'end_year', 'end_month')
+    values = [request.query_params.get(k) for k in keys]
+    if not all(values):
+        raise ValidationError(
+            'start_year, start_month, end_year, end_month は必須です'
+        )
+    try:
+        sy, sm, ey, em = (int(v) for v in values)
+        start_first = datetime.date(sy, sm, 1)
+        end_first = datetime.date(ey, em, 1)
+    except (TypeError, ValueError):
+        raise ValidationError('年月は整数で指定してください')
+    if start_first > end_first:
+        raise ValidationError('終了月は開始月以降を指定してください')
+    if (ey - sy) * 12 + (em - sm) + 1 > max_months:
+        raise ValidationError(
+            '一度に指定できるのは{0}か月までです'.format(max_months)
+        )
+    return sy, sm, ey, em
+
+
+def _parse_date_range(request):
+    """date_from / date_to(YYYY-MM-DD、省略可)を返す。"""
+    dates = []
+    for key in ('date_from', 'date_to'):
+        value = request.query_params.get(key)
+        try:
+            dates.append(datetime.date.fromisoformat(value) if value else None)
+        except ValueError:
+            raise ValidationError(
+                '{0} は YYYY-MM-DD 形式で指定してください'.format(key)
+            )
+    date_from, date_to = dates
+    if date_from and date_to and date_from > date_to:
+        raise ValidationError('date_to は date_from 以降を指定してください')
+    return date_from, date_to
+
+
+def _parse_as_of_date(request):
+    """基準日(date、YYYY-MM-DD、省略時は今日)を返す。"""
+    value = request.query_params.get('date')
+    try:
+        return (
+            datetime.date.fromisoformat(value) if value
+            else timezone.localdate()
+        )
+    except ValueError:
+        raise ValidationError('date は YYYY-MM-DD 形式で指定してください')
+
+
+def _parse_at(request):
+    """時点(at、ISO 8601 の日時、省略時は現在)を返す。"""
+    value = request.query_params.get('at')
+    if not value:
+        return timezone.now()
+    try:
+        at = dateparse.parse_datetime(value)
+    except ValueError:
+        at = None
+    if at is None:
+        raise ValidationError('at は ISO 8601 形式の日時で指定してください')
+    if timezone.is_naive(at):
+        at = timezone.make_aware(at)
+    return at
+
+
+# エクスポートで受け付ける Accept(エラーの詳細は既定の JSON を優先)
+_EXPORT_RENDERERS = [
+    *api_settings.DEFAULT_RENDERER_CLASSES,
+    exports.CSVRenderer,
+    exports.JSONLRenderer,
+]
+
+
+def _parse_export_params(request):
+    """エクスポートの期間(date_from / date_to、省略可)と形式を返す。
+
+    形式は file_type、省略時は Accept で選ばれた形式(既定は csv)。
+    """
+    file_type = request.query_params.get('file_type')
+    if not file_type:
+        file_type = request.accepted_renderer.format
+        if file_type not in exports.FILE_TYPES:
+            file_type = 'csv'
+    if file_type not in exports.FILE_TYPES:
+        raise ValidationError('file_type は csv または jsonl を指定してください')
+    return (*_parse_date_range(request), file_type)
+
+
+def _wants_async(request):
+    """async=1 が指定され、ジョブとして実行するか。"""
+    return request.query_params.get('async') in ('1', 'true')
+
+
+def _job_response(job):
+    """登録したジョブを 202 で返す(Location は状態の取得先)。"""
+    return Response(
+        JobSerializer(job).data,
+        status=status.HTTP_202_ACCEPTED,
+        headers={'Location': reverse('api:job-detail', args=(job.pk,))},
+    )
+
+
+def _range_params(sy, sm, ey, em):
+    return {
+        'start_year': sy, 'start_month': sm,
+        'end_year': ey, 'end_month': em,
+    }
+
+
+def _added_response(added):
+    """月別の追加件数をレスポンスにする。"""
+    return Response(
+        defaults.added_summary(added), status=status.HTTP_201_CREATED
+    )
+
+
 def _can_delete(year, month):
     current_time = timezone.now()
     current_first = datetime.date(current_time.year, current_time.month, 1)
@@ -53,50 +194,185 @@ def _can_add_default(year, month):
 
 def _get_balance_done(year, month):
     """該当月末までの残高(完了分)。"""
-    _, last_date = _month_range(year, month)
-    inc = Income.objects.filter(
-        pay_date__lte=last_date, state=StateChoices.DONE
-    ).aggregate(Sum('amount'))['amount__sum'] or 0
-    exp = Expense.objects.filter(
-        pay_date__lte=last_date, state=StateChoices.DONE
-    ).aggregate(Sum('amount'))['amount__sum'] or 0
-    return inc - exp
+    return balances.get_balances(year, month)[1]
 
 
 def _get_balance(year, month):
     """該当月末までの残高(全状態)。"""
-    _, last_date = _month_range(year, month)
-    inc = Income.objects.filter(
-        pay_date__lte=last_date,
-    ).aggregate(Sum('amount'))['amount__sum'] or 0
-    exp = Expense.objects.filter(
-        pay_date__lte=last_date,
-    ).aggregate(Sum('amount'))['amount__sum'] or 0
-    return inc - exp
+    return balances.get_balances(year, month)[0]
 
 
-class _InexViewSetBase(viewsets.ModelViewSet):
+def _month_conditional(request, year, month, build):
+    """該当月以前の更新バージョンで条件付き GET に応答する。"""
+    first_date = datetime.date(year, month, 1)
+    return versions.conditional_response(
+        request, first_date.isoformat(),
+        versions.state_until(first_date), build,
+    )
+
+
+def _list_data(data):
+    """一覧のレスポンス(ページ分割時は results/next を持つ辞書)を辞書に揃える。"""
+    if isinstance(data, dict):
+        return data
+    return {'results': data}
+
+
+class _InexViewSetBase(metrics.SerializeTimingMixin, viewsets.ModelViewSet):
     model = None
 
+    pagination_class = InexKeysetPagination
+
     def get_queryset(self):
-        qs = self.model.objects.select_related(
-            'method__account__user', 'method__account__bank'
-        )
         if self.action == 'list':
+            # 一覧はインスタンスを作らず、必要な列だけを辞書で取得する
             year, month = _parse_year_month(self.request)
             first_date, last_date = _month_range(year, month)
-            qs = qs.filter(pay_date__gte=first_date, pay_date__lte=last_date)
-        return qs.order_by(
-            'method__account__user__name', 'method__name',
-            'method__account__bank__name', 'state', 'pay_date', 'name'
+            return self.model.objects.filter(
+                pay_date__gte=first_date, pay_date__lte=last_date
+            ).order_by(*INEX_ORDERING).values(*CompactInexSerializer.VALUES)
+        return self.model.objects.select_related(
+            'method__account__user', 'method__account__bank'
         )
 
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return CompactInexSerializer
+        return super().get_serializer_class()
+
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
         if not _can_delete(instance.pay_date.year, instance.pay_date.month):
             raise ValidationError("古いデータは削除できません。")
         return super().destroy(request, *args, **kwargs)
 
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request):
+        """作成・更新・削除をまとめて1つのトランザクションで実行する。"""
+        operations = request.data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            raise ValidationError('operations に操作のリストを指定してください')
+        if len(operations) > batches.MAX_OPERATIONS:
+            raise ValidationError(
+                '一度に指定できる操作は{0}件までです'.format(
+                    batches.MAX_OPERATIONS
+                )
+            )
+        try:
+            results = batches.apply(
+                self.model, self.get_serializer_class(), operations,
+                self.get_serializer_context(),
+                lambda obj: _can_delete(obj.pay_date.year, obj.pay_date.month),
+            )
+        except batches.BatchError as e:
+            return Response(
+                {'results': e.results}, status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'results': results})
+
+    @action(detail=False, methods=['post'], url_path='transition')
+    def transition(self, request):
+        """条件に合う収支の状態を1回の UPDATE でまとめて変更する。"""
+        params = StateTransitionSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        filters = dict(params.validated_data)
+        to_state = filters.pop('to_state')
+        updated, record = transitions.transition(
+            self.model, to_state, transitions.SOURCE_API,
+            request.user.get_username(), **filters
+        )
+        return Response({
+            'updated': updated,
+            'transition': record.pk if record else None,
+        })
+
+    @action(detail=False, methods=['get'], url_path='as_of')
+    def as_of(self, request):
+        """該当月の収支を、変更の記録から時点(at)の状態で再現して返す。"""
+        year, month = _parse_year_month(request)
+        at = _parse_at(request)
+        rows = journal.month_as_of(
+            self.model, datetime.date(year, month, 1), at
+        )
+        return Response({
+            'at': at,
+            'results': [
+                {
+                    'id': r['id'], 'name': r['name'],
+                    'pay_date': r['pay_date'], 'method': r['method_id'],
+                    'amount': r['amount'], 'state': r['state'],
+                    'memo': r['memo'],
+                }
+                for r in rows
+            ],
+        })
+
+    @action(detail=True, methods=['get'], url_path='history')
+    def history(self, request, pk=None):
+        """収支の変更の記録を古い順に返す(削除済みの収支も返す)。"""
+        try:
+            row_id = int(pk)
+        except ValueError:
+            raise Http404
+        entries = journal.history(self.model, row_id)
+        if not entries:
+            raise Http404
+        return Response(entries)
+
+    @action(detail=False, methods=['get'], url_path='export',
+            renderer_classes=_EXPORT_RENDERERS)
+    def export(self, request):
+        """期間内の収支を CSV / JSONL でストリーミング出力する。"""
+        date_from, date_to, file_type = _parse_export_params(request)
+        qs = self.model.objects.order_by('pay_date', 'id')
+        if date_from:
+            qs = qs.filter(pay_date__gte=date_from)
+        if date_to:
+            qs = qs.filter(pay_date__lte=date_to)
+        return exports.streaming_response(
+            qs, exports.INEX_COLUMNS, file_type,
+            self.model._meta.model_name + 's',
+        )
+
+    @action(detail=False, methods=['post'], url_path='import',
+            parser_classes=[parsers.MultiPartParser])
+    def import_statement(self, request):
+        """明細 CSV から一括登録する。dry_run なら登録せず件数だけ返す。
+
+        async=1 なら明細の形式だけを検証し、登録はジョブで行う(202)。
+        """
+        params = StatementImportSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        p = params.validated_data
+        try:
+            rows = imports.read_statement(
+                p['file'], p['date_column'], p['name_column'],
+                p['amount_column'], p.get('memo_column'),
+                p['date_format'], p['encoding'],
+            )
+            if _wants_async(request):
+                # 明細の読み込み(形式の検証)だけを行い、登録はジョブで行う
+                return _job_response(jobs.enqueue(
+                    'import_statement', jobs.statement_params(
+                        self.model, rows, p['method'], p['state'],
+                        p['dry_run'],
+                    )
+                ))
+            result = imports.import_statement(
+                self.model, rows, p['method'], p['state'], p['dry_run']
+            )
+        except imports.StatementError as e:
+            return Response(
+                imports.error_report(e.errors),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        result['dry_run'] = p['dry_run']
+        return Response(
+            result,
+            status=status.HTTP_200_OK if p['dry_run']
+            else status.HTTP_201_CREATED,
+        )
+
 
 class IncomeViewSet(_InexViewSetBase):
     serializer_class = IncomeSerializer
@@ -106,12 +382,17 @@ class IncomeViewSet(_InexViewSetBase):
     def list(self, request, *args, **kwargs):
         year, month = _parse_year_month(request)
         prev = datetime.date(year, month, 1) - relativedelta(months=1)
-        response = super().list(request, *args, **kwargs)
-        response.data = {
-            'results': response.data,
-            'prev_balance': _get_balance(prev.year, prev.month),
-        }
-        return response
+        parent_list = super().list
+
+        def build():
+            response = parent_list(request, *args, **kwargs)
+            response.data = {
+                **_list_data(response.data),
+                'prev_balance': _get_balance(prev.year, prev.month),
+            }
+            return response
+
+        return _month_conditional(request, year, month, build)
 
     @action(detail=False, methods=['post'], url_path='add_defaults')
     def add_defaults(self, request):
@@ -119,27 +400,24 @@ class IncomeViewSet(_InexViewSetBase):
         if not _can_add_default(year, month):
             raise ValidationError("過去の月にはデフォルトを追加できません。")
 
-        first_date, last_date = _month_range(year, month)
-        def_inc_months = DefaultIncomeMonth.objects.filter(month=month)
-        existing_names = set(
-            Income.objects.filter(
-                pay_date__gte=first_date, pay_date__lte=last_date
-            ).values_list('name', flat=True)
-        )
+        add_num = defaults.add_incomes_from_default(year, month)
+        return Response({'added': add_num}, status=status.HTTP_201_CREATED)
 
-        add_num = 0
-        for dim in def_inc_months:
-            di = dim.def_inc
-            if di.name in existing_names:
-                continue
-            Income(
-                name=di.name,
-                pay_date=datetime.date(year, month, di.pay_day),
-                method=di.method, amount=di.amount, state=di.state,
-            ).save()
-            add_num += 1
+    @action(detail=False, methods=['post'], url_path='add_defaults_range')
+    def add_defaults_range(self, request):
+        sy, sm, ey, em = _parse_year_month_range(
+            request, _MAX_DEFAULT_RANGE_MONTHS
+        )
+        if not _can_add_default(sy, sm):
+            raise ValidationError("過去の月にはデフォルトを追加できません。")
 
-        return Response({'added': add_num}, status=status.HTTP_201_CREATED)
+        if _wants_async(request):
+            return _job_response(jobs.enqueue(
+                'add_incomes_default_range', _range_params(sy, sm, ey, em)
+            ))
+        return _added_response(
+            defaults.add_incomes_from_default_range(sy, sm, ey, em)
+        )
 
 
 class ExpenseViewSet(_InexViewSetBase):
@@ -149,12 +427,17 @@ class ExpenseViewSet(_InexViewSetBase):
 
     def list(self, request, *args, **kwargs):
         year, month = _parse_year_month(request)
-        response = super().list(request, *args, **kwargs)
-        response.data = {
-            'results': response.data,
-            'balance': _get_balance(year, month),
-        }
-        return response
+        parent_list = super().list
+
+        def build():
+            response = parent_list(request, *args, **kwargs)
+            response.data = {
+                **_list_data(response.data),
+                'balance': _get_balance(year, month),
+            }
+            return response
+
+        return _month_conditional(request, year, month, build)
 
     @action(detail=False, methods=['post'], url_path='add_defaults')
     def add_defaults(self, request):
@@ -162,56 +445,35 @@ class ExpenseViewSet(_InexViewSetBase):
         if not _can_add_default(year, month):
             raise ValidationError("過去の月にはデフォルトを追加できません。")
 
-        first_date, last_date = _month_range(year, month)
-        existing_names = set(
-            Expense.objects.filter(
-                pay_date__gte=first_date, pay_date__lte=last_date
-            ).values_list('name', flat=True)
-        )
+        add_num = defaults.add_expenses_from_default_and_loan(year, month)
+        return Response({'added': add_num}, status=status.HTTP_201_CREATED)
 
-        add_num = 0
-        for dem in DefaultExpenseMonth.objects.filter(month=month):
-            de = dem.def_exp
-            if de.name in existing_names:
-                continue
-            Expense(
-                name=de.name,
-                pay_date=datetime.date(year, month, de.pay_day),
-                method=de.method, amount=de.amount, state=de.state,
-            ).save()
-            add_num += 1
-            existing_names.add(de.name)
-
-        loans = Loan.objects.filter(
-            (Q(first_year__lt=year) | Q(first_year=year, first_month__lte=month)),
-            (Q(last_year__gt=year) | Q(last_year=year, last_month__gte=month))
+    @action(detail=False, methods=['post'], url_path='add_defaults_range')
+    def add_defaults_range(self, request):
+        sy, sm, ey, em = _parse_year_month_range(
+            request, _MAX_DEFAULT_RANGE_MONTHS
         )
-        for loan in loans:
-            if loan.name in existing_names:
-                continue
-            if year == loan.first_year and month == loan.first_month:
-                amount = loan.amount_first
-            else:
-                amount = loan.amount_from_second
-            Expense(
-                name=loan.name,
-                pay_date=datetime.date(year, month, loan.pay_day),
-                method=loan.method, amount=amount, state=loan.state,
-            ).save()
-            add_num += 1
-            existing_names.add(loan.name)
+        if not _can_add_default(sy, sm):
+            raise ValidationError("過去の月にはデフォルトを追加できません。")
 
-        return Response({'added': add_num}, status=status.HTTP_201_CREATED)
+        if _wants_async(request):
+            return _job_response(jobs.enqueue(
+                'add_expenses_default_range', _range_params(sy, sm, ey, em)
+            ))
+        return _added_response(
+            defaults.add_expenses_from_default_and_loan_range(sy, sm, ey, em)
+        )
 
 
-class TemplateExpenseListAPIView(generics.ListAPIView):
+class TemplateExpenseListAPIView(
+        metrics.SerializeTimingMixin, generics.ListAPIView):
     serializer_class = TemplateExpenseSerializer
     queryset = TemplateExpense.objects.select_related(
         'method__account__user', 'method__account__bank'
     ).all()
 
 
-class MethodListAPIView(generics.ListAPIView):
+class MethodListAPIView(metrics.SerializeTimingMixin, generics.ListAPIView):
     serializer_class = MethodSerializer
 
     def get_queryset(self):
@@ -222,34 +484,161 @@ class MethodListAPIView(generics.ListAPIView):
         )
 
 
-class DefaultIncomeViewSet(viewsets.ModelViewSet):
+class DefaultIncomeViewSet(
+        metrics.SerializeTimingMixin, viewsets.ModelViewSet):
     serializer_class = DefaultIncomeSerializer
     queryset = DefaultIncome.objects.select_related(
         'method__account__user', 'method__account__bank'
-    ).order_by('name')
+    ).prefetch_related('defaultincomemonth_set').order_by('name')
 
 
-class DefaultExpenseViewSet(viewsets.ModelViewSet):
+class DefaultExpenseViewSet(
+        metrics.SerializeTimingMixin, viewsets.ModelViewSet):
     serializer_class = DefaultExpenseSerializer
     queryset = DefaultExpense.objects.select_related(
         'method__account__user', 'method__account__bank'
-    ).order_by('name')
+    ).prefetch_related('defaultexpensemonth_set').order_by('name')
+
+
+def _loan_rows(rows):
+    """loans の集計結果のローンを id と名前に置き換える。"""
+    return [
+        {
+            'id': row['loan'].id,
+            'name': row['loan'].name,
+            **{k: v for k, v in row.items() if k != 'loan'},
+        }
+        for row in rows
+    ]
 
 
-class LoanViewSet(viewsets.ModelViewSet):
+class LoanViewSet(metrics.SerializeTimingMixin, viewsets.ModelViewSet):
     serializer_class = LoanSerializer
     queryset = Loan.objects.select_related(
         'method__account__user', 'method__account__bank'
     ).order_by('-last_year', '-last_month')
 
+    @action(detail=False, methods=['get'], url_path='export',
+            renderer_classes=_EXPORT_RENDERERS)
+    def export(self, request):
+        """期間に返済月が重なるローンを CSV / JSONL でストリーミング出力する。"""
+        date_from, date_to, file_type = _parse_export_params(request)
+        qs = Loan.objects.order_by('id')
+        if date_from:
+            qs = qs.filter(
+                Q(last_year__gt=date_from.year)
+                | Q(last_year=date_from.year, last_month__gte=date_from.month)
+            )
+        if date_to:
+            qs = qs.filter(
+                Q(first_year__lt=date_to.year)
+                | Q(first_year=date_to.year, first_month__lte=date_to.month)
+            )
+        return exports.streaming_response(
+            qs, exports.LOAN_COLUMNS, file_type, 'loans'
+        )
+
+    @action(detail=True, methods=['get'], url_path='schedule')
+    def schedule(self, request, pk=None):
+        """返済の一覧(期間は date_from / date_to の月、省略可)。"""
+        loan = self.get_object()
+        date_from, date_to = _parse_date_range(request)
+        payments = loans.payments(
+            loan,
+            date_from.replace(day=1) if date_from else None,
+            date_to.replace(day=1) if date_to else None,
+        )
+        return Response({
+            'loan': loan.id,
+            'payments': [
+                {'pay_date': pay_date, 'amount': amount}
+                for pay_date, amount in payments
+            ],
+        })
+
+    @action(detail=False, methods=['get'], url_path='progress')
+    def progress(self, request):
+        """指定日(date、省略時は今日)時点のローン別の返済済み・残り。"""
+        date = _parse_as_of_date(request)
+        result = loans.progress(self.get_queryset(), date)
+        return Response({
+            'date': date,
+            'paid_amount': result['paid_amount'],
+            'remaining_amount': result['remaining_amount'],
+            'loans': _loan_rows(result['loans']),
+        })
+
+    @action(detail=False, methods=['get'], url_path='between')
+    def between(self, request):
+        """期間内の月のローン別・月別の返済額。"""
+        sy, sm, ey, em = _parse_year_month_range(
+            request, _MAX_LOAN_RANGE_MONTHS
+        )
+        result = loans.between(
+            self.get_queryset(),
+            datetime.date(sy, sm, 1), datetime.date(ey, em, 1),
+        )
+        return Response({
+            'amount': result['amount'],
+            'months': result['months'],
+            'loans': _loan_rows(result['loans']),
+        })
+
 
-class AccountViewSet(viewsets.ModelViewSet):
+class AccountViewSet(metrics.SerializeTimingMixin, viewsets.ModelViewSet):
     """口座一覧と残高更新用。"""
     serializer_class = AccountSerializer
     queryset = Account.objects.select_related('user', 'bank').order_by(
         'user__name', 'bank__name'
     )
 
+    @action(detail=True, methods=['get'], url_path='ledger')
+    def ledger(self, request, pk=None):
+        """口座の日別の累計残高(期間は date_from / date_to、省略可)。"""
+        account = self.get_object()
+        date_from, date_to = _parse_date_range(request)
+        qs = AccountLedger.objects.filter(account=account).order_by('date')
+        if date_from:
+            qs = qs.filter(date__gte=date_from)
+        if date_to:
+            qs = qs.filter(date__lte=date_to)
+        opening = (
+            ledger.balance_as_of(account, date_from - datetime.timedelta(days=1))
+            if date_from else (0, 0)
+        )
+        return Response({
+            'account': account.id,
+            'opening_balance': opening[0],
+            'opening_balance_done': opening[1],
+            'entries': [
+                {
+                    'date': row.date,
+                    'balance': row.balance,
+                    'balance_done': row.balance_done,
+                }
+                for row in qs
+            ],
+        })
+
+    @action(detail=False, methods=['get'], url_path='balances_as_of')
+    def balances_as_of(self, request):
+        """指定日(date、省略時は今日)時点の各口座の残高。"""
+        date = _parse_as_of_date(request)
+        as_of = ledger.balances_as_of(date)
+        return Response({
+            'date': date,
+            'accounts': [
+                {
+                    'id': a.id,
+                    'bank': a.bank.name,
+                    'user': a.user.name,
+                    'balance': as_of.get(a.id, (0, 0))[0],
+                    'balance_done': as_of.get(a.id, (0, 0))[1],
+                }
+                for a in self.get_queryset()
+            ],
+        })
+
 
 class AccountRequireAPIView(views.APIView):
     """口座別の必要金額(未完了支出の合計)と不足額。"""
@@ -257,18 +646,12 @@ class AccountRequireAPIView(views.APIView):
     def get(self, request):
         year, month = _parse_year_month(request)
         first_date, last_date = _month_range(year, month)
-        exps = Expense.objects.filter(
-            pay_date__gte=first_date, pay_date__lte=last_date
-        )
         rows = []
         require_sum = 0
         insufficient_sum = 0
-        for a in Account.objects.select_related('user', 'bank').order_by(
-            'user__name', 'bank__name'
+        for a, require in aggregations.require_rows(
+            'account', first_date, last_date
         ):
-            require = exps.filter(method__account=a).exclude(
-                state=StateChoices.DONE
-            ).aggregate(Sum('amount'))['amount__sum'] or 0
             if a.balance < require:
                 insufficient = require - a.balance
                 is_insufficient = True
@@ -296,23 +679,59 @@ class AccountRequireAPIView(views.APIView):
         })
 
 
+class AccountShortfallAPIView(views.APIView):
+    """口座別の、月内の日々の残高の最小値と不足額。
+
+    現在の残高から未完了の収支を支払日順に反映し、残高が最も少なくなる日と
+    初めて不足する日を求める(月の合計では足りても、途中の日に不足する場合を
+    検出する)。現在の残高が負の場合、初めて不足する日は月の初日とする。
+    """
+
+    def get(self, request):
+        year, month = _parse_year_month(request)
+        first_date, last_date = _month_range(year, month)
+        flows = aggregations.pending_daily_flows(first_date, last_date)
+        rows = []
+        shortfall_sum = 0
+        for a in Account.objects.select_related('user', 'bank').order_by(
+            'user__name', 'bank__name'
+        ):
+            swept = forecast.sweep(
+                a.balance, flows.get(a.id, {}), first_date
+            )
+            shortfall = max(0, -swept['min_balance'])
+            shortfall_sum += shortfall
+            rows.append({
+                'id': a.id,
+                'user': a.user.name,
+                'bank': a.bank.name,
+                'balance': a.balance,
+                'min_balance': swept['min_balance'],
+                'min_date': swept['min_date'],
+                'first_short_date': swept['first_negative_date'],
+                'closing_balance': swept['closing_balance'],
+                'shortfall': shortfall,
+                'formed_shortfall': '¥{:,}'.format(shortfall),
+                'is_short': shortfall > 0,
+                'points': swept['points'],
+            })
+        return Response({
+            'accounts': rows,
+            'shortfall_sum': shortfall_sum,
+        })
+
+
 class MethodRequireAPIView(views.APIView):
     """支払方法別の必要金額(未完了支出の合計)。"""
 
     def get(self, request):
         year, month = _parse_year_month(request)
         first_date, last_date = _month_range(year, month)
-        exps = Expense.objects.filter(
-            pay_date__gte=first_date, pay_date__lte=last_date
-        )
         rows = []
         require_sum = 0
-        for m in Method.objects.select_related(
-            'account__user', 'account__bank'
-        ).order_by('account__user__name', 'name', 'account__bank__name'):
-            require = exps.filter(method=m).exclude(
-                state=StateChoices.DONE
-            ).aggregate(Sum('amount'))['amount__sum'] or 0
+        for m, require in aggregations.require_rows(
+            'method', first_date, last_date
+        ):
             require_sum += require
             rows.append({
                 'id': m.id,
@@ -328,16 +747,21 @@ class MethodRequireAPIView(views.APIView):
 
 
 class MethodDoneAPIView(views.APIView):
-    """指定支払方法の今月の未完了支出をすべて完了にする。"""
+    """指定支払方法の今月の未完了支出をすべて完了にする。
+
+    async=1 ならジョブとして登録し、202 を返す。
+    """
 
     def post(self, request, pk):
         year, month = _parse_year_month(request)
-        first_date, last_date = _month_range(year, month)
-        qs = Expense.objects.filter(
-            method__pk=pk,
-            pay_date__gte=first_date, pay_date__lte=last_date,
+        if _wants_async(request):
+            return _job_response(jobs.enqueue(
+                'method_done', {'method': pk, 'year': year, 'month': month}
+            ))
+        updated = transitions.mark_method_done(
+            pk, datetime.date(year, month, 1), transitions.SOURCE_API,
+            request.user.get_username(),
         )
-        updated = qs.update(state=StateChoices.DONE)
         return Response({'updated': updated})
 
 
@@ -369,20 +793,21 @@ class TrendAPIView(views.APIView):
 
         end_first = datetime.date(ey, em, 1)
         start_first = end_first - relativedelta(months=months - 1)
-        end_last = end_first + relativedelta(months=1) - datetime.timedelta(days=1)
-
-        def _aggregate(model):
-            rows = (
-                model.objects
-                .filter(pay_date__gte=start_first, pay_date__lte=end_last)
-                .annotate(m=TruncMonth('pay_date'))
-                .values('m')
-                .annotate(total=Sum('amount'))
-            )
-            return {r['m']: r['total'] or 0 for r in rows}
+        return versions.conditional_response(
+            request,
+            '{0}:{1}'.format(start_first, end_first),
+            versions.state_between(start_first, end_first),
+            lambda: self._build(start_first, end_first),
+        )
 
-        inc_map = _aggregate(Income)
-        exp_map = _aggregate(Expense)
+    def _build(self, start_first, end_first):
+        month_versions = trends.month_versions(start_first, end_first)
+        inc_map = trends.month_totals(
+            Income, start_first, end_first, month_versions
+        )
+        exp_map = trends.month_totals(
+            Expense, start_first, end_first, month_versions
+        )
 
         months_data = []
         cur = start_first
@@ -398,14 +823,37 @@ class TrendAPIView(views.APIView):
         return Response({'months': months_data})
 
 
+class ForecastAPIView(views.APIView):
+    """口座別の残高推移の予測。
+
+    Query:
+      months=12 (default 12, 最大60): 当月を含む予測する月数
+    """
+
+    def get(self, request):
+        try:
+            months = int(request.query_params.get('months', '12'))
+        except (TypeError, ValueError):
+            raise ValidationError('months は整数で指定してください')
+        months = max(1, min(months, forecast.MAX_MONTHS))
+        return Response(forecast.forecast(months, timezone.localdate()))
+
+
 class BalanceAPIView(views.APIView):
     """残高サマリ。口座一覧 + DB上残高(完了分) + 差額。"""
 
     def get(self, request):
         year, month = _parse_year_month(request)
+        return _month_conditional(
+            request, year, month, lambda: self._build(year, month)
+        )
+
+    def _build(self, year, month):
         accounts = Account.objects.select_related('user', 'bank').order_by(
             'user__name', 'bank__name'
         )
+        _, last_date = _month_range(year, month)
+        as_of = ledger.balances_as_of(last_date)
         account_rows = []
         balance_sum = 0
         for a in accounts:
@@ -415,6 +863,7 @@ class BalanceAPIView(views.APIView):
                 'user': a.user.name,
                 'balance': a.balance,
                 'formed_balance': a.formed_balance(),
+                'balance_on_db': as_of.get(a.id, (0, 0))[1],
             })
             balance_sum += a.balance
 
@@ -429,3 +878,98 @@ class BalanceAPIView(views.APIView):
             'balance_on_db': balance_on_db,
             'balance_diff': balance_diff,
         })
+
+
+def _parse_optional_int(request, key):
+    value = request.query_params.get(key)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError('{0} は整数で指定してください'.format(key))
+
+
+class SearchAPIView(views.APIView):
+    """収入・支出の名前・メモの検索と、支払方法・口座・状態・月ごとの件数。
+
+    Query:
+      q (必須): 検索語(空白区切りの語をすべて含むもの)
+      type: income / expense(省略時は両方)
+      method, account, state: 絞り込み(省略可)
+      date_from, date_to: 支払日の範囲(YYYY-MM-DD、省略可)
+      limit=50 (最大200): 返す件数(支払日の新しい順)
+    """
+
+    def get(self, request):
+        q = request.query_params.get('q', '').strip()
+        if not q:
+            raise ValidationError('q は必須です')
+        type_name = request.query_params.get('type')
+        if type_name and type_name not in search.MODELS:
+            raise ValidationError('type は income または expense を指定してください')
+        state = _parse_optional_int(request, 'state')
+        if state is not None and state not in StateChoices.values:
+            raise ValidationError('state が不正です')
+        limit = _parse_optional_int(request, 'limit') or search.DEFAULT_LIMIT
+        date_from, date_to = _parse_date_range(request)
+        return Response(search.search(
+            q,
+            types=[type_name] if type_name else None,
+            method=_parse_optional_int(request, 'method'),
+            account=_parse_optional_int(request, 'account'),
+            state=state,
+            date_from=date_from,
+            date_to=date_to,
+            limit=max(1, min(limit, search.MAX_LIMIT)),
+        ))
+
+
+class JobViewSet(metrics.SerializeTimingMixin, viewsets.ReadOnlyModelViewSet):
+    """ジョブの状態(一覧は新しい順、state / kind で絞り込み可)。"""
+    serializer_class = JobSerializer
+    queryset = Job.objects.order_by('-id')
+
+    def list(self, request):
+        qs = self.get_queryset()
+        state = _parse_optional_int(request, 'state')
+        if state is not None:
+            qs = qs.filter(state=state)
+        kind = request.query_params.get('kind')
+        if kind:
+            qs = qs.filter(kind=kind)
+        return Response(
+            self.get_serializer(qs[:_MAX_JOB_LIST], many=True).data
+        )
+
+    @action(detail=True, methods=['post'], url_path='retry')
+    def retry(self, request, pk=None):
+        """失敗したジョブを再登録する。"""
+        job = self.get_object()
+        if not jobs.retry(job):
+            raise ValidationError('再実行できるのは失敗したジョブだけです')
+        job.refresh_from_db()
+        return _job_response(job)
+
+    @action(detail=False, methods=['post'], url_path='maintenance',
+            permission_classes=[permissions.IsAdminUser])
+    def maintenance(self, request):
+        """集計の作り直し等の保守用ジョブを登録する。管理者のみ。"""
+        kind = request.data.get('kind')
+        if kind not in jobs.MAINTENANCE_KINDS:
+            raise ValidationError(
+                'kind は {0} のいずれかを指定してください'.format(
+                    ', '.join(jobs.MAINTENANCE_KINDS)
+                )
+            )
+        return _job_response(jobs.enqueue(kind))
+
+
+class MetricsAPIView(views.APIView):
+    """ルート別の計測値(Prometheus テキスト形式)。管理者のみ。"""
+
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = [metrics.PrometheusTextRenderer]
+
+    def get(self, request):
+        return Response(metrics.registry.render())
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class IncomeAndExpenseConfig(AppConfig):
     name = 'income_and_expense'
+
+    def ready(self):
+        from income_and_expense import signals  # noqa: F401
@@ -0,0 +1,236 @@
+"""月末残高スナップショットの参照・破棄・再構築。
+
+残高は「直前のスナップショット + それ以降の月の収支」で求め、
+求めた月までの収支のある月のスナップショットを保存しておく。収支が変更された場合は
+その月以降のスナップショットを破棄する(次回参照時に再計算される)。
+
+参照時の保存は、集計の前に読んだ該当月以前の更新バージョンが変わって
+いない場合だけ行う。PostgreSQL では破棄を共有、保存を排他の advisory lock で
+行い、集計後に確定した変更のある古い値を保存しないようにする。
+"""
+import calendar
+import datetime
+
+from dateutil.relativedelta import relativedelta
+from django.db import connection, transaction
+from django.db.models import Max, Q, Sum
+from django.db.models.functions import TruncMonth
+
+from income_and_expense import summaries, versions
+from income_and_expense.models import (
+    BalanceSnapshot, Expense, Income, StateChoices,
+)
+
+
+# スナップショットの保存と破棄を排他する advisory lock のキー
+_SNAPSHOT_LOCK_KEY = 0x696e6578
+
+
+def _lock_snapshots(shared):
+    """トランザクションの終わりまでスナップショットのロックを取る。
+
+    破棄(shared=True)どうしは並行でき、保存(shared=False)とは排他する。
+    SQLite は書き込みを直列に行うため何もしない。
+    """
+    if connection.vendor != 'postgresql':
+        return
+    function = (
+        'pg_advisory_xact_lock_shared' if shared else 'pg_advisory_xact_lock'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT {0}(%s)'.format(function), [_SNAPSHOT_LOCK_KEY]
+        )
+
+
+def _latest_snapshot(first_date):
+    return (
+        BalanceSnapshot.objects
+        .filter(month__lte=first_date)
+        .order_by('-month')
+        .first()
+    )
+
+
+def _save_snapshots(snapshots, first_date, version):
+    """first_date 以前の更新バージョンが version のままなら保存する。
+
+    Returns
+    -------
+    bool
+        保存したか
+    """
+    with transaction.atomic():
+        _lock_snapshots(shared=False)
+        if versions.state_until(first_date)[0] != version:
+            return False
+        BalanceSnapshot.objects.bulk_create(snapshots, ignore_conflicts=True)
+        return True
+
+
+def _month_sums(model, start_date, last_date):
+    """月別の合計(全状態, 完了分)。start_date が None なら最古の月から。"""
+    qs = model.objects.filter(pay_date__lte=last_date)
+    if start_date is not None:
+        qs = qs.filter(pay_date__gte=start_date)
+    rows = (
+        qs.annotate(m=TruncMonth('pay_date'))
+        .values('m')
+        .annotate(
+            total=Sum('amount'),
+            done=Sum('amount', filter=Q(state=StateChoices.DONE)),
+        )
+    )
+    return {r['m']: (r['total'] or 0, r['done'] or 0) for r in rows}
+
+
+def _last_date(first_date):
+    """月の末日(9999年12月でも桁あふれしない)。"""
+    return first_date.replace(
+        day=calendar.monthrange(first_date.year, first_date.month)[1]
+    )
+
+
+def _accumulate(months, balance, balance_done, inc_sums, exp_sums):
+    """months の各月末のスナップショットを古い順に作る。
+
+    月の間の収支のない月は、直前のスナップショットの残高と同じため作らない。
+    """
+    snapshots = []
+    for month in sorted(months):
+        inc_total, inc_done = inc_sums.get(month, (0, 0))
+        exp_total, exp_done = exp_sums.get(month, (0, 0))
+        balance += inc_total - exp_total
+        balance_done += inc_done - exp_done
+        snapshots.append(BalanceSnapshot(
+            month=month, balance=balance, balance_done=balance_done,
+        ))
+    return snapshots
+
+
+def get_balances(year, month):
+    """該当月末までの残高を (全状態, 完了分) で返す。
+
+    該当月のスナップショットがあればそれを返す。なければ直前の
+    スナップショット以降の収支だけを集計し、途中の月の分も保存する
+    (集計中に該当月以前の収支が変更された場合は保存しない)。
+
+    保存するのは収支のある月だけで、収支のない月の残高は直前の
+    スナップショットから求める(遠い将来の月を参照しても、月ごとの
+    スナップショットを大量に作らない)。
+    """
+    first_date = datetime.date(year, month, 1)
+
+    snap = _latest_snapshot(first_date)
+    if snap is not None and snap.month == first_date:
+        return snap.balance, snap.balance_done
+
+    # 起点のスナップショットはバージョンを読んだ後に読み直す
+    version = versions.state_until(first_date)[0]
+    snap = _latest_snapshot(first_date)
+    if snap is not None and snap.month == first_date:
+        return snap.balance, snap.balance_done
+
+    if snap is None:
+        start_date, balance, balance_done = None, 0, 0
+    else:
+        start_date = snap.month + relativedelta(months=1)
+        balance, balance_done = snap.balance, snap.balance_done
+
+    inc_sums = summaries.month_sums(Income, start_date, first_date)
+    exp_sums = summaries.month_sums(Expense, start_date, first_date)
+    months = {*inc_sums, *exp_sums}
+    if not months:
+        # 起点以降に収支がなければ起点の残高のまま
+        return balance, balance_done
+
+    snapshots = _accumulate(
+        months, balance, balance_done, inc_sums, exp_sums
+    )
+    _save_snapshots(snapshots, first_date, version)
+    return snapshots[-1].balance, snapshots[-1].balance_done
+
+
+def invalidate_snapshots(*dates):
+    """指定日のうち最も古い日を含む月以降のスナップショットを破棄する。"""
+    dates = [d for d in dates if d is not None]
+    if not dates:
+        return
+    first_date = min(dates).replace(day=1)
+    with transaction.atomic(savepoint=False):
+        _lock_snapshots(shared=True)
+        BalanceSnapshot.objects.filter(month__gte=first_date).delete()
+
+
+def _last_data_month():
+    """収支が存在する最後の月の初日。収支がなければ None。"""
+    last_dates = [
+        d for d in (
+            Income.objects.aggregate(m=Max('pay_date'))['m'],
+            Expense.objects.aggregate(m=Max('pay_date'))['m'],
+        ) if d is not None
+    ]
+    if not last_dates:
+        return None
+    return max(last_dates).replace(day=1)
+
+
+def rebuild_snapshots():
+    """全スナップショットを破棄し、全期間から作り直す。作成件数を返す。
+
+    月別集計を経由せず、収支から直接集計する。
+    """
+    with transaction.atomic():
+        _lock_snapshots(shared=False)
+        BalanceSnapshot.objects.all().delete()
+        end_first = _last_data_month()
+        if end_first is None:
+            return 0
+        last_date = _last_date(end_first)
+        inc_sums = _month_sums(Income, None, last_date)
+        exp_sums = _month_sums(Expense, None, last_date)
+        snapshots = _accumulate(
+            {*inc_sums, *exp_sums}, 0, 0, inc_sums, exp_sums
+        )
+        BalanceSnapshot.objects.bulk_create(snapshots)
+        return len(snapshots)
+
+
+def check_snapshots():
+    """保存済みスナップショットと全期間の再計算結果を比較する。
+
+    月別集計の誤りも検出できるよう、再計算は収支から直接集計する。
+
+    Returns
+    -------
+    list of dict
+        不一致の月ごとの month, balance, balance_done, expected_balance,
+        expected_balance_done
+    """
+    stored = list(BalanceSnapshot.objects.order_by('month'))
+    if not stored:
+        return []
+
+    end_first = stored[-1].month
+    last_date = _last_date(end_first)
+    inc_sums = _month_sums(Income, None, last_date)
+    exp_sums = _month_sums(Expense, None, last_date)
+    months = {*inc_sums, *exp_sums, *(snap.month for snap in stored)}
+    expected = {
+        s.month: s for s in _accumulate(months, 0, 0, inc_sums, exp_sums)
+    }
+
+    mismatches = []
+    for snap in stored:
+        exp_snap = expected[snap.month]
+        if (snap.balance, snap.balance_done) != (
+            exp_snap.balance, exp_snap.balance_done
+        ):
+            mismatches.append({
+                'month': snap.month,
+                'balance': snap.balance,
+                'balance_done': snap.balance_done,
+                'expected_balance': exp_snap.balance,
+                'expected_balance_done': exp_snap.balance_done,
+            })
+    return mismatches
@@ -0,0 +1,164 @@
+"""収入・支出の作成・更新・削除のまとめ実行。
+
+1つのトランザクションの中で、更新・削除の対象の行をロックしてから
+すべての操作を検証し、1件でも誤りがあれば何も変更しない。誤りがなければ
+bulk_create / bulk_update / QuerySet.delete() を行い、変更の記録を1回で
+書き、変更のあった日を1回で通知する(削除の行ごとのシグナルによる記録と
+通知も journal.collect / signals.collect でまとめる)。
+"""
+import collections
+
+from django.db import transaction
+
+from income_and_expense import journal, signals, summaries
+
+MAX_OPERATIONS = 500
+
+OPERATIONS = ('create', 'update', 'delete')
+
+
+class BatchError(Exception):
+    """操作に誤りがある。results は操作ごとの結果(誤りを含む)のリスト。"""
+
+    def __init__(self, results):
+        super().__init__('操作に誤りがあります')
+        self.results = results
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _validate(model, serializer_class, operations, context, can_delete):
+    """操作を検証し、(操作ごとの結果, 操作ごとの対象) を返す。"""
+    ids = [
+        op.get('id') for op in operations
+        if isinstance(op, dict) and op.get('op') in ('update', 'delete')
+    ]
+    ids = [i for i in ids if _is_id(i)]
+    id_counts = collections.Counter(ids)
+    instances = {
+        obj.pk: obj
+        for obj in model.objects.select_for_update()
+        .filter(pk__in=ids).order_by('pk')
+    }
+
+    results = []
+    targets = []
+    for op in operations:
+        result = {'op': op.get('op') if isinstance(op, dict) else None}
+        target = None
+        if result['op'] not in OPERATIONS:
+            result['errors'] = {
+                'op': ['create, update, delete のいずれかを指定してください']
+            }
+        elif result['op'] == 'create':
+            serializer = serializer_class(
+                data=op.get('data'), context=context
+            )
+            if serializer.is_valid():
+                target = model(**serializer.validated_data)
+            else:
+                result['errors'] = serializer.errors
+        else:
+            result['id'] = op.get('id')
+            instance = (
+                instances.get(result['id']) if _is_id(result['id']) else None
+            )
+            if instance is None:
+                result['errors'] = {'id': ['対象が見つかりません']}
+            elif id_counts[result['id']] > 1:
+                result['errors'] = {'id': ['同じ対象を複数回指定しています']}
+            elif result['op'] == 'delete':
+                if can_delete(instance):
+                    target = instance
+                else:
+                    result['errors'] = {
+                        'non_field_errors': ['古いデータは削除できません。']
+                    }
+            else:
+                serializer = serializer_class(
+                    instance, data=op.get('data'), partial=True,
+                    context=context,
+                )
+                if serializer.is_valid():
+                    for attr, value in serializer.validated_data.items():
+                        setattr(instance, attr, value)
+                    target = (instance, list(serializer.validated_data))
+                else:
+                    result['errors'] = serializer.errors
+        results.append(result)
+        targets.append(target)
+    return results, targets
+
+
+def apply(model, serializer_class, operations, context, can_delete):
+    """操作をまとめて実行し、操作ごとの結果のリストを返す。
+
+    Parameters
+    ----------
+    model : Model
+        Income または Expense
+    serializer_class : Serializer
+        検証と結果の出力に使うシリアライザ
+    operations : list
+        {'op': 'create', 'data': {...}} / {'op': 'update', 'id': 1,
+        'data': {...}} / {'op': 'delete', 'id': 1} のリスト
+    context : dict
+        シリアライザに渡すコンテキスト
+    can_delete : callable
+        インスタンスを削除してよいか
+
+    Raises
+    ------
+    BatchError
+        誤りのある操作がある場合(何も変更しない)
+    """
+    with transaction.atomic(), journal.collect(), signals.collect():
+        results, targets = _validate(
+            model, serializer_class, operations, context, can_delete
+        )
+        if any('errors' in r for r in results):
+            raise BatchError(results)
+
+        creates, updates, deletes = [], [], []
+        update_fields = set()
+        for result, target in zip(results, targets):
+            if result['op'] == 'create':
+                creates.append(target)
+            elif result['op'] == 'update':
+                instance, fields = target
+                updates.append(instance)
+                update_fields.update(fields)
+            else:
+                deletes.append(target)
+
+        if creates:
+            model.objects.bulk_create(creates)
+            journal.record_created(model, creates)
+            signals.notify_inex_created(model, creates)
+        if updates and update_fields:
+            model.objects.bulk_update(updates, sorted(update_fields))
+            journal.record_updated(model, updates)
+            signals.notify_inex_changed(
+                model,
+                [o.loaded_value('pay_date') for o in updates]
+                + [o.pay_date for o in updates],
+                [(summaries.loaded_row(o), summaries.row(o)) for o in updates],
+            )
+        if deletes:
+            # 記録と通知は post_delete の受信側が行う(まとめて書く・送る)
+            model.objects.filter(pk__in=[o.pk for o in deletes]).delete()
+
+    # 結果の出力用に、作成・更新した行を関連ごと1回で読み直す
+    saved = model.objects.select_related(
+        'method__account__user', 'method__account__bank'
+    ).in_bulk([o.pk for o in creates] + [o.pk for o in updates])
+    for result, target in zip(results, targets):
+        if result['op'] == 'create':
+            result['id'] = target.pk
+        if result['op'] in ('create', 'update'):
+            result['data'] = serializer_class(
+                saved[result['id']], context=context
+            ).data
+    return results
@@ -30,6 +30,16 @@ const.SHOWN_NAME_UNDECIDED = '未定'
 const.SHOWN_NAME_DECIDED = '確定'
 const.SHOWN_NAME_CHANGE_TO = 'に変更'
 const.SHOWN_NAME_MEMO = 'メモ'
+const.SHOWN_NAME_BALANCE_SNAPSHOT = '月末残高スナップショット'
+const.SHOWN_NAME_MONTH_VERSION = '月別更新バージョン'
+const.SHOWN_NAME_ACCOUNT_LEDGER = '口座別残高台帳'
+const.SHOWN_NAME_MONTH_SUMMARY = '月別集計'
+const.SHOWN_NAME_JOB = 'ジョブ'
+const.SHOWN_NAME_JOB_QUEUED = '待機中'
+const.SHOWN_NAME_JOB_RUNNING = '実行中'
+const.SHOWN_NAME_JOB_FAILED = '失敗'
+const.SHOWN_NAME_STATE_TRANSITION = '状態の一括変更'
+const.SHOWN_NAME_INEX_CHANGE = '収支の変更履歴'
 
 const.PATH_NAME_INCOME = 'income_and_expense:income'
 const.PATH_NAME_EXPENSE = 'income_and_expense:expense'
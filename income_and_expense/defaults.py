@@ -0,0 +1,202 @@
+"""デフォルト収支・ローンからの収支の一括追加。
+
+追加元ごとに1クエリで取得し、各月の既存の名前と集合で突き合わせて、
+1回の bulk_create でまとめて登録する。複数月をまとめて処理する場合も
+クエリ数は月数によらない。登録せずに追加予定の行だけを求める plan_* は
+収支の予測にも使う。
+"""
+import collections
+import datetime
+
+from dateutil.relativedelta import relativedelta
+from django.db import transaction
+from django.db.models import Q
+
+from income_and_expense import journal, signals
+from income_and_expense.models import (
+    DefaultExpenseMonth, DefaultIncomeMonth, Expense, Income, Loan,
+)
+
+
+def _months(start_year, start_month, end_year, end_month):
+    """開始月から終了月までの各月の初日のリスト。"""
+    cur = datetime.date(start_year, start_month, 1)
+    end_first = datetime.date(end_year, end_month, 1)
+    months = []
+    while cur <= end_first:
+        months.append(cur)
+        cur = cur + relativedelta(months=1)
+    return months
+
+
+def _existing_names(model, months):
+    """月の初日をキー、その月に登録済みの名前の集合を値とする辞書。"""
+    last_date = months[-1] + relativedelta(months=1) - datetime.timedelta(days=1)
+    names = collections.defaultdict(set)
+    for pay_date, name in model.objects.filter(
+        pay_date__gte=months[0], pay_date__lte=last_date
+    ).values_list('pay_date', 'name'):
+        names[pay_date.replace(day=1)].add(name)
+    return names
+
+
+def _bulk_add(model, months, rows):
+    """まとめて登録し、月の初日をキーとする追加件数の辞書を返す。"""
+    added = {first_date: 0 for first_date in months}
+    for row in rows:
+        added[row.pay_date.replace(day=1)] += 1
+    if rows:
+        model.objects.bulk_create(rows)
+        journal.record_created(model, rows)
+        signals.notify_inex_created(model, rows)
+    return added
+
+
+def plan_incomes_from_default(months):
+    """デフォルトの収入から各月に追加すべき収入(未保存)のリストを返す。
+
+    各月に同じ名前の収入が既にあるものは含めない。
+    """
+    existing_names = _existing_names(Income, months)
+    def_incs = collections.defaultdict(list)
+    for dim in DefaultIncomeMonth.objects.filter(
+        month__in={m.month for m in months}
+    ).select_related('def_inc'):
+        def_incs[dim.month].append(dim.def_inc)
+
+    rows = []
+    for first_date in months:
+        names = existing_names[first_date]
+        for di in def_incs[first_date.month]:
+            if di.name in names:
+                continue
+            names.add(di.name)
+            rows.append(Income(
+                name=di.name,
+                pay_date=first_date.replace(day=di.pay_day),
+                method_id=di.method_id, amount=di.amount, state=di.state,
+            ))
+    return rows
+
+
+def plan_expenses_from_default_and_loan(months):
+    """デフォルトの支出とローンから各月に追加すべき支出(未保存)のリストを返す。
+
+    各月に同じ名前の支出が既にあるものは含めない。
+    """
+    start_year, start_month = months[0].year, months[0].month
+    end_year, end_month = months[-1].year, months[-1].month
+    existing_names = _existing_names(Expense, months)
+    def_exps = collections.defaultdict(list)
+    for dem in DefaultExpenseMonth.objects.filter(
+        month__in={m.month for m in months}
+    ).select_related('def_exp'):
+        def_exps[dem.month].append(dem.def_exp)
+    loans = list(Loan.objects.filter(
+        (Q(first_year__lt=end_year)
+         | Q(first_year=end_year, first_month__lte=end_month)),
+        (Q(last_year__gt=start_year)
+         | Q(last_year=start_year, last_month__gte=start_month))
+    ))
+
+    rows = []
+    for first_date in months:
+        year, month = first_date.year, first_date.month
+        names = existing_names[first_date]
+        for de in def_exps[month]:
+            if de.name in names:
+                continue
+            names.add(de.name)
+            rows.append(Expense(
+                name=de.name,
+                pay_date=first_date.replace(day=de.pay_day),
+                method_id=de.method_id, amount=de.amount, state=de.state,
+            ))
+        for loan in loans:
+            if not (
+                (loan.first_year, loan.first_month) <= (year, month)
+                <= (loan.last_year, loan.last_month)
+            ):
+                continue
+            if loan.name in names:
+                continue
+            names.add(loan.name)
+            if year == loan.first_year and month == loan.first_month:
+                amount = loan.amount_first
+            else:
+                amount = loan.amount_from_second
+            rows.append(Expense(
+                name=loan.name,
+                pay_date=first_date.replace(day=loan.pay_day),
+                method_id=loan.method_id, amount=amount, state=loan.state,
+            ))
+    return rows
+
+
+def add_incomes_from_default_range(start_year, start_month,
+                                   end_year, end_month):
+    """デフォルトの収入から開始月〜終了月の収入をまとめて追加する。
+
+    Returns
+    -------
+    dict
+        月の初日をキー、追加した収入の数を値とする辞書(月順)
+    """
+    months = _months(start_year, start_month, end_year, end_month)
+    if not months:
+        return {}
+    with transaction.atomic():
+        return _bulk_add(Income, months, plan_incomes_from_default(months))
+
+
+def add_expenses_from_default_and_loan_range(start_year, start_month,
+                                             end_year, end_month):
+    """デフォルトの支出とローンから開始月〜終了月の支出をまとめて追加する。
+
+    Returns
+    -------
+    dict
+        月の初日をキー、追加した支出の数を値とする辞書(月順)
+    """
+    months = _months(start_year, start_month, end_year, end_month)
+    if not months:
+        return {}
+    with transaction.atomic():
+        return _bulk_add(
+            Expense, months, plan_expenses_from_default_and_loan(months)
+        )
+
+
+def added_summary(added):
+    """add_*_range の戻り値を、合計と月別の件数の辞書にする。"""
+    return {
+        'added': sum(added.values()),
+        'months': [
+            {'year': d.year, 'month': d.month, 'added': n}
+            for d, n in added.items()
+        ],
+    }
+
+
+def add_incomes_from_default(year, month):
+    """デフォルトの収入から当月の収入を追加する。
+
+    Returns
+    -------
+    int
+        追加した収入の数
+    """
+    added = add_incomes_from_default_range(year, month, year, month)
+    return added[datetime.date(year, month, 1)]
+
+
+def add_expenses_from_default_and_loan(year, month):
+    """デフォルトの支出とローンから当月の支出を追加する。
+
+    Returns
+    -------
+    int
+        追加した支出の数
+    """
+    added = add_expenses_from_default_and_loan_range(year, month, year, month)
+    return added[datetime.date(year, month, 1)]
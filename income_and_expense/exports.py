@@ -0,0 +1,129 @@
+"""収入・支出・ローンの CSV / JSONL エクスポート。
+
+values_list() で必要な列だけを取得し、iterator(chunk_size=...) で少しずつ
+読みながら StreamingHttpResponse で送るため、件数によらずメモリ使用量は
+一定で、先頭の行からすぐに送信が始まる。
+
+CSV の文字列のうち = + - @ 等で始まるものは、表計算ソフトで数式として
+実行されないよう先頭に ' を付ける。
+"""
+import csv
+import datetime
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+CHUNK_SIZE = 2000
+
+FILE_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# (出力する列名, values_list() に渡す参照)
+INEX_COLUMNS = (
+    ('id', 'id'),
+    ('pay_date', 'pay_date'),
+    ('name', 'name'),
+    ('amount', 'amount'),
+    ('state', 'state'),
+    ('method_id', 'method_id'),
+    ('method', 'method__name'),
+    ('user', 'method__account__user__name'),
+    ('bank', 'method__account__bank__name'),
+    ('memo', 'memo'),
+)
+LOAN_COLUMNS = (
+    ('id', 'id'),
+    ('name', 'name'),
+    ('pay_day', 'pay_day'),
+    ('first_year', 'first_year'),
+    ('first_month', 'first_month'),
+    ('last_year', 'last_year'),
+    ('last_month', 'last_month'),
+    ('amount_first', 'amount_first'),
+    ('amount_from_second', 'amount_from_second'),
+    ('state', 'state'),
+    ('method_id', 'method_id'),
+    ('method', 'method__name'),
+    ('user', 'method__account__user__name'),
+    ('bank', 'method__account__bank__name'),
+)
+
+
+# 表計算ソフトが数式として扱う先頭の文字
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+class _ExportRenderer(BaseRenderer):
+    """エクスポートの Accept を受け付けるための renderer。
+
+    本文は streaming_response が作るため、描画するのはエラーの詳細だけ。
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+
+class CSVRenderer(_ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JSONLRenderer(_ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+
+
+class _Echo:
+    """csv.writer の書き込み先。書き込まれた文字列をそのまま返す。"""
+
+    def write(self, value):
+        return value
+
+
+def _json_default(value):
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError(repr(value))
+
+
+def _rows(queryset, columns):
+    lookups = [lookup for _, lookup in columns]
+    return queryset.values_list(*lookups).iterator(chunk_size=CHUNK_SIZE)
+
+
+def _csv_value(value):
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _csv_lines(queryset, columns):
+    writer = csv.writer(_Echo())
+    # Excel で文字化けしないよう BOM を付ける
+    yield '\ufeff' + writer.writerow([name for name, _ in columns])
+    for row in _rows(queryset, columns):
+        yield writer.writerow([_csv_value(value) for value in row])
+
+
+def _jsonl_lines(queryset, columns):
+    names = [name for name, _ in columns]
+    for row in _rows(queryset, columns):
+        yield json.dumps(
+            dict(zip(names, row)), ensure_ascii=False, default=_json_default
+        ) + '\n'
+
+
+def streaming_response(queryset, columns, file_type, filename):
+    """queryset を file_type('csv' / 'jsonl')でストリーミング出力する。"""
+    lines = _csv_lines if file_type == 'csv' else _jsonl_lines
+    response = StreamingHttpResponse(
+        lines(queryset, columns), content_type=FILE_TYPES[file_type]
+    )
+    response['Content-Disposition'] = 'attachment; filename="{0}.{1}"'.format(
+        filename, file_type
+    )
+    return response
@@ -0,0 +1,119 @@
+"""口座別の資金繰り予測。
+
+現在の口座残高(Account.balance)を起点に、未完了の収支と、まだ追加されて
+いないデフォルト収支・ローン(defaults.plan_*)を日付ごとの増減として
+集め、口座ごとに日付順に累計して残高の推移を求める。行は保存しない。
+
+残高が変わるのは収支のある日だけなので、日 × 口座の配列を作らず、
+増減のある日だけを走査する(予測期間の日数によらず、件数に比例する)。
+"""
+import collections
+import datetime
+
+from dateutil.relativedelta import relativedelta
+
+from income_and_expense import defaults
+from income_and_expense.models import (
+    Account, Expense, Income, Method, StateChoices,
+)
+
+MAX_MONTHS = 60
+
+
+def _pending(model, end_date):
+    """未完了の収支の (支払方法ID, 支払日, 金額)。"""
+    return model.objects.filter(
+        pay_date__lte=end_date,
+    ).exclude(state=StateChoices.DONE).values_list(
+        'method_id', 'pay_date', 'amount'
+    )
+
+
+def sweep(opening, deltas, start_date):
+    """増減を日付順に累計し、推移と最小残高・初めて負になった日を求める。
+
+    起点の残高が負の場合、初めて負になった日は start_date とする。
+    """
+    balance = opening
+    points = []
+    min_balance, min_date = opening, None
+    first_negative = start_date if opening < 0 else None
+    for date in sorted(deltas):
+        balance += deltas[date]
+        points.append({'date': date, 'balance': balance})
+        if balance < min_balance:
+            min_balance, min_date = balance, date
+        if balance < 0 and first_negative is None:
+            first_negative = date
+    return {
+        'opening_balance': opening,
+        'closing_balance': balance,
+        'min_balance': min_balance,
+        'min_date': min_date,
+        'first_negative_date': first_negative,
+        'points': points,
+    }
+
+
+def forecast(months, today):
+    """today から months か月分(当月を含む)の口座別の残高推移を返す。
+
+    期日を過ぎた未完了の収支は today に発生するものとして扱う。
+
+    Returns
+    -------
+    dict
+        start_date, end_date, accounts(口座ごとの推移)、
+        total(全口座合計の推移)
+    """
+    month_firsts = [
+        today.replace(day=1) + relativedelta(months=i) for i in range(months)
+    ]
+    end_date = (
+        month_firsts[-1] + relativedelta(months=1) - datetime.timedelta(days=1)
+    )
+    method_accounts = dict(Method.objects.values_list('id', 'account_id'))
+
+    # 口座ID -> 日付 -> 増減
+    deltas = collections.defaultdict(lambda: collections.defaultdict(int))
+
+    def add(method_id, pay_date, amount):
+        date = max(pay_date, today)
+        deltas[method_accounts[method_id]][date] += amount
+
+    for method_id, pay_date, amount in _pending(Income, end_date):
+        add(method_id, pay_date, amount)
+    for method_id, pay_date, amount in _pending(Expense, end_date):
+        add(method_id, pay_date, -amount)
+
+    # まだ追加されていない予定の収支(その日が過ぎたものは除く)
+    for row in defaults.plan_incomes_from_default(month_firsts):
+        if row.pay_date >= today:
+            add(row.method_id, row.pay_date, row.amount)
+    for row in defaults.plan_expenses_from_default_and_loan(month_firsts):
+        if row.pay_date >= today:
+            add(row.method_id, row.pay_date, -row.amount)
+
+    accounts = []
+    total_deltas = collections.defaultdict(int)
+    opening_total = 0
+    for account in Account.objects.select_related('user', 'bank').order_by(
+        'user__name', 'bank__name'
+    ):
+        account_deltas = deltas.get(account.id, {})
+        for date, amount in account_deltas.items():
+            total_deltas[date] += amount
+        opening_total += account.balance
+        accounts.append({
+            'id': account.id,
+            'bank': account.bank.name,
+            'user': account.user.name,
+            **sweep(account.balance, account_deltas, today),
+        })
+
+    return {
+        'start_date': today,
+        'end_date': end_date,
+        'accounts': accounts,
+        'total': sweep(opening_total, total_deltas, today),
+    }
@@ -0,0 +1,184 @@
+"""銀行・カードの明細 CSV からの収入・支出の一括取り込み。
+
+明細の列を支払日・名前・金額(・メモ)に対応付けて読み込み、
+支払日の検証(is_valid_pay_date と同じ基準)をまとめて行い、
+既存の収支と重複する行を除いてから、トランザクション内で
+bulk_create をまとめて実行する。
+"""
+import collections
+import csv
+import datetime
+import io
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from income_and_expense import journal, signals
+from income_and_expense.serializers import earliest_valid_pay_date
+
+BATCH_SIZE = 2000
+
+# 結果として返す誤りの最大件数
+MAX_REPORTED_ERRORS = 100
+
+# 金額の上限(金額の PositiveIntegerField がどのデータベースでも保存できる値)
+MAX_AMOUNT = 2147483647
+
+# 金額から取り除く記号
+_AMOUNT_NOISE = str.maketrans('', '', ',¥￥円 　')
+
+
+class StatementError(Exception):
+    """明細の内容に誤りがある。errors は (行番号, メッセージ) のリスト。"""
+
+    def __init__(self, errors):
+        super().__init__('明細に誤りがあります')
+        self.errors = errors
+
+
+def error_report(errors):
+    """誤りを件数と一覧(最大 MAX_REPORTED_ERRORS 件)の辞書にする。"""
+    return {
+        'error_count': len(errors),
+        'errors': [
+            {'line': line, 'message': message}
+            for line, message in errors[:MAX_REPORTED_ERRORS]
+        ],
+    }
+
+
+def _parse_amount(value):
+    try:
+        amount = Decimal(value.translate(_AMOUNT_NOISE))
+    except InvalidOperation:
+        raise ValueError('金額が数値ではありません: {0}'.format(value))
+    if not amount.is_finite():
+        raise ValueError('金額が数値ではありません: {0}'.format(value))
+    if amount != amount.to_integral_value():
+        raise ValueError('金額は整数で指定してください: {0}'.format(value))
+    if amount <= 0:
+        raise ValueError('金額は正の数で指定してください: {0}'.format(value))
+    if amount > MAX_AMOUNT:
+        raise ValueError(
+            '金額は{0:,}以下で指定してください: {1}'.format(MAX_AMOUNT, value)
+        )
+    return int(amount)
+
+
+def read_statement(fileobj, date_column, name_column, amount_column,
+                   memo_column=None, date_format='%Y-%m-%d',
+                   encoding='utf-8-sig'):
+    """明細 CSV を (行番号, 支払日, 名前, 金額, メモ) のリストにする。
+
+    Raises
+    ------
+    StatementError
+        列が見つからない、または値を解釈できない行がある場合
+    """
+    text = io.TextIOWrapper(fileobj, encoding=encoding, newline='')
+    try:
+        reader = csv.DictReader(text)
+        columns = [date_column, name_column, amount_column]
+        if memo_column:
+            columns.append(memo_column)
+        missing = [c for c in columns if c not in (reader.fieldnames or [])]
+        if missing:
+            raise StatementError(
+                [(1, '列がありません: {0}'.format(', '.join(missing)))]
+            )
+
+        rows = []
+        errors = []
+        # 1行目は見出し
+        for line, record in enumerate(reader, start=2):
+            # 見出しより列の少ない行は、足りない列の値が None になる
+            short = [c for c in columns if record[c] is None]
+            if short:
+                errors.append(
+                    (line, '値がありません: {0}'.format(', '.join(short)))
+                )
+                continue
+            try:
+                pay_date = datetime.datetime.strptime(
+                    record[date_column].strip(), date_format
+                ).date()
+                amount = _parse_amount(record[amount_column])
+            except ValueError as e:
+                errors.append((line, str(e)))
+                continue
+            name = record[name_column].strip()
+            if not name:
+                errors.append((line, '名前が空です'))
+                continue
+            memo = record[memo_column].strip() if memo_column else None
+            rows.append((line, pay_date, name, amount, memo or None))
+    except UnicodeDecodeError:
+        raise StatementError(
+            [(0, '文字コードが {0} ではありません'.format(encoding))]
+        )
+    finally:
+        # 呼び出し元のファイルを閉じない
+        text.detach()
+    if errors:
+        raise StatementError(errors)
+    return rows
+
+
+def import_statement(model, rows, method, state, dry_run=False):
+    """読み込んだ明細を model(Income / Expense)として登録する。
+
+    同じ支払日・名前・金額の収支が同じ支払方法に既にある行は重複として
+    除く(同じ内容の行が複数ある場合は、既存の件数分だけ除く)。
+
+    Returns
+    -------
+    dict
+        rows(明細の行数)、created(登録数)、duplicates(重複として除いた数)
+
+    Raises
+    ------
+    StatementError
+        1か月前より前の支払日の行、または名前が長すぎる行がある場合
+    """
+    earliest = earliest_valid_pay_date()
+    name_length = model._meta.get_field('name').max_length
+    errors = []
+    for line, pay_date, name, _, _ in rows:
+        if pay_date < earliest:
+            errors.append((line, '1か月前より前の日付は指定できません。'))
+        if len(name) > name_length:
+            # 切り詰めると別の収支と重複とみなすおそれがあるため誤りにする
+            errors.append((line, '名前は{0}文字以内で指定してください: {1}文字'
+                           .format(name_length, len(name))))
+    if errors:
+        raise StatementError(errors)
+
+    result = {'rows': len(rows), 'created': 0, 'duplicates': 0}
+    if not rows:
+        return result
+
+    with transaction.atomic():
+        dates = [pay_date for _, pay_date, _, _, _ in rows]
+        existing = collections.Counter(
+            model.objects.filter(
+                method=method,
+                pay_date__gte=min(dates), pay_date__lte=max(dates),
+            ).values_list('pay_date', 'name', 'amount')
+        )
+        objs = []
+        for _, pay_date, name, amount, memo in rows:
+            key = (pay_date, name, amount)
+            if existing[key]:
+                existing[key] -= 1
+                result['duplicates'] += 1
+                continue
+            objs.append(model(
+                name=name, pay_date=pay_date, method=method,
+                amount=amount, state=state, memo=memo,
+            ))
+        result['created'] = len(objs)
+        if objs and not dry_run:
+            model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+            journal.record_created(model, objs)
+            signals.notify_inex_created(model, objs)
+    return result
@@ -0,0 +1,293 @@
+"""データベースを使ったジョブの登録・取得・実行。
+
+重い処理(デフォルト収支の期間追加、明細の取り込み、一括完了、集計の
+作り直し)をリクエストの外で実行するため、Job の行として登録し、
+run_jobs コマンドのワーカーが取り出して実行する。外部のブローカーは
+使わない。
+
+取り出しは PostgreSQL では SELECT ... FOR UPDATE SKIP LOCKED で行い、
+状態を条件にした UPDATE で実行中にするため、ロックのない SQLite でも
+同じジョブが二重に実行されることはない。例外で失敗したジョブは
+max_attempts 回まで、間隔を倍にしながら再実行する。
+
+実行中はワーカーが HEARTBEAT_INTERVAL 秒ごとに heartbeat_at を更新し、
+requeue_stale はこれが途絶えたジョブ(ワーカーの異常終了等)だけを戻す。
+終了の保存は「取り出したワーカーで実行中のまま」を条件に行い、成功時は
+処理と同じトランザクションで保存するため、戻された後に古いワーカーが
+終わっても結果は上書きされず、処理の変更も取り消される。
+"""
+import contextlib
+import datetime
+import threading
+import traceback
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from income_and_expense import (
+    balances, defaults, imports, ledger, summaries, transitions,
+)
+from income_and_expense.models import (
+    Expense, Income, Job, JobStateChoices, Method,
+)
+
+# 再実行までの最初の待ち時間(秒)。以降は1回ごとに倍にする
+RETRY_DELAY = 30
+
+# 実行中のジョブの heartbeat_at を更新する間隔(秒)
+HEARTBEAT_INTERVAL = 30
+
+# 種類 -> 処理する関数(params をキーワード引数で受け取り、結果を返す)
+HANDLERS = {}
+
+# API から引数なしで登録できる保守用のジョブ
+MAINTENANCE_KINDS = (
+    'rebuild_balance_snapshots',
+    'rebuild_account_ledger',
+    'rebuild_month_summaries',
+)
+
+_INEX_MODELS = {
+    'income': Income,
+    'expense': Expense,
+}
+
+
+class JobFailed(Exception):
+    """再実行しても結果が変わらない失敗。result は結果として保存する値。"""
+
+    def __init__(self, message, result=None):
+        super().__init__(message)
+        self.result = result
+
+
+class _JobLost(Exception):
+    """実行中にジョブが戻された(他のワーカーに渡った)。"""
+
+
+def handler(kind):
+    """関数を kind のジョブを処理する関数として登録するデコレータ。"""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, params=None, max_attempts=3):
+    """ジョブを登録する。"""
+    if kind not in HANDLERS:
+        raise ValueError('未知のジョブです: {0}'.format(kind))
+    return Job.objects.create(
+        kind=kind, params=params or {}, max_attempts=max_attempts,
+        run_after=timezone.now(),
+    )
+
+
+def claim(worker):
+    """実行できるジョブを1件取り出して実行中にする。なければ None。"""
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(state=JobStateChoices.QUEUED, run_after__lte=now)
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        claimed = Job.objects.filter(
+            pk=job.pk, state=JobStateChoices.QUEUED
+        ).update(
+            state=JobStateChoices.RUNNING, worker=worker, started_at=now,
+            heartbeat_at=now, attempts=F('attempts') + 1,
+        )
+    if not claimed:
+        # 他のワーカーが先に取り出した
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def _running(job, condition=None):
+    """job が取り出したワーカーで実行中のままの場合だけ対象にする。"""
+    qs = Job.objects.filter(
+        pk=job.pk, state=JobStateChoices.RUNNING, worker=job.worker
+    )
+    if condition is not None:
+        qs = qs.filter(condition)
+    return qs
+
+
+def _finish(job, state, condition=None, **fields):
+    """終了を保存し、保存したかを返す。"""
+    return bool(_running(job, condition).update(
+        state=state, finished_at=timezone.now(), **fields
+    ))
+
+
+def _retry_or_fail(job, error, condition=None):
+    if job.attempts < job.max_attempts:
+        delay = RETRY_DELAY * 2 ** (job.attempts - 1)
+        return bool(_running(job, condition).update(
+            state=JobStateChoices.QUEUED, error=error,
+            run_after=timezone.now() + datetime.timedelta(seconds=delay),
+        ))
+    return _finish(job, JobStateChoices.FAILED, condition, error=error)
+
+
+@contextlib.contextmanager
+def _heartbeat(job):
+    """中にいる間、別スレッドで job の heartbeat_at を定期的に更新する。"""
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(HEARTBEAT_INTERVAL):
+                try:
+                    _running(job).update(heartbeat_at=timezone.now())
+                except DatabaseError:
+                    # 書き込みが競合した場合等は次の間隔で更新する
+                    pass
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run(job):
+    """取り出したジョブを実行し、結果・失敗を保存する。
+
+    実行中にジョブが戻された場合は処理の変更を取り消し、何も保存しない。
+    """
+    func = HANDLERS.get(job.kind)
+    try:
+        if func is None:
+            raise JobFailed('未知のジョブです: {0}'.format(job.kind))
+        with _heartbeat(job), transaction.atomic():
+            result = func(**job.params)
+            if not _finish(job, JobStateChoices.DONE, result=result, error=''):
+                raise _JobLost()
+    except _JobLost:
+        pass
+    except JobFailed as e:
+        _finish(job, JobStateChoices.FAILED, error=str(e), result=e.result)
+    except Exception:
+        _retry_or_fail(job, traceback.format_exc())
+
+
+def requeue_stale(timeout):
+    """timeout 秒を過ぎても heartbeat_at が更新されない実行中のジョブを戻す。
+
+    ワーカーの異常終了等で止まったジョブが対象で、時間のかかる処理でも
+    ワーカーが動いていれば戻さない。
+    """
+    limit = timezone.now() - datetime.timedelta(seconds=timeout)
+    stale_condition = (
+        Q(heartbeat_at__lt=limit)
+        | Q(heartbeat_at__isnull=True, started_at__lt=limit)
+    )
+    stale = Job.objects.filter(stale_condition, state=JobStateChoices.RUNNING)
+    count = 0
+    for job in stale:
+        # 読んだ後に heartbeat_at が更新されていれば戻さない
+        if _retry_or_fail(
+            job, '{0}秒以上応答がありませんでした'.format(timeout),
+            stale_condition,
+        ):
+            count += 1
+    return count
+
+
+def retry(job):
+    """失敗したジョブを、試行回数を戻して再登録する。"""
+    return Job.objects.filter(
+        pk=job.pk, state=JobStateChoices.FAILED
+    ).update(
+        state=JobStateChoices.QUEUED, attempts=0, error='', result=None,
+        run_after=timezone.now(), started_at=None, finished_at=None,
+    )
+
+
+@handler('add_incomes_default_range')
+def _add_incomes_default_range(start_year, start_month, end_year, end_month):
+    return defaults.added_summary(
+        defaults.add_incomes_from_default_range(
+            start_year, start_month, end_year, end_month
+        )
+    )
+
+
+@handler('add_expenses_default_range')
+def _add_expenses_default_range(start_year, start_month, end_year,
+                                end_month):
+    return defaults.added_summary(
+        defaults.add_expenses_from_default_and_loan_range(
+            start_year, start_month, end_year, end_month
+        )
+    )
+
+
+@handler('method_done')
+def _method_done(method, year, month):
+    first_date = datetime.date(year, month, 1)
+    return {
+        'updated': transitions.mark_method_done(
+            method, first_date, transitions.SOURCE_JOB
+        )
+    }
+
+
+@handler('import_statement')
+def _import_statement(model, rows, method, state, dry_run=False):
+    rows = [
+        (line, datetime.date.fromisoformat(pay_date), name, amount, memo)
+        for line, pay_date, name, amount, memo in rows
+    ]
+    try:
+        method = Method.objects.get(pk=method)
+    except Method.DoesNotExist:
+        raise JobFailed('支払方法が見つかりません')
+    try:
+        result = imports.import_statement(
+            _INEX_MODELS[model], rows, method, state, dry_run
+        )
+    except imports.StatementError as e:
+        raise JobFailed(str(e), imports.error_report(e.errors))
+    result['dry_run'] = dry_run
+    return result
+
+
+def statement_params(model, rows, method, state, dry_run):
+    """read_statement の結果を import_statement ジョブの params にする。"""
+    return {
+        'model': model._meta.model_name,
+        'rows': [
+            [line, pay_date.isoformat(), name, amount, memo]
+            for line, pay_date, name, amount, memo in rows
+        ],
+        'method': method.pk,
+        'state': state,
+        'dry_run': dry_run,
+    }
+
+
+@handler('rebuild_balance_snapshots')
+def _rebuild_balance_snapshots():
+    return {'created': balances.rebuild_snapshots()}
+
+
+@handler('rebuild_account_ledger')
+def _rebuild_account_ledger():
+    return {'created': ledger.rebuild_from(None)}
+
+
+@handler('rebuild_month_summaries')
+def _rebuild_month_summaries():
+    return {'created': summaries.rebuild()}
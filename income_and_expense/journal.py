@@ -0,0 +1,182 @@
+"""収入・支出の変更の記録(追記のみ)と、過去の時点の月の状態の再現。
+
+作成・更新・削除のたびに InexChange を1行追記する。data には差分だけを
+持つ(作成は全項目の値、更新は変更した項目の [変更前, 変更後]、削除は
+削除前の全項目の値)。変更前の値はモデルが読み込み時に保持している値
+(loaded_value)を使うため、記録のための読み込みは行わない。
+
+collect() の中の変更は溜めておき、抜けるときに1回の bulk_create で書く。
+一括処理(batches、defaults、imports、transitions)は collect() の中で行う。
+
+month_as_of() は、その月に入った記録のある行について時点までの記録を
+順に適用して、時点の月の行を再現する。記録の開始(マイグレーション 0025 で
+既存の行を作成として記録)より前の時点は再現できない。
+"""
+import contextlib
+import datetime
+import threading
+
+from django.utils import timezone
+
+from income_and_expense.models import InexChange
+
+OP_CREATE = 'c'
+OP_UPDATE = 'u'
+OP_DELETE = 'd'
+
+# 記録する項目(モデルの attname)
+FIELDS = ('name', 'pay_date', 'method_id', 'amount', 'state', 'memo')
+
+_local = threading.local()
+
+
+def _to_json(value):
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def _entry(model, row_id, op, pay_date, data):
+    return InexChange(
+        model=model._meta.model_name, row_id=row_id, op=op,
+        month=pay_date.replace(day=1), data=data,
+    )
+
+
+def _write(entries):
+    if not entries:
+        return
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is not None:
+        buffer.extend(entries)
+        return
+    now = timezone.now()
+    for entry in entries:
+        entry.created_at = now
+    if len(entries) == 1:
+        # 1件の保存・削除では bulk_create より軽い
+        entries[0].save(force_insert=True)
+    else:
+        InexChange.objects.bulk_create(entries)
+
+
+@contextlib.contextmanager
+def collect():
+    """中で記録した変更を、抜けるときに1回の INSERT でまとめて書く。
+
+    入れ子にした場合は一番外側で書く。例外で抜けた場合は書かない。
+    """
+    if getattr(_local, 'buffer', None) is not None:
+        yield
+        return
+    _local.buffer = []
+    try:
+        yield
+        entries = _local.buffer
+    finally:
+        _local.buffer = None
+    _write(entries)
+
+
+def _created_entry(model, obj):
+    return _entry(
+        model, obj.pk, OP_CREATE, obj.pay_date,
+        {f: _to_json(getattr(obj, f)) for f in FIELDS},
+    )
+
+
+def _updated_entry(model, obj):
+    data = {}
+    for f in FIELDS:
+        before = _to_json(obj.loaded_value(f))
+        after = _to_json(getattr(obj, f))
+        if before != after:
+            data[f] = [before, after]
+    if not data:
+        return None
+    return _entry(model, obj.pk, OP_UPDATE, obj.pay_date, data)
+
+
+def _deleted_entry(model, obj):
+    loaded = getattr(obj, '_loaded_values', {})
+    data = {
+        f: _to_json(loaded[f] if f in loaded else getattr(obj, f))
+        for f in FIELDS
+    }
+    return _entry(
+        model, obj.pk, OP_DELETE, loaded.get('pay_date', obj.pay_date), data
+    )
+
+
+def record_created(model, objs):
+    """作成した行(pk 設定済み)を記録する。"""
+    _write([_created_entry(model, obj) for obj in objs])
+
+
+def record_updated(model, objs):
+    """保存した行を、読み込み時点からの差分で記録する。"""
+    _write([
+        e for e in (_updated_entry(model, obj) for obj in objs)
+        if e is not None
+    ])
+
+
+def record_deleted(model, objs):
+    """削除した行を記録する。"""
+    _write([_deleted_entry(model, obj) for obj in objs])
+
+
+def record_states(model, rows, to_state):
+    """状態の一括変更を記録する。rows は (id, 支払日, 変更前の状態)。"""
+    _write([
+        _entry(
+            model, pk, OP_UPDATE, pay_date,
+            {'state': [old_state, to_state]},
+        )
+        for pk, pay_date, old_state in rows
+    ])
+
+
+def month_as_of(model, first_date, at):
+    """first_date の月の行を at の時点の状態で再現する。
+
+    Returns
+    -------
+    list of dict
+        id と FIELDS(pay_date は date)の辞書のリスト(支払日・id 順)
+    """
+    changes = InexChange.objects.filter(
+        model=model._meta.model_name, created_at__lte=at
+    )
+    row_ids = changes.filter(month=first_date).values('row_id')
+    rows = {}
+    for row_id, op, data in (
+        changes.filter(row_id__in=row_ids)
+        .order_by('id').values_list('row_id', 'op', 'data')
+    ):
+        if op == OP_CREATE:
+            rows[row_id] = dict(data)
+        elif op == OP_DELETE:
+            rows.pop(row_id, None)
+        elif row_id in rows:
+            rows[row_id].update(
+                (f, after) for f, (_, after) in data.items()
+            )
+
+    result = []
+    for row_id, data in rows.items():
+        pay_date = datetime.date.fromisoformat(data['pay_date'])
+        if pay_date.replace(day=1) != first_date:
+            continue
+        result.append({'id': row_id, **data, 'pay_date': pay_date})
+    result.sort(key=lambda r: (r['pay_date'], r['id']))
+    return result
+
+
+def history(model, row_id):
+    """行の変更の記録を古い順に返す。"""
+    return list(
+        InexChange.objects.filter(model=model._meta.model_name, row_id=row_id)
+        .order_by('id')
+        .values('op', 'data', 'created_at')
+    )
@@ -0,0 +1,267 @@
+"""口座別の残高台帳(日別の累計残高)の更新と参照。
+
+収支の変更時は、変更のあった日ごとに口座別の日の合計を集計し直し、
+変更のあった最初の日〜最後の日の行を作り直して、それより後の行には
+口座ごとの差分を加算する(変更のない日の増減は、その日の行と直前の行の
+差として台帳から求める)。
+対象の口座の行をロックしてから集計するため、同じ口座を並行して変更する
+トランザクションは順に反映される。支払方法の口座の付け替え等は
+rebuild_from で作り直す。ある日時点の残高は (口座, 日付) のインデックスで
+直前の行を引くだけで求まる。
+"""
+import collections
+
+from django.db import transaction
+from django.db.models import (
+    BigIntegerField, Case, F, OuterRef, Q, Subquery, Sum, Value, When,
+)
+
+from income_and_expense.models import (
+    Account, AccountLedger, Expense, Income, StateChoices,
+)
+
+def _daily_sums(model, start_date=None, dates=None, accounts=None):
+    """(口座ID, 日付) ごとの合計(全状態, 完了分)。"""
+    qs = model.objects.all()
+    if start_date is not None:
+        qs = qs.filter(pay_date__gte=start_date)
+    if dates is not None:
+        qs = qs.filter(pay_date__in=dates)
+    if accounts is not None:
+        qs = qs.filter(method__account__in=accounts)
+    rows = (
+        qs.values('method__account', 'pay_date')
+        .annotate(
+            total=Sum('amount'),
+            done=Sum('amount', filter=Q(state=StateChoices.DONE)),
+        )
+        .order_by()
+    )
+    return {
+        (r['method__account'], r['pay_date']): (r['total'], r['done'] or 0)
+        for r in rows
+    }
+
+
+def _latest(date_filter):
+    """各口座の、条件を満たす最新の台帳の行の値を注釈した Account の QuerySet。"""
+    latest = AccountLedger.objects.filter(
+        date_filter, account=OuterRef('pk')
+    ).order_by('-date')
+    return Account.objects.annotate(
+        ledger_balance=Subquery(latest.values('balance')[:1]),
+        ledger_balance_done=Subquery(latest.values('balance_done')[:1]),
+    )
+
+
+def _lock_accounts(account_ids=None):
+    """口座の行をロックする(None ならすべて)。ロックした口座IDのリスト。"""
+    qs = Account.objects.select_for_update().order_by('pk')
+    if account_ids is not None:
+        qs = qs.filter(pk__in=account_ids)
+    return list(qs.values_list('pk', flat=True))
+
+
+def _day_deltas(dates, accounts):
+    """(口座ID, 日付) ごとの日の増減(全状態, 完了分)を収支から集計する。"""
+    deltas = collections.defaultdict(lambda: [0, 0])
+    for sign, model in ((1, Income), (-1, Expense)):
+        for key, (total, done) in _daily_sums(
+            model, dates=dates, accounts=accounts
+        ).items():
+            deltas[key][0] += sign * total
+            deltas[key][1] += sign * done
+    return deltas
+
+
+def rebuild_from(start_date=None):
+    """start_date 以降(None なら全期間)の台帳を作り直す。作成件数を返す。"""
+    with transaction.atomic():
+        _lock_accounts()
+        running = {}
+        if start_date is not None:
+            for a in _latest(Q(date__lt=start_date)):
+                running[a.pk] = [
+                    a.ledger_balance or 0, a.ledger_balance_done or 0
+                ]
+
+        deleted = AccountLedger.objects.all()
+        if start_date is not None:
+            deleted = deleted.filter(date__gte=start_date)
+        deleted.delete()
+
+        deltas = collections.defaultdict(lambda: [0, 0])
+        for sign, model in ((1, Income), (-1, Expense)):
+            for key, (total, done) in _daily_sums(model, start_date).items():
+                deltas[key][0] += sign * total
+                deltas[key][1] += sign * done
+
+        rows = []
+        for (account_id, date), (total, done) in sorted(deltas.items()):
+            balance = running.setdefault(account_id, [0, 0])
+            balance[0] += total
+            balance[1] += done
+            rows.append(AccountLedger(
+                account_id=account_id, date=date,
+                balance=balance[0], balance_done=balance[1],
+            ))
+        AccountLedger.objects.bulk_create(rows, batch_size=2000)
+        return len(rows)
+
+
+def _shift_after(shifts):
+    """口座ごとに、変更範囲より後の行に加える差分の式。"""
+    return Case(
+        *[
+            When(account_id=account_id, then=Value(shift))
+            for account_id, shift in shifts.items()
+        ],
+        default=Value(0), output_field=BigIntegerField(),
+    )
+
+
+def apply_changes(dates):
+    """dates の日の収支の変更を台帳に反映する。
+
+    変更のあった最初の日〜最後の日の行は、直前の行と保存済みの行の差
+    (変更のない日)・集計し直した値(変更のあった日)から作り直し、それより
+    後の行には口座ごとの差分を1回の UPDATE で加える。クエリ数は日数・口座数
+    によらない。
+
+    Parameters
+    ----------
+    dates : iterable of date
+        変更のあった収支の支払日(変更前後)
+    """
+    dates = sorted({d for d in dates if d is not None})
+    if not dates:
+        return
+    first, last = dates[0], dates[-1]
+    with transaction.atomic():
+        touched = set(
+            AccountLedger.objects.filter(date__in=dates)
+            .values_list('account', flat=True)
+        )
+        for model in (Income, Expense):
+            touched.update(
+                model.objects.filter(pay_date__in=dates)
+                .values_list('method__account', flat=True)
+            )
+        # ロックの後に集計し、先に確定した変更を含む値で差分を求める
+        accounts = _lock_accounts(touched)
+        if not accounts:
+            return
+        new = _day_deltas(dates, accounts)
+        base = {
+            a.pk: (a.ledger_balance or 0, a.ledger_balance_done or 0)
+            for a in _latest(Q(date__lt=first)).filter(pk__in=accounts)
+        }
+        stored = collections.defaultdict(dict)
+        in_range = AccountLedger.objects.filter(
+            account__in=accounts, date__gte=first, date__lte=last
+        )
+        for account_id, date, balance, balance_done in in_range.values_list(
+            'account', 'date', 'balance', 'balance_done'
+        ):
+            stored[account_id][date] = (balance, balance_done)
+
+        changed = set(dates)
+        rows = []
+        shifts = {}
+        for account_id in accounts:
+            old_rows = stored[account_id]
+            running = old_prev = base.get(account_id, (0, 0))
+            for date in sorted(changed | old_rows.keys()):
+                old = old_rows.get(date)
+                if date in changed:
+                    day = new.get((account_id, date))
+                else:
+                    day = (old[0] - old_prev[0], old[1] - old_prev[1])
+                if old is not None:
+                    old_prev = old
+                if day is None:
+                    # その日の収支がない(なくなった)
+                    continue
+                running = (running[0] + day[0], running[1] + day[1])
+                rows.append(AccountLedger(
+                    account_id=account_id, date=date,
+                    balance=running[0], balance_done=running[1],
+                ))
+            shift = (running[0] - old_prev[0], running[1] - old_prev[1])
+            if shift != (0, 0):
+                shifts[account_id] = shift
+
+        in_range.delete()
+        AccountLedger.objects.bulk_create(rows)
+        if shifts:
+            AccountLedger.objects.filter(
+                account__in=shifts, date__gt=last
+            ).update(
+                balance=F('balance') + _shift_after(
+                    {a: s[0] for a, s in shifts.items()}
+                ),
+                balance_done=F('balance_done') + _shift_after(
+                    {a: s[1] for a, s in shifts.items()}
+                ),
+            )
+
+
+def balances_as_of_queryset(date):
+    """balances_as_of の QuerySet(台帳の値を注釈した Account)。"""
+    return _latest(Q(date__lte=date))
+
+
+def balances_as_of(date):
+    """指定日時点の各口座の残高を、口座IDをキーに (全状態, 完了分) で返す。"""
+    return {
+        a.pk: (a.ledger_balance or 0, a.ledger_balance_done or 0)
+        for a in balances_as_of_queryset(date)
+    }
+
+
+def balance_as_of(account, date):
+    """指定日時点の口座の残高を (全状態, 完了分) で返す。"""
+    row = (
+        AccountLedger.objects
+        .filter(account=account, date__lte=date)
+        .order_by('-date')
+        .values_list('balance', 'balance_done')
+        .first()
+    )
+    return row or (0, 0)
+
+
+def check():
+    """保存済みの台帳と全期間の再計算結果を比較し、不一致の行を返す。
+
+    Returns
+    -------
+    list of dict
+        account, date, balance, balance_done, expected_balance,
+        expected_balance_done(台帳にない・余分な行は値が None)
+    """
+    with transaction.atomic():
+        stored = {
+            (r.account_id, r.date): (r.balance, r.balance_done)
+            for r in AccountLedger.objects.all()
+        }
+        rebuild_from(None)
+        expected = {
+            (r.account_id, r.date): (r.balance, r.balance_done)
+            for r in AccountLedger.objects.all()
+        }
+        # 比較のために作り直した分は元に戻す
+        transaction.set_rollback(True)
+
+    mismatches = []
+    for key in sorted(stored.keys() | expected.keys()):
+        got = stored.get(key, (None, None))
+        want = expected.get(key, (None, None))
+        if got != want:
+            mismatches.append({
+                'account': key[0], 'date': key[1],
+                'balance': got[0], 'balance_done': got[1],
+                'expected_balance': want[0],
+                'expected_balance_done': want[1],
+            })
+    return mismatches
@@ -0,0 +1,156 @@
+"""ローンの返済スケジュール。
+
+ローンは初回・最終の年月と、初回・2回目以降の返済額だけを持つ。
+返済は初回の月から最終の月まで毎月 pay_day に行われるものとして、
+返済の一覧は必要な分だけジェネレータで展開し、期間内の返済額や
+返済済み・残りの集計は返済回数からの計算で求める(返済ごとの行は
+作らず、ローンの件数に比例する1回の走査で済む)。
+"""
+import datetime
+
+
+def month_index(year, month):
+    """年月を通し番号(月数)にする。"""
+    return year * 12 + month - 1
+
+
+def _from_index(index):
+    return index // 12, index % 12 + 1
+
+
+def _first_index(loan):
+    return month_index(loan.first_year, loan.first_month)
+
+
+def _last_index(loan):
+    return month_index(loan.last_year, loan.last_month)
+
+
+def _amount(loan, index):
+    if index == _first_index(loan):
+        return loan.amount_first
+    return loan.amount_from_second
+
+
+def _range_sum(loan, start, end):
+    """start〜end 月(通し番号、両端を含む)の返済の (回数, 金額)。"""
+    first, last = _first_index(loan), _last_index(loan)
+    lo, hi = max(first, start), min(last, end)
+    if lo > hi:
+        return 0, 0
+    count = hi - lo + 1
+    amount = count * loan.amount_from_second
+    if lo == first:
+        amount += loan.amount_first - loan.amount_from_second
+    return count, amount
+
+
+def _paid_until(loan, date):
+    """date 時点で返済日を迎えた最後の月の通し番号。"""
+    index = month_index(date.year, date.month)
+    return index if date.day >= loan.pay_day else index - 1
+
+
+def payments(loan, start_first=None, end_first=None):
+    """返済を (返済日, 金額) で順に返すジェネレータ。
+
+    Parameters
+    ----------
+    loan : Loan
+        ローン
+    start_first, end_first : date
+        対象とする月の初日(省略時はローンの初回・最終の月)
+    """
+    start = _first_index(loan)
+    end = _last_index(loan)
+    if start_first is not None:
+        start = max(start, month_index(start_first.year, start_first.month))
+    if end_first is not None:
+        end = min(end, month_index(end_first.year, end_first.month))
+    for index in range(start, end + 1):
+        year, month = _from_index(index)
+        yield datetime.date(year, month, loan.pay_day), _amount(loan, index)
+
+
+def progress(loans, date):
+    """各ローンの date 時点の返済済み・残りの回数と金額を返す。
+
+    返済日が date 以前の回を返済済みとする。
+
+    Returns
+    -------
+    dict
+        loans(ローンごとの内訳)と、全ローン合計の paid_amount /
+        remaining_amount
+    """
+    rows = []
+    paid_sum = remaining_sum = 0
+    for loan in loans:
+        total_count, total_amount = _range_sum(
+            loan, _first_index(loan), _last_index(loan)
+        )
+        paid_count, paid_amount = _range_sum(
+            loan, _first_index(loan), _paid_until(loan, date)
+        )
+        paid_sum += paid_amount
+        remaining_sum += total_amount - paid_amount
+        rows.append({
+            'loan': loan,
+            'total_count': total_count,
+            'total_amount': total_amount,
+            'paid_count': paid_count,
+            'paid_amount': paid_amount,
+            'remaining_count': total_count - paid_count,
+            'remaining_amount': total_amount - paid_amount,
+        })
+    return {
+        'loans': rows,
+        'paid_amount': paid_sum,
+        'remaining_amount': remaining_sum,
+    }
+
+
+def remaining_total(loans, date):
+    """date 時点の全ローンの残りの返済額の合計。"""
+    return progress(loans, date)['remaining_amount']
+
+
+def between(loans, start_first, end_first):
+    """start_first〜end_first の月の返済を、ローン別・月別に集計する。
+
+    月別の合計は、各ローンの返済期間の始まりと終わりに増減を置いて
+    累積する(ローン数 + 月数に比例する)。
+
+    Returns
+    -------
+    dict
+        loans(ローンごとの回数・金額)、months(月ごとの金額)、amount(合計)
+    """
+    start = month_index(start_first.year, start_first.month)
+    end = month_index(end_first.year, end_first.month)
+    # 月ごとの返済額の増減(2回目以降の額の開始・終了と、初回の差額)
+    deltas = [0] * (end - start + 2)
+    rows = []
+    amount_sum = 0
+    for loan in loans:
+        count, amount = _range_sum(loan, start, end)
+        if not count:
+            continue
+        lo = max(_first_index(loan), start)
+        hi = min(_last_index(loan), end)
+        deltas[lo - start] += loan.amount_from_second
+        deltas[hi - start + 1] -= loan.amount_from_second
+        if lo == _first_index(loan):
+            diff = loan.amount_first - loan.amount_from_second
+            deltas[lo - start] += diff
+            deltas[lo - start + 1] -= diff
+        amount_sum += amount
+        rows.append({'loan': loan, 'count': count, 'amount': amount})
+
+    months = []
+    running = 0
+    for offset in range(end - start + 1):
+        running += deltas[offset]
+        year, month = _from_index(start + offset)
+        months.append({'year': year, 'month': month, 'amount': running})
+    return {'loans': rows, 'months': months, 'amount': amount_sum}
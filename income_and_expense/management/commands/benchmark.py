@@ -0,0 +1,344 @@
+import datetime
+import json
+import math
+import time
+
+from dateutil.relativedelta import relativedelta
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import (
+    CaptureQueriesContext, setup_test_environment, teardown_test_environment,
+)
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from income_and_expense import jobs, sampledata
+from income_and_expense.models import (
+    Account, DefaultExpense, DefaultIncome, Expense, Income, Loan, Method,
+    StateChoices,
+)
+
+# 計測しない API(URL 名 -> 理由)。これ以外の API が計測対象にない場合は
+# エラーにする
+UNMEASURED_API = {
+    'api:job-retry': '失敗したジョブにしか使えず、繰り返すと結果が変わる',
+    'api:job-maintenance': '管理者のみで、実行のたびにジョブを登録する',
+    'api:metrics': '管理者のみ',
+}
+
+# 明細の取り込み(dry_run)の行数
+IMPORT_ROWS = 100
+
+
+def _percentile(values, p):
+    """最近順位法によるパーセンタイル。"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def _api_url_names():
+    """api 名前空間の URL 名('api:...')。"""
+    _, resolver = get_resolver().namespace_dict['api']
+    return {
+        'api:' + name for name in resolver.reverse_dict
+        if isinstance(name, str)
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'ダミーの家計データを投入し、API と画面の各エンドポイントの'
+        '応答時間(p50/p95)とクエリ数を JSON で出力する'
+        '(投入データは最後にロールバックされる)。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2,
+                            help='利用者数')
+        parser.add_argument('--years', type=int, default=3,
+                            help='当月までの過去データの年数')
+        parser.add_argument('--incomes-per-month', type=int, default=2,
+                            help='毎月の変動収入の件数')
+        parser.add_argument('--expenses-per-month', type=int, default=60,
+                            help='毎月の変動費の件数')
+        parser.add_argument('--loans', type=int, default=2,
+                            help='ローンの数')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='エンドポイントごとの計測回数')
+        parser.add_argument('--warmup', type=int, default=2,
+                            help='計測前に捨てる実行回数')
+        parser.add_argument('--label', default='',
+                            help='結果に含めるラベル(コミット ID 等)')
+        parser.add_argument('--output', help='結果の出力先ファイル')
+
+    def handle(self, *args, **options):
+        today = datetime.date.today()
+        # テストクライアントのホスト(testserver)を許可する
+        setup_test_environment()
+        try:
+            with transaction.atomic():
+                counts = sampledata.seed_household(
+                    users=options['users'],
+                    years=options['years'],
+                    incomes_per_month=options['incomes_per_month'],
+                    expenses_per_month=options['expenses_per_month'],
+                    loans=options['loans'],
+                    today=today,
+                    prefix='benchmark-',
+                )
+                client = APIClient()
+                client.force_login(get_user_model().objects.create_user(
+                    'benchmark-{0}'.format(time.time_ns())
+                ))
+                results = [
+                    self._measure(client, name, method, url, body,
+                                  options['repeat'], options['warmup'])
+                    for name, method, url, body in self._endpoints(today)
+                ]
+                transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+
+        report = {
+            'label': options['label'],
+            'vendor': connection.vendor,
+            'date': today.isoformat(),
+            'repeat': options['repeat'],
+            'rows': counts,
+            'results': results,
+        }
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(text + '\n')
+        else:
+            self.stdout.write(text)
+
+    def _measure(self, client, name, method, url, body, repeat, warmup):
+        request = getattr(client, method.lower())
+
+        def call():
+            response = request(url, **(body() if body else {}))
+            if response.streaming:
+                # ストリーミング出力は本文を読み終えるまでを計測する
+                b''.join(response.streaming_content)
+            return response
+
+        for _ in range(warmup):
+            call()
+        timings = []
+        queries = 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                response = call()
+                timings.append((time.perf_counter() - start) * 1000)
+            queries = max(queries, len(ctx.captured_queries))
+        return {
+            'name': name,
+            'method': method,
+            'url': url,
+            'status': response.status_code,
+            'p50_ms': round(_percentile(timings, 50), 3),
+            'p95_ms': round(_percentile(timings, 95), 3),
+            'queries': queries,
+        }
+
+    def _endpoints(self, today):
+        """計測対象の (名前, メソッド, URL, 本文)。
+
+        本文はリクエストの引数を返す関数(なければ None)。更新系は繰り返しても
+        結果が変わらないもの(一括追加・完了、既存の値での一括更新、
+        dry_run の取り込み)だけを含める。UNMEASURED_API 以外の API が
+        含まれていない場合は CommandError にする。
+        """
+        y, m = today.year, today.month
+        ym = 'year={0}&month={1}'.format(y, m)
+        first = today.replace(day=1)
+        last = first + relativedelta(months=1) - datetime.timedelta(days=1)
+        range_end = first + relativedelta(months=2)
+        prefix = {'name__startswith': 'benchmark-'}
+        income = Income.objects.filter(
+            pay_date__gte=first, pay_date__lte=last, **prefix
+        ).first()
+        expense = Expense.objects.filter(
+            pay_date__gte=first, pay_date__lte=last, **prefix
+        ).first()
+        account = Account.objects.filter(
+            user__name__startswith='benchmark-'
+        ).first()
+        method = Method.objects.filter(
+            account__user__name__startswith='benchmark-'
+        ).first()
+        loan = Loan.objects.filter(**prefix).first()
+        def_inc = DefaultIncome.objects.filter(**prefix).first()
+        def_exp = DefaultExpense.objects.filter(**prefix).first()
+        range_query = (
+            'start_year={0}&start_month={1}&end_year={2}&end_month={3}'
+        ).format(y, m, range_end.year, range_end.month)
+        date_range = 'date_from={0}&date_to={1}'.format(first, last)
+        at = 'at={0}&'.format(timezone.now().isoformat()).replace('+', '%2B')
+        job = jobs.enqueue('rebuild_month_summaries')
+
+        def batch(obj):
+            return lambda: {'format': 'json', 'data': {'operations': [
+                {'op': 'update', 'id': obj.pk, 'data': {'amount': obj.amount}}
+            ]}}
+
+        def month_done():
+            return {'format': 'json', 'data': {
+                'to_state': StateChoices.DONE, 'year': y, 'month': m,
+                'method': method.pk,
+            }}
+
+        statement = 'date,name,amount\n' + ''.join(
+            '{0},benchmark-import-{1},{2}\n'.format(first, i, 1000 + i)
+            for i in range(IMPORT_ROWS)
+        )
+
+        def import_statement():
+            return {'format': 'multipart', 'data': {
+                'file': SimpleUploadedFile(
+                    'statement.csv', statement.encode('utf-8'), 'text/csv'
+                ),
+                'method': method.pk,
+                'dry_run': True,
+            }}
+
+        api = [
+            ('api:income-list', 'GET', reverse('api:income-list') + '?' + ym),
+            ('api:income-list (page_size=50)', 'GET',
+             reverse('api:income-list') + '?page_size=50&' + ym),
+            ('api:income-detail', 'GET',
+             reverse('api:income-detail', args=(income.pk,))),
+            ('api:income-add-defaults', 'POST',
+             reverse('api:income-add-defaults') + '?' + ym),
+            ('api:income-add-defaults-range', 'POST',
+             reverse('api:income-add-defaults-range') + '?' + range_query),
+            ('api:expense-list', 'GET', reverse('api:expense-list') + '?' + ym),
+            ('api:expense-list (page_size=50)', 'GET',
+             reverse('api:expense-list') + '?page_size=50&' + ym),
+            ('api:expense-detail', 'GET',
+             reverse('api:expense-detail', args=(expense.pk,))),
+            ('api:expense-add-defaults', 'POST',
+             reverse('api:expense-add-defaults') + '?' + ym),
+            ('api:expense-add-defaults-range', 'POST',
+             reverse('api:expense-add-defaults-range') + '?' + range_query),
+            ('api:income-export', 'GET',
+             reverse('api:income-export') + '?' + date_range),
+            ('api:expense-export', 'GET',
+             reverse('api:expense-export') + '?' + date_range),
+            ('api:expense-export (jsonl)', 'GET',
+             reverse('api:expense-export') + '?file_type=jsonl&' + date_range),
+            ('api:income-import-statement (dry_run)', 'POST',
+             reverse('api:income-import-statement'), import_statement),
+            ('api:expense-import-statement (dry_run)', 'POST',
+             reverse('api:expense-import-statement'), import_statement),
+            ('api:income-batch', 'POST', reverse('api:income-batch'),
+             batch(income)),
+            ('api:expense-batch', 'POST', reverse('api:expense-batch'),
+             batch(expense)),
+            ('api:income-transition', 'POST',
+             reverse('api:income-transition'), month_done),
+            ('api:expense-transition', 'POST',
+             reverse('api:expense-transition'), month_done),
+            ('api:income-as-of', 'GET',
+             reverse('api:income-as-of') + '?' + at + ym),
+            ('api:expense-as-of', 'GET',
+             reverse('api:expense-as-of') + '?' + at + ym),
+            ('api:income-history', 'GET',
+             reverse('api:income-history', args=(income.pk,))),
+            ('api:expense-history', 'GET',
+             reverse('api:expense-history', args=(expense.pk,))),
+            ('api:account-list', 'GET', reverse('api:account-list')),
+            ('api:account-detail', 'GET',
+             reverse('api:account-detail', args=(account.pk,))),
+            ('api:account-ledger', 'GET',
+             reverse('api:account-ledger', args=(account.pk,))
+             + '?' + date_range),
+            ('api:account-balances-as-of', 'GET',
+             reverse('api:account-balances-as-of') + '?date={0}'.format(last)),
+            ('api:loan-list', 'GET', reverse('api:loan-list')),
+            ('api:loan-detail', 'GET',
+             reverse('api:loan-detail', args=(loan.pk,))),
+            ('api:loan-export', 'GET',
+             reverse('api:loan-export') + '?' + date_range),
+            ('api:loan-schedule', 'GET',
+             reverse('api:loan-schedule', args=(loan.pk,))),
+            ('api:loan-progress', 'GET', reverse('api:loan-progress')),
+            ('api:loan-between', 'GET',
+             reverse('api:loan-between') + '?' + range_query),
+            ('api:job-list', 'GET', reverse('api:job-list')),
+            ('api:job-detail', 'GET',
+             reverse('api:job-detail', args=(job.pk,))),
+            ('api:default-income-list', 'GET',
+             reverse('api:default-income-list')),
+            ('api:default-income-detail', 'GET',
+             reverse('api:default-income-detail', args=(def_inc.pk,))),
+            ('api:default-expense-list', 'GET',
+             reverse('api:default-expense-list')),
+            ('api:default-expense-detail', 'GET',
+             reverse('api:default-expense-detail', args=(def_exp.pk,))),
+            ('api:method-list', 'GET', reverse('api:method-list')),
+            ('api:template-expense-list', 'GET',
+             reverse('api:template-expense-list')),
+            ('api:method-done', 'POST',
+             reverse('api:method-done', args=(method.pk,)) + '?' + ym),
+            ('api:balance', 'GET', reverse('api:balance') + '?' + ym),
+            ('api:trends', 'GET',
+             reverse('api:trends') + '?months=12&end_year={0}&end_month={1}'
+             .format(y, m)),
+            ('api:forecast', 'GET', reverse('api:forecast') + '?months=60'),
+            ('api:search', 'GET', reverse('api:search') + '?q=benchmark'),
+            ('api:account-require', 'GET',
+             reverse('api:account-require') + '?' + ym),
+            ('api:account-shortfall', 'GET',
+             reverse('api:account-shortfall') + '?' + ym),
+            ('api:method-require', 'GET',
+             reverse('api:method-require') + '?' + ym),
+            ('api:api-root', 'GET', reverse('api:api-root')),
+        ]
+        missing = _api_url_names() - set(UNMEASURED_API) - {
+            name.split(' ')[0] for name, *_ in api
+        }
+        if missing:
+            raise CommandError('計測対象にない API があります: {0}'.format(
+                ', '.join(sorted(missing))
+            ))
+
+        def page(name, *args):
+            return (
+                'income_and_expense:' + name, 'GET',
+                reverse('income_and_expense:' + name, args=args), None,
+            )
+
+        pages = [
+            page('index'),
+            ('income_and_expense:move_another_page', 'GET',
+             reverse('income_and_expense:move_another_page')
+             + '?path_name=income_and_expense:income&' + ym, None),
+            page('login'),
+            page('income', y, m),
+            page('create_inc', y, m),
+            page('update_inc', y, m, income.pk),
+            page('delete_inc', y, m, income.pk),
+            page('add_default_incs', y, m),
+            page('expense', y, m),
+            page('create_exp', y, m),
+            page('update_exp', y, m, expense.pk),
+            page('delete_exp', y, m, expense.pk),
+            page('add_default_exps', y, m),
+            page('balance', y, m),
+            page('update_balance', y, m, account.pk),
+            page('account_require', y, m),
+            page('method_require', y, m),
+            page('method_done', y, m, method.pk),
+            page('loan', y, m),
+            page('create_loan', y, m),
+            page('update_loan', y, m, loan.pk),
+            page('delete_loan', y, m, loan.pk),
+        ]
+        return [(*endpoint, None)[:4] for endpoint in api] + pages
@@ -0,0 +1,133 @@
+import datetime
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from income_and_expense.models import (
+    Account, Bank, Expense, Method, StateChoices, User,
+)
+from income_and_expense.pagination import INEX_ORDERING
+from income_and_expense.serializers import (
+    CompactInexSerializer, ExpenseSerializer,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        '1か月分の支出を投入し、一覧の取得とシリアライズの速度(行/秒)を'
+        '従来のシリアライザと CompactInexSerializer で比較して JSON で出力する'
+        '(投入データは最後にロールバックされる)。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='投入する支出の件数')
+        parser.add_argument('--methods', type=int, default=20,
+                            help='支払方法の数')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='計測回数(最良値を採る)')
+        parser.add_argument('--label', default='',
+                            help='結果に含めるラベル(コミット ID 等)')
+        parser.add_argument('--output', help='結果の出力先ファイル')
+
+    def handle(self, *args, **options):
+        first_date = datetime.date(2000, 1, 1)
+        with transaction.atomic():
+            self._seed(first_date, options['rows'], options['methods'])
+            qs = Expense.objects.filter(
+                pay_date__gte=first_date,
+                pay_date__lte=first_date.replace(day=28),
+            ).order_by(*INEX_ORDERING)
+
+            def model_serializer():
+                return ExpenseSerializer(
+                    qs.select_related(
+                        'method__account__user', 'method__account__bank'
+                    ),
+                    many=True,
+                ).data
+
+            def compact_serializer():
+                return CompactInexSerializer(
+                    qs.values(*CompactInexSerializer.VALUES), many=True
+                ).data
+
+            before, before_data = self._measure(
+                model_serializer, options['repeat']
+            )
+            after, after_data = self._measure(
+                compact_serializer, options['repeat']
+            )
+            transaction.set_rollback(True)
+
+        identical = (
+            json.dumps(before_data, ensure_ascii=False)
+            == json.dumps(after_data, ensure_ascii=False)
+        )
+        rows = len(after_data)
+        report = {
+            'label': options['label'],
+            'vendor': connection.vendor,
+            'rows': rows,
+            'repeat': options['repeat'],
+            'identical': identical,
+            'results': [
+                {
+                    'name': name,
+                    'best_ms': round(seconds * 1000, 3),
+                    'rows_per_second': round(rows / seconds),
+                }
+                for name, seconds in (
+                    ('ExpenseSerializer', before),
+                    ('CompactInexSerializer', after),
+                )
+            ],
+            'speedup': round(before / after, 2),
+        }
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(text + '\n')
+        else:
+            self.stdout.write(text)
+        if not identical:
+            raise CommandError('2つのシリアライザの出力が一致しません。')
+
+    def _seed(self, first_date, rows, methods):
+        user = User.objects.create(name='benchmark-user')
+        method_objs = []
+        for i in range(methods):
+            account = Account.objects.create(
+                bank=Bank.objects.create(name='benchmark-bank-{0}'.format(i)),
+                user=user, balance=0,
+            )
+            method_objs.append(Method.objects.create(
+                name='benchmark-method-{0}'.format(i), account=account,
+            ))
+        Expense.objects.bulk_create(
+            [
+                Expense(
+                    name='benchmark-{0}'.format(i),
+                    pay_date=first_date.replace(day=i % 28 + 1),
+                    method=method_objs[i % methods],
+                    amount=i % 5000 + 1,
+                    state=StateChoices.values[i % len(StateChoices.values)],
+                    memo='memo' if i % 3 else None,
+                )
+                for i in range(rows)
+            ],
+            batch_size=2000,
+        )
+
+    def _measure(self, serialize, repeat):
+        """取得とシリアライズの最良時間(秒)と、最後の出力を返す。"""
+        best = None
+        data = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            data = serialize()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, data
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from income_and_expense import balances
+
+
+class Command(BaseCommand):
+    help = '月末残高スナップショットを全期間の再計算結果と比較する。'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='不一致があった場合にスナップショットを作り直す',
+        )
+
+    def handle(self, *args, **options):
+        mismatches = balances.check_snapshots()
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('不一致はありません。'))
+            return
+
+        for m in mismatches:
+            self.stdout.write(
+                '{0:%Y-%m}: 残高 {1} (期待値 {2}), 完了分 {3} (期待値 {4})'
+                .format(
+                    m['month'], m['balance'], m['expected_balance'],
+                    m['balance_done'], m['expected_balance_done'],
+                )
+            )
+
+        if options['rebuild']:
+            created = balances.rebuild_snapshots()
+            self.stdout.write(self.style.SUCCESS(
+                '{0}か月分のスナップショットを作り直しました。'.format(created)
+            ))
+            return
+
+        raise CommandError(
+            '{0}か月分のスナップショットが一致しません。'.format(len(mismatches))
+        )
@@ -0,0 +1,157 @@
+import datetime
+import random
+
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from income_and_expense import aggregations, ledger, summaries, transitions
+from income_and_expense.models import (
+    Account, Bank, Expense, Income, Method, StateChoices, User,
+)
+from income_and_expense.pagination import INEX_ORDERING
+from income_and_expense.serializers import CompactInexSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        '収支の主要クエリの実行計画を、インデックスあり・なしで表示する'
+        '(インデックスなしは PostgreSQL のみ)。'
+        '--seed を指定するとダミーデータを投入して計測する'
+        '(投入データと削除したインデックスは最後にロールバックされる)。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='投入する収入・支出のそれぞれの件数(例: 300000)',
+        )
+        parser.add_argument(
+            '--years', type=int, default=10,
+            help='ダミーデータを分散させる年数',
+        )
+        parser.add_argument('--year', type=int, help='計測対象の年')
+        parser.add_argument('--month', type=int, help='計測対象の月')
+
+    def handle(self, *args, **options):
+        today = datetime.date.today()
+        year = options['year'] or today.year
+        month = options['month'] or today.month
+
+        with transaction.atomic():
+            if options['seed']:
+                self._seed(options['seed'], options['years'], today)
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+
+            queries = self._queries(year, month)
+            self._explain_all(queries, 'インデックスあり')
+            if connection.vendor == 'postgresql':
+                # DDL もトランザクション内で行えるため、削除して比較する
+                self._drop_indexes()
+                self._explain_all(queries, 'インデックスなし')
+            else:
+                self.stdout.write(
+                    'インデックスなしの実行計画は PostgreSQL でのみ表示します。'
+                )
+
+            transaction.set_rollback(True)
+
+    def _seed(self, count, years, today):
+        rnd = random.Random(0)
+        bank = Bank.objects.create(name='explain-bank')
+        methods = []
+        for i in range(5):
+            user = User.objects.create(name='explain-user-{0}'.format(i))
+            account = Account.objects.create(bank=bank, user=user, balance=0)
+            for j in range(6):
+                methods.append(Method.objects.create(
+                    name='explain-method-{0}-{1}'.format(i, j),
+                    account=account,
+                ))
+
+        first = datetime.date(today.year - years + 1, 1, 1)
+        days = (today - first).days + 60
+        for model in (Income, Expense):
+            model.objects.bulk_create(
+                (
+                    model(
+                        name='explain-{0}'.format(n),
+                        pay_date=first + datetime.timedelta(
+                            days=rnd.randrange(days)
+                        ),
+                        method=rnd.choice(methods),
+                        amount=rnd.randrange(100, 100000),
+                        state=rnd.choice(StateChoices.values),
+                    )
+                    for n in range(count)
+                ),
+                batch_size=5000,
+            )
+        self.stdout.write('{0}件ずつ投入しました。'.format(count))
+
+    def _queries(self, year, month):
+        first_date = datetime.date(year, month, 1)
+        last_date = first_date + relativedelta(months=1) - datetime.timedelta(days=1)
+        trend_first = first_date - relativedelta(months=35)
+        method = Method.objects.order_by('pk').first()
+
+        # 各処理が実行するものと同じ QuerySet を、それぞれのモジュールから得る
+        queries = [
+            (
+                '月別一覧 (_InexViewSetBase.get_queryset)',
+                Expense.objects.filter(
+                    pay_date__gte=first_date, pay_date__lte=last_date
+                ).order_by(*INEX_ORDERING)
+                .values(*CompactInexSerializer.VALUES),
+            ),
+            (
+                '月末残高 (balances.get_balances → summaries.month_sums)',
+                summaries.month_sums_queryset(Expense, None, first_date),
+            ),
+            (
+                '口座別残高 (BalanceAPIView → ledger.balances_as_of)',
+                ledger.balances_as_of_queryset(last_date),
+            ),
+            (
+                '必要金額 (AccountRequire → aggregations.require_by)',
+                aggregations.require_queryset(
+                    'account', first_date, last_date
+                ),
+            ),
+            (
+                '月次推移 (TrendAPIView → summaries.month_totals)',
+                summaries.month_totals_queryset(
+                    Income, trend_first, first_date
+                ),
+            ),
+        ]
+        if method is not None:
+            queries.append((
+                '支払方法別 (MethodDoneAPIView → transitions.filter_rows)',
+                transitions.filter_rows(
+                    Expense, first_date, last_date, method=method.pk
+                ).exclude(state=StateChoices.DONE),
+            ))
+        return queries
+
+    def _explain_all(self, queries, title):
+        self.stdout.write(self.style.MIGRATE_HEADING('== {0} =='.format(title)))
+        options = {}
+        if connection.vendor == 'postgresql':
+            options = {'analyze': True, 'buffers': True}
+        for label, qs in queries:
+            self.stdout.write(self.style.MIGRATE_LABEL(label))
+            self.stdout.write(qs.explain(**options))
+            self.stdout.write('')
+
+    def _drop_indexes(self):
+        with connection.cursor() as cursor:
+            for model in (Income, Expense):
+                for index in model._meta.indexes:
+                    cursor.execute(
+                        'DROP INDEX {0}'.format(
+                            connection.ops.quote_name(index.name)
+                        )
+                    )
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from income_and_expense import ledger
+
+
+class Command(BaseCommand):
+    help = '口座別残高台帳を全期間から作り直す。'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='作り直さずに、全期間の再計算結果との不一致だけを表示する',
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            created = ledger.rebuild_from(None)
+            self.stdout.write(self.style.SUCCESS(
+                '{0}件の台帳を作成しました。'.format(created)
+            ))
+            return
+
+        mismatches = ledger.check()
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('不一致はありません。'))
+            return
+        for m in mismatches:
+            self.stdout.write(
+                '口座{0} {1:%Y-%m-%d}: 残高 {2} (期待値 {3}), '
+                '完了分 {4} (期待値 {5})'.format(
+                    m['account'], m['date'], m['balance'],
+                    m['expected_balance'], m['balance_done'],
+                    m['expected_balance_done'],
+                )
+            )
+        raise CommandError(
+            '{0}件の台帳が一致しません。'.format(len(mismatches))
+        )
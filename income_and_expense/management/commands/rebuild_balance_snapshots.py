@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from income_and_expense import balances
+
+
+class Command(BaseCommand):
+    help = '月末残高スナップショットを全期間から作り直す。'
+
+    def handle(self, *args, **options):
+        created = balances.rebuild_snapshots()
+        self.stdout.write(self.style.SUCCESS(
+            '{0}か月分のスナップショットを作成しました。'.format(created)
+        ))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from income_and_expense import summaries
+
+
+class Command(BaseCommand):
+    help = '収入・支出の月別集計を全期間から作り直す。'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='作り直さずに、全期間の再集計結果との不一致だけを表示する',
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            created = summaries.rebuild()
+            self.stdout.write(self.style.SUCCESS(
+                '{0}件の集計を作成しました。'.format(created)
+            ))
+            return
+
+        mismatches = summaries.check()
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('不一致はありません。'))
+            return
+        for m in mismatches:
+            self.stdout.write(
+                '{0} {1:%Y-%m} 支払方法{2} 状態{3}: 件数 {4} (期待値 {5}), '
+                '金額 {6} (期待値 {7})'.format(
+                    m['model'], m['month'], m['method'], m['state'],
+                    m['count'], m['expected_count'],
+                    m['amount'], m['expected_amount'],
+                )
+            )
+        raise CommandError(
+            '{0}件の集計が一致しません。'.format(len(mismatches))
+        )
@@ -0,0 +1,56 @@
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from income_and_expense import jobs
+
+
+class Command(BaseCommand):
+    help = 'ジョブを順に取り出して実行するワーカー。'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='実行できるジョブがなくなったら終了する',
+        )
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='ジョブがない場合の待ち時間(秒)')
+        parser.add_argument('--stale-after', type=int, default=300,
+                            help='この秒数を過ぎても応答のない実行中のジョブを戻す')
+        parser.add_argument('--worker', help='ワーカー名(既定はホスト名:PID)')
+
+    def handle(self, *args, **options):
+        worker = options['worker'] or '{0}:{1}'.format(
+            socket.gethostname(), os.getpid()
+        )
+        self.stdout.write('ワーカー {0} を開始しました。'.format(worker))
+
+        # SIGTERM(再起動等)を受けたら、実行中のジョブを終えてから止まる
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+        try:
+            while not stopping:
+                job = jobs.claim(worker)
+                if job is None:
+                    requeued = jobs.requeue_stale(options['stale_after'])
+                    if requeued:
+                        self.stdout.write(
+                            '{0}件の実行中のジョブを戻しました。'.format(requeued)
+                        )
+                        continue
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+                start = time.perf_counter()
+                jobs.run(job)
+                job.refresh_from_db()
+                self.stdout.write('{0}: {1:.3f}秒'.format(
+                    job, time.perf_counter() - start
+                ))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write('ワーカー {0} を終了しました。'.format(worker))
@@ -0,0 +1,244 @@
+"""リクエストごとの計測(クエリ数・DB時間・シリアライズ時間・
+レンダリング時間・応答サイズ)。
+
+MetricsMiddleware が計測してルート(URL パターンの名前)・メソッドごとの
+ヒストグラムに集計する。集計はプロセス内に保持し、/api/_metrics/ から Prometheus のテキスト形式で
+取得する(累積値のため、一定期間の値はスクレイプ側で rate() 等を使って
+求める)。Server-Timing ヘッダーは DEBUG の場合と管理者のリクエストにだけ
+付ける。
+
+シリアライズ時間は SerializeTimingMixin を付けた汎用ビューで、出力に使う
+シリアライザを作ってからレスポンスを返すまでの時間(SQL の時間を除く)。
+レンダリング時間は DRF の Response 等の render の時間で、レンダラーは
+置き換えずにミドルウェアで計測する。
+"""
+import bisect
+import contextlib
+import contextvars
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.renderers import BaseRenderer
+
+_current = contextvars.ContextVar('income_and_expense_metrics', default=None)
+
+# (メトリクス名, 説明, バケットの上限)
+HISTOGRAMS = (
+    ('inex_request_duration_seconds', 'リクエストの処理時間',
+     (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    ('inex_request_db_seconds', 'リクエスト中の SQL の合計実行時間',
+     (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)),
+    ('inex_request_db_queries', 'リクエスト中の SQL の実行回数',
+     (1, 2, 5, 10, 20, 50, 100, 200, 500)),
+    ('inex_request_serialize_seconds', 'API レスポンスのシリアライズ時間',
+     (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)),
+    ('inex_request_render_seconds', 'API レスポンスのレンダリング時間',
+     (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5)),
+    ('inex_response_size_bytes', 'レスポンスの本文のサイズ',
+     (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)),
+)
+
+
+class RequestMetrics:
+    """1リクエスト分の計測値。"""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.render_time = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+class _Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    """ルート・メソッドごとのヒストグラム。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, route, method, values):
+        with self._lock:
+            series = self._series.get((route, method))
+            if series is None:
+                series = {
+                    name: _Histogram(buckets)
+                    for name, _, buckets in HISTOGRAMS
+                }
+                self._series[(route, method)] = series
+            for name, value in values.items():
+                series[name].observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        """Prometheus のテキスト形式で出力する。"""
+        with self._lock:
+            lines = []
+            for name, help_text, buckets in HISTOGRAMS:
+                lines.append('# HELP {0} {1}'.format(name, help_text))
+                lines.append('# TYPE {0} histogram'.format(name))
+                for (route, method), series in sorted(self._series.items()):
+                    hist = series[name]
+                    labels = 'route="{0}",method="{1}"'.format(
+                        _escape(route), _escape(method)
+                    )
+                    cumulative = 0
+                    for bound, count in zip(buckets, hist.counts):
+                        cumulative += count
+                        lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(
+                            name, labels, bound, cumulative
+                        ))
+                    cumulative += hist.counts[-1]
+                    lines.append('{0}_bucket{{{1},le="+Inf"}} {2}'.format(
+                        name, labels, cumulative
+                    ))
+                    lines.append('{0}_sum{{{1}}} {2}'.format(
+                        name, labels, hist.sum
+                    ))
+                    lines.append('{0}_count{{{1}}} {2}'.format(
+                        name, labels, cumulative
+                    ))
+            return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+def _shows_timing(request):
+    """Server-Timing ヘッダーを付けるか(DEBUG または管理者)。"""
+    if settings.DEBUG:
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user is not None and user.is_staff)
+
+
+def _route(request):
+    """集計のラベルにするルート(URL パターンの名前、なければビューのパス)。"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name
+
+
+class MetricsMiddleware:
+    """リクエストを計測し、Server-Timing ヘッダーと集計に反映する。"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.record_query)
+                    )
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - start
+
+        if _shows_timing(request):
+            response['Server-Timing'] = ', '.join([
+                'db;dur={0:.1f};desc="{1} queries"'.format(
+                    metrics.db_time * 1000, metrics.queries
+                ),
+                'serialize;dur={0:.1f}'.format(metrics.serialize_time * 1000),
+                'render;dur={0:.1f}'.format(metrics.render_time * 1000),
+                'total;dur={0:.1f}'.format(total * 1000),
+            ])
+        values = {
+            'inex_request_duration_seconds': total,
+            'inex_request_db_seconds': metrics.db_time,
+            'inex_request_db_queries': metrics.queries,
+            'inex_request_serialize_seconds': metrics.serialize_time,
+            'inex_request_render_seconds': metrics.render_time,
+        }
+        if not response.streaming:
+            values['inex_response_size_bytes'] = len(response.content)
+        registry.observe(_route(request), request.method, values)
+        return response
+
+    def process_template_response(self, request, response):
+        """この後に行われる render の時間を計測値に加える。"""
+        metrics = _current.get()
+        if metrics is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                metrics.render_time += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+class SerializeTimingMixin:
+    """シリアライズ時間を計測値に加える汎用ビュー用の mixin。
+
+    最後に get_serializer を呼んでから finalize_response までの時間から、
+    その間の SQL の時間を除いたものをシリアライズ時間とする(作成・更新では
+    検証と保存の処理も含む)。
+    """
+
+    _serialize_started = None
+
+    def get_serializer(self, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is not None:
+            self._serialize_started = (time.perf_counter(), metrics.db_time)
+        return super().get_serializer(*args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is not None and self._serialize_started is not None:
+            started, db_time = self._serialize_started
+            elapsed = time.perf_counter() - started
+            metrics.serialize_time += max(
+                0.0, elapsed - (metrics.db_time - db_time)
+            )
+            self._serialize_started = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class PrometheusTextRenderer(BaseRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, str):
+            # 認証エラー等の詳細
+            data = json.dumps(data, ensure_ascii=False) + '\n'
+        return data.encode(self.charset)
@@ -0,0 +1,26 @@
+# Generated by Django 4.0.6 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income_and_expense', '0016_alter_account_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('balance', models.BigIntegerField()),
+                ('balance_done', models.BigIntegerField()),
+            ],
+            options={
+                'verbose_name': '月末残高スナップショット',
+                'verbose_name_plural': '月末残高スナップショット',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.6 on 2026-10-18 09:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income_and_expense', '0017_balancesnapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['pay_date', 'state', 'amount'], name='expense_date_state_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['method', 'pay_date'], name='expense_method_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='income',
+            index=models.Index(fields=['pay_date', 'state', 'amount'], name='income_date_state_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='income',
+            index=models.Index(fields=['method', 'pay_date'], name='income_method_date_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income_and_expense', '0018_inex_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(unique=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': '月別更新バージョン',
+                'verbose_name_plural': '月別更新バージョン',
+            },
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:14
+
+from django.db import migrations, models
+from django.db.models import Q, Sum
+import django.db.models.deletion
+
+DONE = 2
+
+
+def build_ledger(apps, schema_editor):
+    """既存の収支から台帳を作る(ledger.rebuild_from と同じ計算)。"""
+    AccountLedger = apps.get_model('income_and_expense', 'AccountLedger')
+    deltas = {}
+    for sign, name in ((1, 'Income'), (-1, 'Expense')):
+        model = apps.get_model('income_and_expense', name)
+        rows = (
+            model.objects.values('method__account', 'pay_date')
+            .annotate(
+                total=Sum('amount'),
+                done=Sum('amount', filter=Q(state=DONE)),
+            )
+            .order_by()
+        )
+        for r in rows:
+            delta = deltas.setdefault(
+                (r['method__account'], r['pay_date']), [0, 0]
+            )
+            delta[0] += sign * r['total']
+            delta[1] += sign * (r['done'] or 0)
+
+    running = {}
+    ledger = []
+    for (account_id, date), (total, done) in sorted(deltas.items()):
+        balance = running.setdefault(account_id, [0, 0])
+        balance[0] += total
+        balance[1] += done
+        ledger.append(AccountLedger(
+            account_id=account_id, date=date,
+            balance=balance[0], balance_done=balance[1],
+        ))
+    AccountLedger.objects.bulk_create(ledger, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income_and_expense', '0019_monthversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('balance', models.BigIntegerField()),
+                ('balance_done', models.BigIntegerField()),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='income_and_expense.account')),
+            ],
+            options={
+                'verbose_name': '口座別残高台帳',
+                'verbose_name_plural': '口座別残高台帳',
+                'unique_together': {('account', 'date')},
+            },
+        ),
+        migrations.RunPython(build_ledger, migrations.RunPython.noop),
+    ]
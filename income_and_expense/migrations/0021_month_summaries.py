@@ -0,0 +1,76 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:18
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def build_summaries(apps, schema_editor):
+    """既存の収支から月別集計を作る(summaries.rebuild と同じ集計)。"""
+    for name in ('Income', 'Expense'):
+        model = apps.get_model('income_and_expense', name)
+        summary_model = apps.get_model(
+            'income_and_expense', name + 'MonthSummary'
+        )
+        rows = (
+            model.objects.annotate(m=TruncMonth('pay_date'))
+            .values('m', 'method', 'state')
+            .annotate(count=Count('id'), total=Sum('amount'))
+            .order_by()
+        )
+        summary_model.objects.bulk_create(
+            [
+                summary_model(
+                    month=r['m'], method_id=r['method'], state=r['state'],
+                    count=r['count'], amount=r['total'],
+                )
+                for r in rows
+            ],
+            batch_size=2000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income_and_expense', '0020_accountledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IncomeMonthSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('state', models.IntegerField(choices=[(0, '未定'), (1, '確定'), (2, '完了')])),
+                ('count', models.PositiveIntegerField()),
+                ('amount', models.BigIntegerField()),
+                ('method', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='income_and_expense.method')),
+            ],
+            options={
+                'verbose_name': '収入月別集計',
+                'verbose_name_plural': '収入月別集計',
+                'abstract': False,
+                'unique_together': {('month', 'method', 'state')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ExpenseMonthSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('state', models.IntegerField(choices=[(0, '未定'), (1, '確定'), (2, '完了')])),
+                ('count', models.PositiveIntegerField()),
+                ('amount', models.BigIntegerField()),
+                ('method', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='income_and_expense.method')),
+            ],
+            options={
+                'verbose_name': '支出月別集計',
+                'verbose_name_plural': '支出月別集計',
+                'abstract': False,
+                'unique_together': {('month', 'method', 'state')},
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,96 @@
+from django.db import OperationalError, migrations
+
+TABLES = ('income_and_expense_income', 'income_and_expense_expense')
+
+
+def _postgresql_forward(schema_editor):
+    # name__icontains / memo__icontains が生成する UPPER(列::text) LIKE に
+    # 使われるよう、同じ式に trigram の GIN インデックスを張る
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in TABLES:
+        for column in ('name', 'memo'):
+            schema_editor.execute(
+                'CREATE INDEX IF NOT EXISTS {0}_{1}_trgm ON {0} '
+                'USING gin ((UPPER({1}::text)) gin_trgm_ops)'.format(
+                    table, column
+                )
+            )
+
+
+def _postgresql_backward(schema_editor):
+    for table in TABLES:
+        for column in ('name', 'memo'):
+            schema_editor.execute(
+                'DROP INDEX IF EXISTS {0}_{1}_trgm'.format(table, column)
+            )
+
+
+def _sqlite_forward(schema_editor):
+    # 収支の表を外部コンテンツとする FTS5(trigram)の表をトリガーで同期する。
+    # FTS5 / trigram(SQLite 3.34 以降)がなければ作らない(検索は LIKE になる)
+    for table in TABLES:
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE {0}_fts USING fts5("
+                "name, memo, content='{0}', content_rowid='id', "
+                "tokenize='trigram')".format(table)
+            )
+        except OperationalError:
+            return
+        schema_editor.execute(
+            'CREATE TRIGGER {0}_fts_ai AFTER INSERT ON {0} BEGIN '
+            'INSERT INTO {0}_fts(rowid, name, memo) '
+            'VALUES (new.id, new.name, new.memo); END'.format(table)
+        )
+        schema_editor.execute(
+            'CREATE TRIGGER {0}_fts_ad AFTER DELETE ON {0} BEGIN '
+            "INSERT INTO {0}_fts({0}_fts, rowid, name, memo) "
+            "VALUES ('delete', old.id, old.name, old.memo); END".format(table)
+        )
+        schema_editor.execute(
+            'CREATE TRIGGER {0}_fts_au AFTER UPDATE ON {0} BEGIN '
+            "INSERT INTO {0}_fts({0}_fts, rowid, name, memo) "
+            "VALUES ('delete', old.id, old.name, old.memo); "
+            'INSERT INTO {0}_fts(rowid, name, memo) '
+            'VALUES (new.id, new.name, new.memo); END'.format(table)
+        )
+        schema_editor.execute(
+            "INSERT INTO {0}_fts({0}_fts) VALUES ('rebuild')".format(table)
+        )
+
+
+def _sqlite_backward(schema_editor):
+    for table in TABLES:
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(
+                'DROP TRIGGER IF EXISTS {0}_fts_{1}'.format(table, suffix)
+            )
+        schema_editor.execute('DROP TABLE IF EXISTS {0}_fts'.format(table))
+
+
+def create_search_indexes(apps, schema_editor):
+    """検索用のインデックスを作る(PostgreSQL / SQLite 以外では作らない)。"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _postgresql_forward(schema_editor)
+    elif vendor == 'sqlite':
+        _sqlite_forward(schema_editor)
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _postgresql_backward(schema_editor)
+    elif vendor == 'sqlite':
+        _sqlite_backward(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income_and_expense', '0021_month_summaries'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
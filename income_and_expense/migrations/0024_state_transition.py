@@ -0,0 +1,31 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income_and_expense', '0023_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StateTransition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20)),
+                ('to_state', models.IntegerField(choices=[(0, '未定'), (1, '確定'), (2, '完了')])),
+                ('source', models.CharField(max_length=20)),
+                ('actor', models.CharField(blank=True, max_length=150)),
+                ('filters', models.JSONField(default=dict)),
+                ('count', models.PositiveIntegerField()),
+                ('changes', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': '状態の一括変更',
+                'verbose_name_plural': '状態の一括変更',
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:36
+
+from django.db import migrations, models
+from django.utils import timezone
+
+FIELDS = ('name', 'pay_date', 'method_id', 'amount', 'state', 'memo')
+
+
+def record_existing_rows(apps, schema_editor):
+    """既存の収支を作成として記録する(変更の記録の起点)。"""
+    change_model = apps.get_model('income_and_expense', 'InexChange')
+    now = timezone.now()
+    for name in ('Income', 'Expense'):
+        model = apps.get_model('income_and_expense', name)
+        entries = []
+        rows = model.objects.order_by('id').values('id', *FIELDS)
+        for row in rows.iterator():
+            entries.append(change_model(
+                model=name.lower(), row_id=row['id'], op='c',
+                month=row['pay_date'].replace(day=1),
+                data={
+                    f: row[f].isoformat() if f == 'pay_date' else row[f]
+                    for f in FIELDS
+                },
+                created_at=now,
+            ))
+            if len(entries) >= 2000:
+                change_model.objects.bulk_create(entries)
+                entries = []
+        change_model.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income_and_expense', '0024_state_transition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InexChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=10)),
+                ('row_id', models.IntegerField()),
+                ('op', models.CharField(max_length=1)),
+                ('month', models.DateField()),
+                ('data', models.JSONField()),
+                ('created_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': '収支の変更履歴',
+                'verbose_name_plural': '収支の変更履歴',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='inexchange',
+            index=models.Index(fields=['model', 'month', 'created_at'], name='inex_change_month_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inexchange',
+            index=models.Index(fields=['model', 'row_id', 'id'], name='inex_change_row_idx'),
+        ),
+        migrations.RunPython(record_existing_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+from django.db import migrations, models
+
+MODELS = ('Income', 'Expense')
+
+
+def _method_indexes(schema_editor, model):
+    """method_id だけを対象とする(外部キーの)インデックスの名前。"""
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(
+            cursor, model._meta.db_table
+        )
+    return [
+        name for name, c in constraints.items()
+        if c['index'] and c['columns'] == ['method_id']
+        and not c['unique'] and not c['primary_key']
+    ]
+
+
+def drop_method_indexes(apps, schema_editor):
+    # (method, pay_date) のインデックスが method だけの検索にも使えるため、
+    # 外部キーのインデックスを削除する。AlterField は SQLite では表を
+    # 作り直し、FTS5 の同期トリガー(0022)が消えるため、インデックスだけを
+    # 削除する
+    for model_name in MODELS:
+        model = apps.get_model('income_and_expense', model_name)
+        for name in _method_indexes(schema_editor, model):
+            schema_editor.remove_index(
+                model, models.Index(fields=['method'], name=name)
+            )
+
+
+def create_method_indexes(apps, schema_editor):
+    for model_name in MODELS:
+        model = apps.get_model('income_and_expense', model_name)
+        if _method_indexes(schema_editor, model):
+            continue
+        schema_editor.add_index(model, models.Index(
+            fields=['method'],
+            name='{0}_method_id_idx'.format(model_name.lower()),
+        ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('income_and_expense', '0026_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(
+                    drop_method_indexes, create_method_indexes
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name=model_name.lower(),
+                    name='method',
+                    field=models.ForeignKey(
+                        db_index=False,
+                        on_delete=models.deletion.PROTECT,
+                        to='income_and_expense.method',
+                    ),
+                )
+                for model_name in MODELS
+            ],
+        ),
+    ]
@@ -1,3 +1,5 @@
+import datetime
+
 from django.db import models
 from django.core import validators
 from income_and_expense.const import const_data
@@ -5,6 +7,29 @@ from income_and_expense.const import const_data
 # Create your models here.
 
 
+class _TrackLoadedValuesMixin:
+    """DB上の値(読み込み時点・直近の保存時点)を保持する。
+
+    シグナル受信側で変更前の支払日等を参照するために使う。
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {
+            f.attname: getattr(self, f.attname)
+            for f in self._meta.concrete_fields
+        }
+
+    def loaded_value(self, attname):
+        return getattr(self, '_loaded_values', {}).get(attname)
+
+
 class Bank(models.Model):
     name = models.CharField(max_length=50, unique=True)
 
@@ -47,7 +72,7 @@ class Account(models.Model):
     formed_balance.short_description = const_data.const.SHOWN_NAME_BALANCE
 
 
-class Method(models.Model):
+class Method(_TrackLoadedValuesMixin, models.Model):
     name = models.CharField(max_length=50)
     account = models.ForeignKey(Account, on_delete=models.PROTECT)
 
@@ -70,10 +95,14 @@ class StateChoices(models.IntegerChoices):
     DONE = 2, const_data.const.SHOWN_NAME_DONE
 
 
-class Expense(models.Model):
+class Expense(_TrackLoadedValuesMixin, models.Model):
     name = models.CharField(max_length=50)
     pay_date = models.DateField('payment date')
-    method = models.ForeignKey(Method, on_delete=models.PROTECT)
+    # (method, pay_date) のインデックスで足りるため、外部キーの
+    # インデックスは作らない
+    method = models.ForeignKey(
+        Method, on_delete=models.PROTECT, db_index=False
+    )
     amount = models.PositiveIntegerField()
     state = models.IntegerField(choices=StateChoices.choices, default=StateChoices.UNDECIDED)
     memo = models.TextField(blank=True, null=True)
@@ -82,6 +111,19 @@ class Expense(models.Model):
         verbose_name = const_data.const.SHOWN_NAME_EXPENSE
         verbose_name_plural = const_data.const.SHOWN_NAME_EXPENSE
 
+        indexes = [
+            # 月範囲 + 状態での絞り込みと、月別の SUM(amount) をインデックスのみで賄う
+            models.Index(
+                fields=['pay_date', 'state', 'amount'],
+                name='expense_date_state_amount_idx',
+            ),
+            # 支払方法 + 月範囲での絞り込み
+            models.Index(
+                fields=['method', 'pay_date'],
+                name='expense_method_date_idx',
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -98,10 +140,14 @@ class Expense(models.Model):
     state_info.short_description = const_data.const.SHOWN_NAME_STATE
 
 
-class Income(models.Model):
+class Income(_TrackLoadedValuesMixin, models.Model):
     name = models.CharField(max_length=50)
     pay_date = models.DateField('payment date')
-    method = models.ForeignKey(Method, on_delete=models.PROTECT)
+    # (method, pay_date) のインデックスで足りるため、外部キーの
+    # インデックスは作らない
+    method = models.ForeignKey(
+        Method, on_delete=models.PROTECT, db_index=False
+    )
     amount = models.PositiveIntegerField()
     state = models.IntegerField(choices=StateChoices.choices, default=StateChoices.UNDECIDED)
     memo = models.TextField(blank=True, null=True)
@@ -110,6 +156,19 @@ class Income(models.Model):
         verbose_name = const_data.const.SHOWN_NAME_INCOME
         verbose_name_plural = const_data.const.SHOWN_NAME_INCOME
 
+        indexes = [
+            # 月範囲 + 状態での絞り込みと、月別の SUM(amount) をインデックスのみで賄う
+            models.Index(
+                fields=['pay_date', 'state', 'amount'],
+                name='income_date_state_amount_idx',
+            ),
+            # 支払方法 + 月範囲での絞り込み
+            models.Index(
+                fields=['method', 'pay_date'],
+                name='income_method_date_idx',
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -354,3 +413,211 @@ class Loan(models.Model):
     def state_info(self):
         return (StateChoices(self.state).label)
     state_info.short_description = const_data.const.SHOWN_NAME_STATE
+
+
+class BalanceSnapshot(models.Model):
+    """月末時点の累計残高(全状態・完了分)。
+
+    収支の保存・削除で該当月以降が破棄され、参照時に再計算される。
+    """
+    month = models.DateField(unique=True)
+    balance = models.BigIntegerField()
+    balance_done = models.BigIntegerField()
+
+    class Meta:
+        verbose_name = const_data.const.SHOWN_NAME_BALANCE_SNAPSHOT
+        verbose_name_plural = const_data.const.SHOWN_NAME_BALANCE_SNAPSHOT
+
+    def __str__(self):
+        return "{0}年{1}月".format(self.month.year, self.month.month)
+
+
+class MonthVersion(models.Model):
+    """月ごとの更新バージョン。ETag / Last-Modified の算出に使う。
+
+    口座・支払方法等のマスタの変更は全月に影響するため、
+    最小日付(GLOBAL_MONTH)の行で管理する。
+    """
+    GLOBAL_MONTH = datetime.date.min
+
+    month = models.DateField(unique=True)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = const_data.const.SHOWN_NAME_MONTH_VERSION
+        verbose_name_plural = const_data.const.SHOWN_NAME_MONTH_VERSION
+
+    def __str__(self):
+        return "{0}年{1}月(v{2})".format(
+            self.month.year, self.month.month, self.version
+        )
+
+
+class AccountLedger(models.Model):
+    """口座ごとの日別の累計残高(全状態・完了分)。
+
+    収支のある日だけ行を持ち、ある日時点の残高はその日以前の最新の行で
+    求める。収支の変更時に、変更のあった日の増減の差分がその日以降の行に
+    加算される。
+    """
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    date = models.DateField()
+    balance = models.BigIntegerField()
+    balance_done = models.BigIntegerField()
+
+    class Meta:
+        verbose_name = const_data.const.SHOWN_NAME_ACCOUNT_LEDGER
+        verbose_name_plural = const_data.const.SHOWN_NAME_ACCOUNT_LEDGER
+
+        unique_together = ('account', 'date')
+
+    def __str__(self):
+        return "{0}({1})".format(self.account, self.date)
+
+
+class _MonthSummaryBase(models.Model):
+    """月・支払方法・状態ごとの件数と金額の合計。
+
+    収支の変更時に、変更した行の差分が同じトランザクションで加えられる。
+    """
+    month = models.DateField()
+    method = models.ForeignKey(Method, on_delete=models.CASCADE)
+    state = models.IntegerField(choices=StateChoices.choices)
+    count = models.PositiveIntegerField()
+    amount = models.BigIntegerField()
+
+    class Meta:
+        abstract = True
+
+        unique_together = ('month', 'method', 'state')
+
+    def __str__(self):
+        return "{0}年{1}月 {2}({3})".format(
+            self.month.year, self.month.month, self.method,
+            StateChoices(self.state).label,
+        )
+
+
+class IncomeMonthSummary(_MonthSummaryBase):
+
+    class Meta(_MonthSummaryBase.Meta):
+        verbose_name = (
+            const_data.const.SHOWN_NAME_INCOME +
+            const_data.const.SHOWN_NAME_MONTH_SUMMARY
+        )
+        verbose_name_plural = (
+            const_data.const.SHOWN_NAME_INCOME +
+            const_data.const.SHOWN_NAME_MONTH_SUMMARY
+        )
+
+
+class ExpenseMonthSummary(_MonthSummaryBase):
+
+    class Meta(_MonthSummaryBase.Meta):
+        verbose_name = (
+            const_data.const.SHOWN_NAME_EXPENSE +
+            const_data.const.SHOWN_NAME_MONTH_SUMMARY
+        )
+        verbose_name_plural = (
+            const_data.const.SHOWN_NAME_EXPENSE +
+            const_data.const.SHOWN_NAME_MONTH_SUMMARY
+        )
+
+
+class JobStateChoices(models.IntegerChoices):
+    QUEUED = 0, const_data.const.SHOWN_NAME_JOB_QUEUED
+    RUNNING = 1, const_data.const.SHOWN_NAME_JOB_RUNNING
+    DONE = 2, const_data.const.SHOWN_NAME_DONE
+    FAILED = 3, const_data.const.SHOWN_NAME_JOB_FAILED
+
+
+class Job(models.Model):
+    """リクエストの外で実行する処理。run_jobs コマンドのワーカーが実行する。
+
+    失敗した場合は max_attempts 回まで、間隔を空けて再実行する。
+    実行中はワーカーが heartbeat_at を定期的に更新する。
+    """
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict)
+    state = models.IntegerField(
+        choices=JobStateChoices.choices, default=JobStateChoices.QUEUED
+    )
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField()
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = const_data.const.SHOWN_NAME_JOB
+        verbose_name_plural = const_data.const.SHOWN_NAME_JOB
+        indexes = [models.Index(fields=['state', 'run_after'])]
+
+    def __str__(self):
+        return "{0} #{1}({2})".format(
+            self.kind, self.pk, JobStateChoices(self.state).label
+        )
+
+
+class StateTransition(models.Model):
+    """状態の一括変更の記録。1回の変更につき1行。
+
+    changes は変更前の状態ごとの変更した行の id のリスト
+    ({"0": [1, 2], "1": [3]})。
+    """
+    model = models.CharField(max_length=20)
+    to_state = models.IntegerField(choices=StateChoices.choices)
+    source = models.CharField(max_length=20)
+    actor = models.CharField(max_length=150, blank=True)
+    filters = models.JSONField(default=dict)
+    count = models.PositiveIntegerField()
+    changes = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = const_data.const.SHOWN_NAME_STATE_TRANSITION
+        verbose_name_plural = const_data.const.SHOWN_NAME_STATE_TRANSITION
+
+    def __str__(self):
+        return "{0} #{1}({2}件 → {3})".format(
+            self.model, self.pk, self.count, StateChoices(self.to_state).label
+        )
+
+
+class InexChange(models.Model):
+    """収入・支出の変更の記録(追記のみ)。1回の作成・更新・削除につき1行。
+
+    data は差分だけを持つ(journal モジュール参照)。month は変更後
+    (削除は削除前)の支払日の月。
+    """
+    model = models.CharField(max_length=10)
+    row_id = models.IntegerField()
+    op = models.CharField(max_length=1)
+    month = models.DateField()
+    data = models.JSONField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = const_data.const.SHOWN_NAME_INEX_CHANGE
+        verbose_name_plural = const_data.const.SHOWN_NAME_INEX_CHANGE
+        indexes = [
+            # 月の状態の再現: 月に入った行の絞り込み
+            models.Index(
+                fields=['model', 'month', 'created_at'],
+                name='inex_change_month_idx',
+            ),
+            # 行ごとの記録を順に読む
+            models.Index(
+                fields=['model', 'row_id', 'id'],
+                name='inex_change_row_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return "{0} #{1} {2}".format(self.model, self.row_id, self.op)
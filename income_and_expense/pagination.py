@@ -0,0 +1,111 @@
+"""収入・支出一覧のキーセットページネーション。
+
+page_size を指定した場合だけ有効になる(未指定なら従来どおり月全体を返す)。
+一覧の並び順のキー列の値をカーソルにして「その行より後ろ」を条件に
+取得するため、何ページ目でも OFFSET による読み飛ばしが発生しない。
+"""
+import base64
+import binascii
+import datetime
+import json
+import operator
+from functools import reduce
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# 一覧の並び順(末尾の id は同順位の行を一意にするため)
+INEX_ORDERING = (
+    'method__account__user__name', 'method__name',
+    'method__account__bank__name', 'state', 'pay_date', 'name', 'id',
+)
+
+# カーソルの各値の型(pay_date は ISO 形式の文字列)
+_KEY_TYPES = (str, str, str, int, str, str, int)
+
+
+def _row_key(obj):
+    """行の並び順キー列の値(カーソルに埋め込む値)。
+
+    obj はインスタンスまたは並び順のキー列を含む values() の辞書。
+    """
+    if isinstance(obj, dict):
+        key = [obj[field] for field in INEX_ORDERING]
+        key[4] = key[4].isoformat()
+        return key
+    account = obj.method.account
+    return [
+        account.user.name, obj.method.name, account.bank.name,
+        obj.state, obj.pay_date.isoformat(), obj.name, obj.id,
+    ]
+
+
+def _after(key):
+    """並び順で key より後ろの行を表す条件。"""
+    conditions = []
+    for i, field in enumerate(INEX_ORDERING):
+        equals = {f: v for f, v in zip(INEX_ORDERING[:i], key[:i])}
+        conditions.append(Q(**equals, **{field + '__gt': key[i]}))
+    return reduce(operator.or_, conditions)
+
+
+class InexKeysetPagination(BasePagination):
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = request.query_params.get(self.page_size_query_param)
+        if page_size is None:
+            return None
+        try:
+            page_size = int(page_size)
+        except ValueError:
+            raise ValidationError('page_size は整数で指定してください')
+        self.page_size = max(1, min(page_size, self.max_page_size))
+        self.request = request
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(_after(self._decode_cursor(cursor)))
+
+        # 次ページの有無を判定するため1件多く取得する
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_key = _row_key(rows[-1]) if self.has_next else None
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'results': data,
+            'next': self.get_next_link(),
+        })
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self._encode_cursor(self.next_key)
+        )
+
+    def _encode_cursor(self, key):
+        raw = json.dumps(key, ensure_ascii=False).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii')
+
+    def _decode_cursor(self, cursor):
+        try:
+            key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            if not isinstance(key, list) or len(key) != len(INEX_ORDERING):
+                raise ValueError
+            for value, key_type in zip(key, _KEY_TYPES):
+                if type(value) is not key_type:
+                    raise ValueError
+            key[4] = datetime.date.fromisoformat(key[4])
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise ValidationError('cursor が不正です')
+        return key
@@ -0,0 +1,212 @@
+"""計測用のダミーの家計データ。
+
+実際の家計に近い分布(毎月の給与・固定費、年数回の賞与・年払い、
+ローン、日々の変動費)で各モデルを投入する。当月より前の収支は完了、
+当月は状態が混在、翌月以降は未定・確定とする。
+"""
+import datetime
+import random
+
+from dateutil.relativedelta import relativedelta
+
+from income_and_expense import defaults, journal, signals, transitions
+from income_and_expense.models import (
+    Account, Bank, DefaultExpense, DefaultExpenseMonth, DefaultIncome,
+    DefaultIncomeMonth, Expense, Income, Loan, Method, StateChoices,
+    TemplateExpense, User,
+)
+
+ALL_MONTHS = range(1, 13)
+
+# (名前, 支払日, 金額, 適用月)
+DEFAULT_INCOMES = [
+    ('給与', 25, 280000, ALL_MONTHS),
+    ('賞与', 10, 450000, (6, 12)),
+]
+DEFAULT_EXPENSES = [
+    ('家賃', 27, 85000, ALL_MONTHS),
+    ('電気代', 10, 8000, ALL_MONTHS),
+    ('ガス代', 12, 5000, ALL_MONTHS),
+    ('水道代', 20, 6000, (2, 4, 6, 8, 10, 12)),
+    ('携帯電話', 26, 7000, ALL_MONTHS),
+    ('保険料', 27, 60000, (4,)),
+    ('自動車税', 28, 36000, (5,)),
+]
+# 変動費の名前と金額の中央値(金額は対数正規分布でばらつかせる)
+VARIABLE_EXPENSES = [
+    ('スーパー', 3500), ('コンビニ', 800), ('外食', 4000),
+    ('ドラッグストア', 2000), ('ガソリン', 6000), ('日用品', 1500),
+    ('書籍', 1800), ('衣料品', 7000), ('医療費', 3000), ('交通費', 1200),
+]
+VARIABLE_INCOMES = [('ポイント還元', 500), ('フリマ売上', 3000)]
+METHOD_NAMES = ['振込', '引き落とし', 'カード', '現金']
+BANK_NAMES = ['銀行A', '銀行B', '銀行C']
+
+
+def _month_firsts(start_first, end_first):
+    months = []
+    cur = start_first
+    while cur <= end_first:
+        months.append(cur)
+        cur = cur + relativedelta(months=1)
+    return months
+
+
+def _random_state(rnd, first_date, current_first):
+    if first_date < current_first:
+        return StateChoices.DONE
+    if first_date == current_first:
+        return rnd.choice(StateChoices.values)
+    return rnd.choice((StateChoices.UNDECIDED, StateChoices.DECIDED))
+
+
+def _amount(rnd, median):
+    return max(1, int(rnd.lognormvariate(0, 0.6) * median))
+
+
+def _variable_rows(model, rnd, names, per_month, months, methods,
+                   current_first, prefix):
+    for first_date in months:
+        days = (first_date + relativedelta(months=1) - first_date).days
+        for _ in range(per_month):
+            name, median = rnd.choice(names)
+            yield model(
+                name='{0}{1}'.format(prefix, name),
+                pay_date=first_date + datetime.timedelta(
+                    days=rnd.randrange(days)
+                ),
+                method=rnd.choice(methods),
+                amount=_amount(rnd, median),
+                state=_random_state(rnd, first_date, current_first),
+            )
+
+
+def _prefix_filter(model, prefix):
+    if model is Account:
+        return {'user__name__startswith': prefix}
+    if model is Method:
+        return {'account__user__name__startswith': prefix}
+    return {'name__startswith': prefix}
+
+
+def seed_household(users=2, years=3, future_months=3,
+                   incomes_per_month=2, expenses_per_month=60, loans=2,
+                   today=None, seed=0, prefix='sample-'):
+    """ダミーの家計データを投入する。
+
+    Parameters
+    ----------
+    users : int
+        利用者数(利用者ごとに各銀行の口座と支払方法を作る)
+    years : int
+        当月までの過去データの年数
+    future_months : int
+        当月より後に作るデータの月数
+    incomes_per_month : int
+        毎月の変動収入の件数
+    expenses_per_month : int
+        毎月の変動費の件数
+    loans : int
+        ローンの数
+    today : date
+        基準日(省略時は今日)
+    seed : int
+        乱数のシード
+    prefix : str
+        名前の接頭辞(一意制約のある名前の衝突を避ける)
+
+    Returns
+    -------
+    dict
+        モデル名をキー、投入件数を値とする辞書
+    """
+    rnd = random.Random(seed)
+    today = today or datetime.date.today()
+    current_first = today.replace(day=1)
+    start_first = datetime.date(today.year - years + 1, 1, 1)
+    end_first = current_first + relativedelta(months=future_months)
+    months = _month_firsts(start_first, end_first)
+
+    banks = [
+        Bank.objects.create(name=prefix + name) for name in BANK_NAMES
+    ]
+    methods = []
+    for i in range(users):
+        user = User.objects.create(name='{0}利用者{1}'.format(prefix, i + 1))
+        for bank in banks:
+            account = Account.objects.create(
+                bank=bank, user=user, balance=rnd.randrange(100000, 2000000)
+            )
+            for name in METHOD_NAMES:
+                methods.append(Method.objects.create(name=name, account=account))
+
+    for name, pay_day, amount, apply_months in DEFAULT_INCOMES:
+        di = DefaultIncome.objects.create(
+            name=prefix + name, pay_day=pay_day,
+            method=rnd.choice(methods), amount=amount,
+        )
+        DefaultIncomeMonth.objects.bulk_create(
+            [DefaultIncomeMonth(month=m, def_inc=di) for m in apply_months]
+        )
+    for name, pay_day, amount, apply_months in DEFAULT_EXPENSES:
+        de = DefaultExpense.objects.create(
+            name=prefix + name, pay_day=pay_day,
+            method=rnd.choice(methods), amount=amount,
+        )
+        DefaultExpenseMonth.objects.bulk_create(
+            [DefaultExpenseMonth(month=m, def_exp=de) for m in apply_months]
+        )
+    for i in range(loans):
+        first = start_first + relativedelta(months=rnd.randrange(12))
+        last = first + relativedelta(months=rnd.randrange(24, 120))
+        amount = rnd.randrange(10, 80) * 1000
+        Loan.objects.create(
+            name='{0}ローン{1}'.format(prefix, i + 1),
+            pay_day=rnd.randrange(1, 29),
+            first_year=first.year, first_month=first.month,
+            last_year=last.year, last_month=last.month,
+            method=rnd.choice(methods),
+            amount_first=amount + rnd.randrange(0, 10000),
+            amount_from_second=amount,
+        )
+    TemplateExpense.objects.create(
+        template_name=prefix + 'コンビニ', name=prefix + 'コンビニ',
+        date_type='today', method=rnd.choice(methods),
+    )
+
+    # 固定費・給与・ローンは既存の一括追加で作り、過去分を完了にする
+    first, last = months[0], months[-1]
+    defaults.add_incomes_from_default_range(
+        first.year, first.month, last.year, last.month
+    )
+    defaults.add_expenses_from_default_and_loan_range(
+        first.year, first.month, last.year, last.month
+    )
+    for model in (Income, Expense):
+        transitions.apply(
+            model.objects.filter(
+                name__startswith=prefix, pay_date__lt=current_first
+            ),
+            StateChoices.DONE, transitions.SOURCE_SAMPLEDATA,
+        )
+
+    for model, names, per_month in (
+        (Income, VARIABLE_INCOMES, incomes_per_month),
+        (Expense, VARIABLE_EXPENSES, expenses_per_month),
+    ):
+        rows = model.objects.bulk_create(
+            _variable_rows(model, rnd, names, per_month, months, methods,
+                           current_first, prefix),
+            batch_size=5000,
+        )
+        journal.record_created(model, rows)
+        signals.notify_inex_created(model, rows)
+
+    counts = {}
+    for model in (Bank, User, Account, Method, DefaultIncome, DefaultExpense,
+                  Loan, Income, Expense):
+        counts[model.__name__] = model.objects.filter(
+            **_prefix_filter(model, prefix)
+        ).count()
+    return counts
+
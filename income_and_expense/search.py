@@ -0,0 +1,233 @@
+"""収入・支出の名前・メモの検索と、支払方法・口座・状態・月ごとの件数。
+
+PostgreSQL では UPPER(列::text) の trigram GIN インデックス(マイグレーション
+0022)が name__icontains / memo__icontains の LIKE に使われる。SQLite では
+FTS5(trigram)の表で一致する行を絞り込む(3文字未満の語と、FTS5 の表が
+ない場合は LIKE で探す)。FTS5 の表はトリガーで同期するため、bulk_create や
+update() による変更にも追従する。
+
+ファセットは収支の種類ごとに (支払方法, 口座, 状態, 月) の1回の GROUP BY
+から組み立てる。
+"""
+import collections
+import datetime
+import functools
+import operator
+
+from django.db import connection, connections
+from django.db.models import Count, Q, Sum
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Substr, TruncMonth
+
+from income_and_expense.models import Expense, Income, Method, StateChoices
+from income_and_expense.serializers import CompactInexSerializer
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+MODELS = {
+    'income': Income,
+    'expense': Expense,
+}
+
+# FTS5 の trigram で絞り込める最短の語の長さ
+_FTS_MIN_LENGTH = 3
+
+
+def _fts_table(model):
+    return model._meta.db_table + '_fts'
+
+
+@functools.lru_cache(maxsize=None)
+def _table_names(alias, name):
+    """データベース(別名, 名前)の表名の集合。
+
+    FTS5 の表の有無はマイグレーションでしか変わらないため、リクエストごとに
+    調べず、データベースごとに1回だけ調べる。
+    """
+    return frozenset(connections[alias].introspection.table_names())
+
+
+def _has_fts(model):
+    if connection.vendor != 'sqlite':
+        return False
+    return _fts_table(model) in _table_names(
+        connection.alias, connection.settings_dict['NAME']
+    )
+
+
+def _like_q(term):
+    return Q(name__icontains=term) | Q(memo__icontains=term)
+
+
+def _match(model, terms):
+    """すべての語を名前またはメモに含む条件。
+
+    FTS5 で探せる語は1つの MATCH(語の AND)にまとめて絞り込む。
+    """
+    fts_terms = []
+    conditions = []
+    use_fts = _has_fts(model)
+    for term in terms:
+        if use_fts and len(term) >= _FTS_MIN_LENGTH:
+            fts_terms.append('"{0}"'.format(term.replace('"', '""')))
+        else:
+            conditions.append(_like_q(term))
+    if fts_terms:
+        table = _fts_table(model)
+        conditions.append(Q(pk__in=RawSQL(
+            'SELECT rowid FROM {0} WHERE {0} MATCH %s'.format(table),
+            [' '.join(fts_terms)],
+        )))
+    return functools.reduce(operator.and_, conditions)
+
+
+def _month():
+    """支払日の月を表す式。
+
+    SQLite の TruncMonth は行ごとに Python の関数を呼ぶため、日付の文字列
+    (YYYY-MM-DD)の先頭7文字で代用する。
+    """
+    if connection.vendor == 'sqlite':
+        return Substr('pay_date', 1, 7)
+    return TruncMonth('pay_date')
+
+
+def _first_of_month(value):
+    if isinstance(value, str):
+        return datetime.date(int(value[:4]), int(value[5:7]), 1)
+    return value
+
+
+def search(q, types=None, method=None, account=None, state=None,
+           date_from=None, date_to=None, limit=DEFAULT_LIMIT):
+    """名前・メモに q の語(空白区切り、すべてを含む)を含む収支を探す。
+
+    Parameters
+    ----------
+    q : str
+        検索語
+    types : list of str
+        'income' / 'expense'(省略時は両方)
+    method, account, state : int
+        支払方法・口座・状態で絞り込む(省略可)
+    date_from, date_to : date
+        支払日の範囲(省略可)
+    limit : int
+        返す件数(支払日の新しい順)
+
+    Returns
+    -------
+    dict
+        count(一致件数)、results(一覧と同じ形式 + type)、
+        facets(type, method, account, state, month ごとの件数・金額)
+    """
+    terms = q.split()
+    rows = []
+    groups = []
+    for type_name in types or MODELS:
+        model = MODELS[type_name]
+        qs = model.objects.filter(_match(model, terms))
+        if method is not None:
+            qs = qs.filter(method=method)
+        if account is not None:
+            qs = qs.filter(method__account=account)
+        if state is not None:
+            qs = qs.filter(state=state)
+        if date_from is not None:
+            qs = qs.filter(pay_date__gte=date_from)
+        if date_to is not None:
+            qs = qs.filter(pay_date__lte=date_to)
+
+        for row in (
+            qs.annotate(month=_month())
+            .values('method', 'method__account', 'state', 'month')
+            .annotate(count=Count('id'), amount=Sum('amount'))
+            .order_by()
+        ):
+            groups.append((type_name, row))
+
+        page = qs.order_by('-pay_date', '-id').values(
+            *CompactInexSerializer.VALUES
+        )[:limit]
+        rows += [(type_name, row) for row in page]
+
+    rows.sort(
+        key=lambda r: (r[1]['pay_date'], r[0], r[1]['id']), reverse=True
+    )
+    rows = rows[:limit]
+    data = CompactInexSerializer([row for _, row in rows], many=True).data
+    return {
+        'count': sum(row['count'] for _, row in groups),
+        'results': [
+            {'type': type_name, **item}
+            for (type_name, _), item in zip(rows, data)
+        ],
+        'facets': _facets(groups),
+    }
+
+
+def _facets(groups):
+    totals = {
+        key: collections.defaultdict(lambda: [0, 0])
+        for key in ('type', 'method', 'account', 'state', 'month')
+    }
+    for type_name, row in groups:
+        for key, value in (
+            ('type', type_name),
+            ('method', row['method']),
+            ('account', row['method__account']),
+            ('state', row['state']),
+            ('month', _first_of_month(row['month'])),
+        ):
+            totals[key][value][0] += row['count']
+            totals[key][value][1] += row['amount']
+
+    def by_count(key):
+        return sorted(
+            totals[key].items(), key=lambda item: (-item[1][0], item[0])
+        )
+
+    methods = Method.objects.select_related(
+        'account__user', 'account__bank'
+    ).in_bulk(list(totals['method']))
+    accounts = {m.account_id: m.account for m in methods.values()}
+    state_labels = dict(StateChoices.choices)
+    return {
+        'type': [
+            {'value': value, 'count': count, 'amount': amount}
+            for value, (count, amount) in by_count('type')
+        ],
+        'method': [
+            {
+                'id': value, 'name': methods[value].name,
+                'display_name': str(methods[value]),
+                'count': count, 'amount': amount,
+            }
+            for value, (count, amount) in by_count('method')
+        ],
+        'account': [
+            {
+                'id': value, 'user': accounts[value].user.name,
+                'bank': accounts[value].bank.name,
+                'count': count, 'amount': amount,
+            }
+            for value, (count, amount) in by_count('account')
+        ],
+        'state': [
+            {
+                'value': value, 'label': state_labels[value],
+                'count': count, 'amount': amount,
+            }
+            for value, (count, amount) in by_count('state')
+        ],
+        'month': [
+            {
+                'year': value.year, 'month': value.month,
+                'count': count, 'amount': amount,
+            }
+            for value, (count, amount) in sorted(
+                totals['month'].items(), reverse=True
+            )
+        ],
+    }
@@ -6,19 +6,23 @@ from rest_framework import serializers
 
 from income_and_expense.models import (
     Account, DefaultExpense, DefaultExpenseMonth, DefaultIncome,
-    DefaultIncomeMonth, Expense, Income, Loan, Method, StateChoices,
-    TemplateExpense,
+    DefaultIncomeMonth, Expense, Income, Job, JobStateChoices, Loan, Method,
+    StateChoices, TemplateExpense,
 )
 
 
-def is_valid_pay_date(pay_date):
-    """1か月前以降の日付か。"""
+def earliest_valid_pay_date():
+    """指定できる最も古い支払日(1か月前の日付)。"""
     current_time = timezone.now()
     current_date = datetime.date(
         current_time.year, current_time.month, current_time.day
     )
-    one_month_ago_date = current_date - relativedelta(months=1)
-    return pay_date >= one_month_ago_date
+    return current_date - relativedelta(months=1)
+
+
+def is_valid_pay_date(pay_date):
+    """1か月前以降の日付か。"""
+    return pay_date >= earliest_valid_pay_date()
 
 
 class MethodSerializer(serializers.ModelSerializer):
@@ -79,6 +83,59 @@ class ExpenseSerializer(_InexSerializerBase):
         ]
 
 
+class _CompactInexListSerializer(serializers.ListSerializer):
+    """状態名と口座の表を一覧全体で1回だけ作り、各行で参照する。"""
+
+    def to_representation(self, data):
+        state_labels = dict(StateChoices.choices)
+        accounts = {}
+        rows = []
+        for row in data:
+            account_id = row['method__account']
+            account = accounts.get(account_id)
+            if account is None:
+                account = accounts[account_id] = {
+                    'id': account_id,
+                    'user': row['method__account__user__name'],
+                    'bank': row['method__account__bank__name'],
+                }
+            rows.append({
+                'id': row['id'],
+                'name': row['name'],
+                'pay_date': row['pay_date'].isoformat(),
+                'method': row['method'],
+                'method_name': row['method__name'],
+                'account': account,
+                'amount': row['amount'],
+                'formed_amount': '¥{:,}'.format(row['amount']),
+                'state': row['state'],
+                'state_label': state_labels[row['state']],
+                'memo': row['memo'],
+            })
+        return rows
+
+
+class CompactInexSerializer(serializers.BaseSerializer):
+    """収入・支出一覧の読み取り専用シリアライザ。
+
+    モデルのインスタンスではなく values(*VALUES) の辞書から、
+    IncomeSerializer / ExpenseSerializer と同じ JSON を出力する。
+    """
+    VALUES = (
+        'id', 'name', 'pay_date', 'method', 'amount', 'state', 'memo',
+        'method__name', 'method__account',
+        'method__account__user__name', 'method__account__bank__name',
+    )
+
+    class Meta:
+        list_serializer_class = _CompactInexListSerializer
+
+    def to_representation(self, instance):
+        return _CompactInexListSerializer(child=self).to_representation(
+            [instance]
+        )[0]
+
+
 class LoanSerializer(serializers.ModelSerializer):
     method_name = serializers.CharField(source='method.name', read_only=True)
     account = serializers.SerializerMethodField()
@@ -134,6 +191,8 @@ class _DefaultInexSerializerBase(serializers.ModelSerializer):
 
     month_model = None
     month_fk = None
+    # 月の逆参照名(ViewSet で prefetch_related する)
+    month_related = None
 
     def get_account(self, obj):
         acc = obj.method.account
@@ -152,19 +211,20 @@ class _DefaultInexSerializerBase(serializers.ModelSerializer):
         return sorted(value)
 
     def _sync_months(self, instance, months):
-        existing = {
-            m.month: m for m in
-            self.month_model.objects.filter(**{self.month_fk: instance})
-        }
+        related = self.month_model.objects.filter(**{self.month_fk: instance})
+        existing = set(related.values_list('month', flat=True))
         target = set(months)
-        for month, obj in existing.items():
-            if month not in target:
-                obj.delete()
-        for month in target:
-            if month not in existing:
-                self.month_model.objects.create(
-                    month=month, **{self.month_fk: instance}
-                )
+        if existing - target:
+            related.exclude(month__in=target).delete()
+        if target - existing:
+            self.month_model.objects.bulk_create([
+                self.month_model(month=month, **{self.month_fk: instance})
+                for month in sorted(target - existing)
+            ])
+        # prefetch 済みの月は古くなっているため破棄する
+        getattr(instance, '_prefetched_objects_cache', {}).pop(
+            self.month_related, None
+        )
 
     def create(self, validated_data):
         months = validated_data.pop('months', [])
@@ -179,10 +239,19 @@ class _DefaultInexSerializerBase(serializers.ModelSerializer):
             self._sync_months(instance, months)
         return instance
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # prefetch 済みであれば追加のクエリは発生しない
+        data['months'] = sorted(
+            m.month for m in getattr(instance, self.month_related).all()
+        )
+        return data
+
 
 class DefaultIncomeSerializer(_DefaultInexSerializerBase):
     month_model = DefaultIncomeMonth
     month_fk = 'def_inc'
+    month_related = 'defaultincomemonth_set'
 
     class Meta:
         model = DefaultIncome
@@ -192,20 +261,11 @@ class DefaultIncomeSerializer(_DefaultInexSerializerBase):
             'state', 'state_label', 'months',
         ]
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        data['months'] = list(
-            DefaultIncomeMonth.objects
-            .filter(def_inc=instance)
-            .order_by('month')
-            .values_list('month', flat=True)
-        )
-        return data
-
 
 class DefaultExpenseSerializer(_DefaultInexSerializerBase):
     month_model = DefaultExpenseMonth
     month_fk = 'def_exp'
+    month_related = 'defaultexpensemonth_set'
 
     class Meta:
         model = DefaultExpense
@@ -215,16 +275,6 @@ class DefaultExpenseSerializer(_DefaultInexSerializerBase):
             'state', 'state_label', 'months',
         ]
 
-    def to_representation(self, instance):
-        data = super().to_representation(instance)
-        data['months'] = list(
-            DefaultExpenseMonth.objects
-            .filter(def_exp=instance)
-            .order_by('month')
-            .values_list('month', flat=True)
-        )
-        return data
-
 
 class TemplateExpenseSerializer(serializers.ModelSerializer):
     method_name = serializers.SerializerMethodField()
@@ -257,3 +307,87 @@ class TemplateExpenseSerializer(serializers.ModelSerializer):
             if obj.pay_day < obj.limit_day_of_this_month:
                 pay_date += relativedelta(months=1)
         return pay_date.strftime('%Y-%m-%d')
+
+
+class StatementImportSerializer(serializers.Serializer):
+    """明細 CSV 取り込みの指定。列名は明細の見出しに合わせて指定する。"""
+    file = serializers.FileField()
+    method = serializers.PrimaryKeyRelatedField(queryset=Method.objects.all())
+    date_column = serializers.CharField(default='date')
+    name_column = serializers.CharField(default='name')
+    amount_column = serializers.CharField(default='amount')
+    memo_column = serializers.CharField(required=False, allow_blank=True)
+    date_format = serializers.CharField(default='%Y-%m-%d')
+    encoding = serializers.ChoiceField(
+        choices=['utf-8-sig', 'cp932'], default='utf-8-sig'
+    )
+    state = serializers.ChoiceField(
+        choices=StateChoices.choices, default=StateChoices.UNDECIDED
+    )
+    dry_run = serializers.BooleanField(default=False)
+
+
+class StateTransitionSerializer(serializers.Serializer):
+    """状態の一括変更の指定。期間は year/month か date_from/date_to で指定する。"""
+    to_state = serializers.ChoiceField(choices=StateChoices.choices)
+    from_states = serializers.ListField(
+        child=serializers.ChoiceField(choices=StateChoices.choices),
+        required=False, allow_empty=False,
+    )
+    year = serializers.IntegerField(
+        required=False, min_value=1, max_value=9999
+    )
+    month = serializers.IntegerField(
+        required=False, min_value=1, max_value=12
+    )
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    method = serializers.PrimaryKeyRelatedField(
+        queryset=Method.objects.all(), required=False
+    )
+    account = serializers.PrimaryKeyRelatedField(
+        queryset=Account.objects.all(), required=False
+    )
+    name = serializers.CharField(required=False)
+
+    def validate(self, data):
+        if 'year' in data and 'month' in data:
+            first_date = datetime.date(data.pop('year'), data.pop('month'), 1)
+            data['date_from'] = first_date
+            data['date_to'] = (
+                first_date + relativedelta(months=1)
+                - datetime.timedelta(days=1)
+            )
+        elif 'year' in data or 'month' in data:
+            raise serializers.ValidationError(
+                'year と month は両方指定してください'
+            )
+        if 'date_from' not in data or 'date_to' not in data:
+            raise serializers.ValidationError(
+                'year/month または date_from/date_to で期間を指定してください'
+            )
+        if data['date_from'] > data['date_to']:
+            raise serializers.ValidationError(
+                'date_to は date_from 以降を指定してください'
+            )
+        for key in ('method', 'account'):
+            if key in data:
+                data[key] = data[key].pk
+        return data
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """ジョブの状態(params は大きくなりうるため含めない)。"""
+    state_label = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'state', 'state_label', 'result', 'error',
+            'attempts', 'max_attempts', 'run_after',
+            'created_at', 'started_at', 'heartbeat_at', 'finished_at',
+        ]
+        read_only_fields = fields
+
+    def get_state_label(self, obj):
+        return JobStateChoices(obj.state).label
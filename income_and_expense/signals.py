@@ -0,0 +1,167 @@
+import collections
+import contextlib
+import threading
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from income_and_expense import (
+    balances, journal, ledger, summaries, versions,
+)
+from income_and_expense.models import (
+    Account, Bank, Expense, Income, Method, User,
+)
+
+# 収支が変更されたことを通知する。bulk_create / update 等、モデルの
+# シグナルが送られない一括処理からも notify_inex_changed で送る。
+# dates には変更のあった収支の変更前後の支払日を渡す(口座別残高台帳は
+# その日の分だけを集計し直す)。changes には行ごとの変更前後の
+# summaries.row の値を渡す(月別集計は差分を加える。None なら dates の月を
+# 作り直す)。
+inex_changed = Signal()
+
+_local = threading.local()
+
+
+def notify_inex_changed(sender, dates, changes=None):
+    """収支の変更を通知する。sender は Income または Expense。
+
+    changes は (変更前, 変更後) のリスト(行がない側は None)。
+    """
+    dates = {d for d in dates if d is not None}
+    if not dates:
+        return
+    changes = list(changes) if changes is not None else None
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is not None:
+        pending = buffer[sender]
+        pending['dates'].update(dates)
+        if pending['changes'] is not None and changes is not None:
+            pending['changes'] += changes
+        else:
+            pending['changes'] = None
+        return
+    inex_changed.send(sender=sender, dates=dates, changes=changes)
+
+
+def notify_inex_created(sender, objs):
+    """bulk_create 等で作成した収支を通知する。"""
+    notify_inex_changed(
+        sender, [obj.pay_date for obj in objs],
+        [(None, summaries.row(obj)) for obj in objs],
+    )
+
+
+@contextlib.contextmanager
+def collect():
+    """中で通知した変更を溜めておき、抜けるときにモデルごとに1回で通知する。
+
+    QuerySet.delete() のように行ごとにシグナルを送る処理でも、変更の反映
+    (台帳・月別集計等)はまとめて1回で行う。入れ子にした場合は一番外側で
+    通知する。例外で抜けた場合は通知しない。
+    """
+    if getattr(_local, 'buffer', None) is not None:
+        yield
+        return
+    _local.buffer = collections.defaultdict(
+        lambda: {'dates': set(), 'changes': []}
+    )
+    try:
+        yield
+        buffer = _local.buffer
+    finally:
+        _local.buffer = None
+    for sender, pending in buffer.items():
+        inex_changed.send(sender=sender, **pending)
+
+
+@receiver(post_save, sender=Income)
+@receiver(post_save, sender=Expense)
+@receiver(post_delete, sender=Income)
+@receiver(post_delete, sender=Expense)
+def inex_saved_or_deleted(sender, instance, signal, created=False,
+                          **kwargs):
+    """収支の保存・削除時、変更前後の支払日と値で変更を通知する。"""
+    before = None if created else summaries.loaded_row(instance)
+    after = None if signal is post_delete else summaries.row(instance)
+    # 読み込み時点の値が分からない行は、集計を月ごと作り直させる
+    changes = None if before is None and not created else [(before, after)]
+    notify_inex_changed(
+        sender, [instance.loaded_value('pay_date'), instance.pay_date],
+        changes,
+    )
+
+
+@receiver(post_save, sender=Income)
+@receiver(post_save, sender=Expense)
+def record_inex_saved(sender, instance, created, **kwargs):
+    """収支の保存を変更の記録に追記する。"""
+    if created:
+        journal.record_created(sender, [instance])
+    else:
+        journal.record_updated(sender, [instance])
+
+
+@receiver(post_delete, sender=Income)
+@receiver(post_delete, sender=Expense)
+def record_inex_deleted(sender, instance, **kwargs):
+    """収支の削除を変更の記録に追記する。"""
+    journal.record_deleted(sender, [instance])
+
+
+# 受信側は登録順に呼ばれる。バージョンの更新を最初に行い、同じ月を変更する
+# トランザクションをその行のロックで順番に処理させる(月別集計の更新が
+# 並行して古い集計で上書きしないようにするため)。
+@receiver(inex_changed)
+def bump_month_versions(sender, dates, **kwargs):
+    """変更のあった月のバージョンを上げる。"""
+    versions.bump_months(dates)
+
+
+@receiver(inex_changed)
+def update_month_summaries(sender, dates, changes=None, **kwargs):
+    """変更した行の差分を月別集計に加える(変更前後の値がなければ月ごと作り直す)。"""
+    if changes is None:
+        summaries.refresh_months(sender, dates)
+    else:
+        summaries.apply_changes(sender, changes)
+
+
+@receiver(inex_changed)
+def invalidate_balance_snapshots(sender, dates, **kwargs):
+    """変更のあった最も古い月以降の月末残高スナップショットを破棄する。"""
+    balances.invalidate_snapshots(*dates)
+
+
+@receiver(inex_changed)
+def update_account_ledger(sender, dates, **kwargs):
+    """変更のあった日の増減を口座別残高台帳に反映する。"""
+    ledger.apply_changes(dates)
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_save, sender=Method)
+@receiver(post_save, sender=Bank)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=Account)
+@receiver(post_delete, sender=Method)
+@receiver(post_delete, sender=Bank)
+@receiver(post_delete, sender=User)
+def master_saved_or_deleted(sender, instance, **kwargs):
+    """口座・支払方法等の変更は全月の表示に影響するためバージョンを上げる。"""
+    versions.bump_global()
+
+
+@receiver(post_save, sender=Method)
+def method_saved(sender, instance, created, **kwargs):
+    """支払方法の口座が変わると過去の収支の口座も変わるため台帳を作り直す。"""
+    if created or instance.loaded_value('account_id') == instance.account_id:
+        return
+    dates = [
+        model.objects.filter(method=instance)
+        .order_by('pay_date').values_list('pay_date', flat=True).first()
+        for model in (Income, Expense)
+    ]
+    dates = [d for d in dates if d is not None]
+    if dates:
+        ledger.rebuild_from(min(dates))
@@ -0,0 +1,234 @@
+"""収入・支出の月別集計(月・支払方法・状態ごとの件数と金額)の更新と参照。
+
+集計表は収支の変更通知(signals.inex_changed)を受けて、同じトランザクション
+内で更新する。通知に変更前後の行の値(changes)があれば、その差分を該当する
+集計の行の件数・金額に加える(コストは変更した行の数に比例し、月の収支の
+件数によらない)。変更のあった日しか分からない通知では、その月の分を
+作り直す。月別の合計・必要金額・残高等の集計はこの表から行うため、コストは
+収支の件数ではなく支払方法の数に比例する。
+"""
+import collections
+import functools
+import operator
+
+from dateutil.relativedelta import relativedelta
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncMonth
+
+from income_and_expense.models import (
+    Expense, ExpenseMonthSummary, Income, IncomeMonthSummary, MonthVersion,
+    StateChoices,
+)
+
+SUMMARY_MODELS = {
+    Income: IncomeMonthSummary,
+    Expense: ExpenseMonthSummary,
+}
+
+
+def _month_q(months):
+    """指定した月(初日)のいずれかに含まれる支払日の条件。"""
+    return functools.reduce(operator.or_, [
+        Q(pay_date__gte=m, pay_date__lt=m + relativedelta(months=1))
+        for m in months
+    ])
+
+
+def _summarize(model, source):
+    summary_model = SUMMARY_MODELS[model]
+    rows = (
+        source.annotate(m=TruncMonth('pay_date'))
+        .values('m', 'method', 'state')
+        .annotate(count=Count('id'), total=Sum('amount'))
+        .order_by()
+    )
+    return [
+        summary_model(
+            month=r['m'], method_id=r['method'], state=r['state'],
+            count=r['count'], amount=r['total'],
+        )
+        for r in rows
+    ]
+
+
+def row(instance):
+    """集計に使う行の値 (支払日, 支払方法ID, 状態, 金額)。"""
+    return (
+        instance.pay_date, instance.method_id, instance.state,
+        instance.amount,
+    )
+
+
+def loaded_row(instance):
+    """読み込み時点の row の値。読み込んでいない項目があれば None。"""
+    values = tuple(
+        instance.loaded_value(attname)
+        for attname in ('pay_date', 'method_id', 'state', 'amount')
+    )
+    return None if None in values else values
+
+
+def _lock_months(months):
+    # 同じ月を同時に更新すると、後から終わった方が古い集計で上書きする
+    # おそれがあるため、月のバージョンの行をロックして順番に行う
+    list(
+        MonthVersion.objects.select_for_update()
+        .filter(month__in=months).values_list('id', flat=True)
+    )
+
+
+def refresh_months(model, dates):
+    """指定日を含む月の集計を作り直す。"""
+    months = sorted({d.replace(day=1) for d in dates})
+    if not months:
+        return
+    summary_model = SUMMARY_MODELS[model]
+    with transaction.atomic():
+        _lock_months(months)
+        summary_model.objects.filter(month__in=months).delete()
+        summary_model.objects.bulk_create(
+            _summarize(model, model.objects.filter(_month_q(months)))
+        )
+
+
+def apply_changes(model, changes):
+    """行の変更前後の値の差分を集計に加える。
+
+    Parameters
+    ----------
+    model : Model
+        Income または Expense
+    changes : iterable of tuple
+        (変更前, 変更後) のリスト。それぞれ row の値、または行がない場合は
+        None
+    """
+    deltas = collections.defaultdict(lambda: [0, 0])
+    for before, after in changes:
+        for sign, values in ((-1, before), (1, after)):
+            if values is None:
+                continue
+            pay_date, method_id, state, amount = values
+            delta = deltas[(pay_date.replace(day=1), method_id, state)]
+            delta[0] += sign
+            delta[1] += sign * amount
+    deltas = {key: d for key, d in deltas.items() if d != [0, 0]}
+    if not deltas:
+        return
+    months = sorted({key[0] for key in deltas})
+    summary_model = SUMMARY_MODELS[model]
+    with transaction.atomic():
+        _lock_months(months)
+        stored = {
+            (s.month, s.method_id, s.state): s
+            for s in summary_model.objects.filter(month__in=months)
+        }
+        creates, updates, deletes = [], [], []
+        for (month, method_id, state), (count, amount) in deltas.items():
+            summary = stored.get((month, method_id, state))
+            if summary is None:
+                creates.append(summary_model(
+                    month=month, method_id=method_id, state=state,
+                    count=count, amount=amount,
+                ))
+                continue
+            summary.count += count
+            summary.amount += amount
+            if summary.count:
+                updates.append(summary)
+            else:
+                deletes.append(summary.pk)
+        if deletes:
+            summary_model.objects.filter(pk__in=deletes).delete()
+        if updates:
+            summary_model.objects.bulk_update(updates, ['count', 'amount'])
+        summary_model.objects.bulk_create(creates)
+
+
+def rebuild():
+    """全期間の集計を作り直す。作成件数を返す。"""
+    created = 0
+    with transaction.atomic():
+        for model, summary_model in SUMMARY_MODELS.items():
+            summary_model.objects.all().delete()
+            rows = _summarize(model, model.objects.all())
+            summary_model.objects.bulk_create(rows, batch_size=2000)
+            created += len(rows)
+    return created
+
+
+def check():
+    """保存済みの集計と収支からの再集計を比較し、不一致を返す。
+
+    Returns
+    -------
+    list of dict
+        model, month, method, state, count, amount, expected_count,
+        expected_amount(片方にしかない行は値が None)
+    """
+    mismatches = []
+    for model, summary_model in SUMMARY_MODELS.items():
+        stored = {
+            (s.month, s.method_id, s.state): (s.count, s.amount)
+            for s in summary_model.objects.all()
+        }
+        expected = {
+            (s.month, s.method_id, s.state): (s.count, s.amount)
+            for s in _summarize(model, model.objects.all())
+        }
+        for key in sorted(stored.keys() | expected.keys()):
+            got = stored.get(key, (None, None))
+            want = expected.get(key, (None, None))
+            if got != want:
+                mismatches.append({
+                    'model': model.__name__,
+                    'month': key[0], 'method': key[1], 'state': key[2],
+                    'count': got[0], 'amount': got[1],
+                    'expected_count': want[0], 'expected_amount': want[1],
+                })
+    return mismatches
+
+
+def month_total(model, first_date):
+    """該当月の合計金額(全状態)。"""
+    return SUMMARY_MODELS[model].objects.filter(month=first_date).aggregate(
+        total=Sum('amount')
+    )['total'] or 0
+
+
+def month_totals_queryset(model, start_first, end_first):
+    """month_totals の集計の QuerySet(month, total)。"""
+    return (
+        SUMMARY_MODELS[model].objects
+        .filter(month__gte=start_first, month__lte=end_first)
+        .values('month')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+
+
+def month_totals(model, start_first, end_first):
+    """開始月〜終了月の月別合計(全状態)を、月の初日をキーとする辞書で返す。"""
+    rows = month_totals_queryset(model, start_first, end_first)
+    return {r['month']: r['total'] or 0 for r in rows}
+
+
+def month_sums_queryset(model, start_first, end_first):
+    """month_sums の集計の QuerySet(month, total, done)。"""
+    qs = SUMMARY_MODELS[model].objects.filter(month__lte=end_first)
+    if start_first is not None:
+        qs = qs.filter(month__gte=start_first)
+    return (
+        qs.values('month')
+        .annotate(
+            total=Sum('amount'),
+            done=Sum('amount', filter=Q(state=StateChoices.DONE)),
+        )
+        .order_by()
+    )
+
+
+def month_sums(model, start_first, end_first):
+    """月別の合計(全状態, 完了分)。start_first が None なら最古の月から。"""
+    rows = month_sums_queryset(model, start_first, end_first)
+    return {r['month']: (r['total'] or 0, r['done'] or 0) for r in rows}
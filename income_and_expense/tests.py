@@ -1,3 +1,1819 @@
+import base64
+import datetime
+import io
+import json
+import random
+from unittest import mock
+
+from dateutil.relativedelta import relativedelta
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q, Sum
+from django.db.models.signals import post_delete
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from income_and_expense import (
+    aggregations, balances, defaults, forecast, imports, jobs, ledger,
+    metrics, search, signals, summaries, transitions, trends, versions,
+)
+from income_and_expense.models import (
+    Account, AccountLedger, BalanceSnapshot, Bank, DefaultExpense,
+    DefaultExpenseMonth, DefaultIncome, DefaultIncomeMonth, Expense,
+    ExpenseMonthSummary, Income, InexChange, Job, JobStateChoices, Loan,
+    Method, StateChoices, StateTransition, User,
+)
+from income_and_expense.serializers import (
+    CompactInexSerializer, ExpenseSerializer, IncomeSerializer,
+    MethodSerializer,
+)
+
+
+def create_account(bank='銀行', user='ユーザー', balance=0):
+    """口座を作る。bank・user は名前(なければ作る)または作成済みの行。"""
+    if isinstance(bank, str):
+        bank = Bank.objects.get_or_create(name=bank)[0]
+    if isinstance(user, str):
+        user = User.objects.get_or_create(name=user)[0]
+    return Account.objects.create(bank=bank, user=user, balance=balance)
+
+
+def create_method(name='カード', account=None):
+    """支払方法を作る。account を省略した場合は口座も create_account で作る。"""
+    return Method.objects.create(
+        name=name, account=account or create_account()
+    )
+
+
+class APITestCase(TestCase):
+    """API のテストの基底クラス。
+
+    認証済みの APIClient を self.client、そのログインユーザーを
+    self.login_user に用意する。
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.login_user = get_user_model().objects.create_user('tester')
+        self.client.force_authenticate(self.login_user)
+
+
+class AccountRequireAPIViewTests(APITestCase):
+    """口座別必要金額APIのクエリ数と集計結果。"""
+
+    def setUp(self):
+        super().setUp()
+        self.pay_date = datetime.date(2024, 4, 10)
+
+    def _add_account(self, bank_name, balance, amounts):
+        account = create_account(bank_name, balance=balance)
+        method = create_method('引き落とし', account)
+        for amount, state in amounts:
+            Expense.objects.create(
+                name='支出', pay_date=self.pay_date, method=method,
+                amount=amount, state=state,
+            )
+        return account
+
+    def _get(self):
+        return self.client.get(
+            '/api/account_require/', {'year': 2024, 'month': 4}
+        )
+
+    def test_query_count_is_constant(self):
+        self._add_account('銀行A', 0, [(100, StateChoices.UNDECIDED)])
+        with self.assertNumQueries(2):
+            self._get()
+
+        for i in range(5):
+            self._add_account(
+                '銀行B{0}'.format(i), 0, [(100, StateChoices.DECIDED)]
+            )
+        with self.assertNumQueries(2):
+            self._get()
+
+    def test_require_and_insufficient(self):
+        short = self._add_account('銀行A', 100, [
+            (300, StateChoices.UNDECIDED),
+            (200, StateChoices.DECIDED),
+            (1000, StateChoices.DONE),
+        ])
+        enough = self._add_account('銀行B', 1000, [
+            (400, StateChoices.UNDECIDED),
+        ])
+        empty = self._add_account('銀行C', 50, [])
+
+        data = self._get().data
+        rows = {r['id']: r for r in data['accounts']}
+        self.assertEqual(rows[short.id]['require'], 500)
+        self.assertEqual(rows[short.id]['insufficient_amount'], 400)
+        self.assertTrue(rows[short.id]['is_insufficient'])
+        self.assertEqual(rows[enough.id]['require'], 400)
+        self.assertFalse(rows[enough.id]['is_insufficient'])
+        self.assertEqual(rows[empty.id]['require'], 0)
+        self.assertEqual(data['require_sum'], 900)
+        self.assertEqual(data['insufficient_sum'], 400)
+
+
+class AccountShortfallAPIViewTests(APITestCase):
+    """口座別の月内の最小残高・不足額。"""
+
+    def setUp(self):
+        super().setUp()
+        self.april = datetime.date(2024, 4, 1)
+
+    def _add_account(self, balance, flows):
+        account = create_account('銀行', '利用者{0}'.format(balance), balance)
+        method = create_method('口座振替', account)
+        for model, day, amount, state in flows:
+            model.objects.create(
+                name='収支', pay_date=self.april.replace(day=day),
+                method=method, amount=amount, state=state,
+            )
+        return account
+
+    def _row(self, account):
+        response = self.client.get(
+            '/api/account_shortfall/', {'year': 2024, 'month': 4}
+        )
+        self.assertEqual(response.status_code, 200)
+        return next(
+            r for r in response.data['accounts'] if r['id'] == account.pk
+        )
+
+    def test_never_short(self):
+        account = self._add_account(1000, [
+            (Income, 5, 100, StateChoices.UNDECIDED),
+            (Expense, 10, 300, StateChoices.UNDECIDED),
+        ])
+        row = self._row(account)
+        self.assertEqual(row['min_balance'], 800)
+        self.assertEqual(row['min_date'], datetime.date(2024, 4, 10))
+        self.assertIsNone(row['first_short_date'])
+        self.assertEqual(row['shortfall'], 0)
+        self.assertFalse(row['is_short'])
+
+    def test_short_in_the_middle_of_month(self):
+        account = self._add_account(100, [
+            (Expense, 5, 300, StateChoices.UNDECIDED),
+            (Income, 6, 500, StateChoices.UNDECIDED),
+        ])
+        row = self._row(account)
+        self.assertEqual(row['min_balance'], -200)
+        self.assertEqual(row['first_short_date'], datetime.date(2024, 4, 5))
+        self.assertEqual(row['closing_balance'], 300)
+        self.assertEqual(row['shortfall'], 200)
+        self.assertTrue(row['is_short'])
+
+    def test_negative_opening_balance(self):
+        account = self._add_account(-100, [
+            (Income, 5, 500, StateChoices.UNDECIDED),
+            (Expense, 20, 50, StateChoices.UNDECIDED),
+        ])
+        row = self._row(account)
+        self.assertEqual(row['min_balance'], -100)
+        self.assertEqual(row['first_short_date'], self.april)
+        self.assertEqual(row['shortfall'], 100)
+        self.assertTrue(row['is_short'])
+
+    def test_done_rows_are_excluded(self):
+        account = self._add_account(100, [
+            (Expense, 3, 500, StateChoices.DONE),
+            (Income, 4, 1000, StateChoices.DONE),
+            (Expense, 10, 50, StateChoices.DECIDED),
+        ])
+        other = self._add_account(0, [])
+        response = self.client.get(
+            '/api/account_shortfall/', {'year': 2024, 'month': 4}
+        )
+        rows = {r['id']: r for r in response.data['accounts']}
+        self.assertEqual(
+            rows[account.pk]['points'],
+            [{'date': datetime.date(2024, 4, 10), 'balance': 50}],
+        )
+        self.assertEqual(rows[account.pk]['min_balance'], 50)
+        self.assertEqual(rows[other.pk]['points'], [])
+        self.assertEqual(response.data['shortfall_sum'], 0)
+
+
+class MethodRequireAPIViewTests(APITestCase):
+    """支払方法別必要金額APIのクエリ数と集計結果。"""
+
+    def test_query_count_and_require(self):
+        account = create_account()
+        methods = [
+            create_method('振込{0}'.format(i), account) for i in range(4)
+        ]
+        for i, method in enumerate(methods):
+            for state in StateChoices.values:
+                Expense.objects.create(
+                    name='支出', pay_date=datetime.date(2024, 4, 1),
+                    method=method, amount=(i + 1) * 100, state=state,
+                )
+
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                '/api/method_require/', {'year': 2024, 'month': 4}
+            )
+        rows = {r['id']: r for r in response.data['methods']}
+        for i, method in enumerate(methods):
+            self.assertEqual(rows[method.id]['require'], (i + 1) * 200)
+        self.assertEqual(response.data['require_sum'], 2000)
+
+
+class DefaultIncomeAPITests(APITestCase):
+    """デフォルト収入APIの適用月の取得・更新のクエリ数。"""
+
+    def setUp(self):
+        super().setUp()
+        self.method = create_method('振込')
+
+    def _add_default(self, name, months):
+        default = DefaultIncome.objects.create(
+            name=name, pay_day=25, method=self.method, amount=1000,
+        )
+        DefaultIncomeMonth.objects.bulk_create([
+            DefaultIncomeMonth(month=m, def_inc=default) for m in months
+        ])
+        return default
+
+    def test_list_query_count_is_constant(self):
+        self._add_default('給与0', [12, 1, 6])
+        with self.assertNumQueries(2):
+            self.client.get('/api/default_incomes/')
+
+        for i in range(1, 20):
+            self._add_default('給与{0}'.format(i), range(1, 13))
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/default_incomes/')
+        months = {r['name']: r['months'] for r in response.data}
+        self.assertEqual(months['給与0'], [1, 6, 12])
+        self.assertEqual(months['給与1'], list(range(1, 13)))
+
+    def test_update_months_is_set_based(self):
+        default = self._add_default('給与', range(1, 13))
+        url = '/api/default_incomes/{0}/'.format(default.id)
+
+        # 10か月分の削除も1クエリで行う
+        with self.assertNumQueries(6):
+            response = self.client.patch(
+                url, {'months': [6, 1]}, format='json'
+            )
+        self.assertEqual(response.data['months'], [1, 6])
+
+        # 削除と追加がある場合も月数によらない
+        with self.assertNumQueries(7):
+            response = self.client.patch(
+                url, {'months': [2, 4, 6, 8, 10, 12]}, format='json'
+            )
+        self.assertEqual(response.data['months'], [2, 4, 6, 8, 10, 12])
+        self.assertEqual(
+            sorted(
+                DefaultIncomeMonth.objects.filter(def_inc=default)
+                .values_list('month', flat=True)
+            ),
+            [2, 4, 6, 8, 10, 12],
+        )
+
+
+class DefaultsRangeTests(APITestCase):
+    """デフォルト・ローンからの複数月の一括追加。"""
+
+    def setUp(self):
+        super().setUp()
+        self.method = create_method('カード', create_account('銀行A'))
+        self.other_method = create_method('振込', create_account('銀行B'))
+        for i, method in enumerate((self.method, self.other_method)):
+            for pay_day in (5, 15, 25):
+                default = DefaultExpense.objects.create(
+                    name='支出{0}-{1}'.format(i, pay_day), pay_day=pay_day,
+                    method=method, amount=100,
+                )
+                DefaultExpenseMonth.objects.bulk_create([
+                    DefaultExpenseMonth(def_exp=default, month=m)
+                    for m in range(1, 13)
+                ])
+
+    def _add_range(self, start, end):
+        return defaults.add_expenses_from_default_and_loan_range(
+            start.year, start.month, end.year, end.month
+        )
+
+    def test_query_count_does_not_depend_on_months(self):
+        # 台帳・月別集計等の更新も月数によらない
+        with self.assertNumQueries(29):
+            added = self._add_range(
+                datetime.date(2030, 1, 1), datetime.date(2030, 1, 1)
+            )
+        self.assertEqual(sum(added.values()), 6)
+        with self.assertNumQueries(29):
+            added = self._add_range(
+                datetime.date(2031, 1, 1), datetime.date(2031, 12, 1)
+            )
+        self.assertEqual(sum(added.values()), 72)
+        self.assertEqual(ledger.check(), [])
+
+    def _post_range(self, sy, sm, ey, em):
+        return self.client.post(
+            '/api/expenses/add_defaults_range/?start_year={0}&start_month={1}'
+            '&end_year={2}&end_month={3}'.format(sy, sm, ey, em)
+        )
+
+    def test_added_counts_and_loan_amounts(self):
+        Loan.objects.create(
+            name='ローン', pay_day=10, first_year=2030, first_month=12,
+            last_year=2031, last_month=2, method=self.method,
+            amount_first=500, amount_from_second=300,
+        )
+        response = self._post_range(2030, 11, 2031, 3)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['added'], 6 * 5 + 3)
+        self.assertEqual(
+            [(m['year'], m['month'], m['added'])
+             for m in response.data['months']],
+            [(2030, 11, 6), (2030, 12, 7), (2031, 1, 7), (2031, 2, 7),
+             (2031, 3, 6)],
+        )
+        # 初月は amount_first、2か月目以降は amount_from_second
+        self.assertEqual(
+            list(
+                Expense.objects.filter(name='ローン').order_by('pay_date')
+                .values_list('pay_date', 'amount')
+            ),
+            [
+                (datetime.date(2030, 12, 10), 500),
+                (datetime.date(2031, 1, 10), 300),
+                (datetime.date(2031, 2, 10), 300),
+            ],
+        )
+
+    def test_second_call_adds_nothing(self):
+        self.assertEqual(
+            self._post_range(2030, 11, 2031, 2).data['added'], 24
+        )
+        response = self._post_range(2030, 11, 2031, 2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['added'], 0)
+        self.assertEqual(
+            [m['added'] for m in response.data['months']], [0, 0, 0, 0]
+        )
+        self.assertEqual(Expense.objects.count(), 24)
+
+    def test_invalid_range_is_rejected(self):
+        for params in (
+            (2031, 2, 2030, 11),  # 終了月が開始月より前
+            (2030, 1, 2035, 1),  # 61か月
+            (2000, 1, 2000, 2),  # 過去の月
+            (2030, 13, 2031, 1),  # 存在しない月
+        ):
+            with self.subTest(params=params):
+                response = self._post_range(*params)
+                self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/expenses/add_defaults_range/?start_year=2030&start_month=1'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Expense.objects.exists())
+
+
+class LoanAPITests(APITestCase):
+    """ローンの返済スケジュール・返済状況・期間内の返済額。"""
+
+    def setUp(self):
+        super().setUp()
+        method = create_method()
+        # 年をまたぐローン(2024年11月〜2025年3月)
+        self.loan = Loan.objects.create(
+            name='自動車ローン', pay_day=27, first_year=2024, first_month=11,
+            last_year=2025, last_month=3, method=method,
+            amount_first=1000, amount_from_second=500,
+        )
+        # 1回だけのローン
+        self.single = Loan.objects.create(
+            name='一括払い', pay_day=10, first_year=2025, first_month=2,
+            last_year=2025, last_month=2, method=method,
+            amount_first=700, amount_from_second=100,
+        )
+
+    def _schedule(self, **params):
+        response = self.client.get(
+            '/api/loans/{0}/schedule/'.format(self.loan.pk), params
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            (p['pay_date'], p['amount']) for p in response.data['payments']
+        ]
+
+    def test_schedule(self):
+        self.assertEqual(self._schedule(), [
+            (datetime.date(2024, 11, 27), 1000),
+            (datetime.date(2024, 12, 27), 500),
+            (datetime.date(2025, 1, 27), 500),
+            (datetime.date(2025, 2, 27), 500),
+            (datetime.date(2025, 3, 27), 500),
+        ])
+        # 期間は月単位で、2回目以降の額になる
+        self.assertEqual(
+            self._schedule(date_from='2024-12-15', date_to='2025-01-03'),
+            [
+                (datetime.date(2024, 12, 27), 500),
+                (datetime.date(2025, 1, 27), 500),
+            ],
+        )
+        self.assertEqual(
+            self._schedule(date_from='2024-01-01', date_to='2024-10-31'), []
+        )
+
+    def _progress(self, date):
+        response = self.client.get('/api/loans/progress/', {'date': date})
+        self.assertEqual(response.status_code, 200)
+        return response.data, {r['id']: r for r in response.data['loans']}
+
+    def test_progress(self):
+        data, rows = self._progress('2024-11-26')
+        self.assertEqual(rows[self.loan.pk]['paid_count'], 0)
+        self.assertEqual(rows[self.loan.pk]['remaining_amount'], 3000)
+
+        # 返済日の前日は前月までが返済済み
+        data, rows = self._progress('2024-12-26')
+        row = rows[self.loan.pk]
+        self.assertEqual((row['paid_count'], row['paid_amount']), (1, 1000))
+        data, rows = self._progress('2024-12-27')
+        row = rows[self.loan.pk]
+        self.assertEqual((row['paid_count'], row['paid_amount']), (2, 1500))
+        self.assertEqual(
+            (row['remaining_count'], row['remaining_amount']), (3, 1500)
+        )
+        self.assertEqual(rows[self.single.pk]['remaining_amount'], 700)
+        self.assertEqual(data['paid_amount'], 1500)
+        self.assertEqual(data['remaining_amount'], 2200)
+
+        data, rows = self._progress('2025-03-27')
+        self.assertEqual(data['remaining_amount'], 0)
+        self.assertEqual(data['paid_amount'], 3700)
+
+    def _between(self, sy, sm, ey, em):
+        response = self.client.get('/api/loans/between/', {
+            'start_year': sy, 'start_month': sm,
+            'end_year': ey, 'end_month': em,
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_between_partly_overlapping(self):
+        # ローンの途中から期間が始まり、期間の途中でローンが終わる
+        data = self._between(2025, 1, 2025, 4)
+        self.assertEqual(
+            {r['id']: (r['count'], r['amount']) for r in data['loans']},
+            {self.loan.pk: (3, 1500), self.single.pk: (1, 700)},
+        )
+        self.assertEqual(
+            [(m['year'], m['month'], m['amount']) for m in data['months']],
+            [(2025, 1, 500), (2025, 2, 1200), (2025, 3, 500), (2025, 4, 0)],
+        )
+        self.assertEqual(data['amount'], 2200)
+
+    def test_between_crossing_year_with_first_month(self):
+        data = self._between(2024, 10, 2025, 1)
+        self.assertEqual(
+            {r['id']: (r['count'], r['amount']) for r in data['loans']},
+            {self.loan.pk: (3, 2000)},
+        )
+        self.assertEqual(
+            [(m['year'], m['month'], m['amount']) for m in data['months']],
+            [(2024, 10, 0), (2024, 11, 1000), (2024, 12, 500),
+             (2025, 1, 500)],
+        )
+        self.assertEqual(data['amount'], 2000)
+
+
+class StateTransitionAPITests(APITestCase):
+    """状態の一括変更APIの対象・記録・月別集計。"""
+
+    def setUp(self):
+        super().setUp()
+        self.method = create_method()
+        self.other = create_method('振込', self.method.account)
+
+    def _add(self, name, pay_date, method, state):
+        return Expense.objects.create(
+            name=name, pay_date=pay_date, method=method, amount=100,
+            state=state,
+        )
+
+    def test_transition(self):
+        april = datetime.date(2024, 4, 10)
+        undecided = self._add('電気代', april, self.method,
+                              StateChoices.UNDECIDED)
+        decided = self._add('ガス代', april, self.method,
+                            StateChoices.DECIDED)
+        done = self._add('水道代', april, self.method, StateChoices.DONE)
+        other_method = self._add('電話代', april, self.other,
+                                 StateChoices.DECIDED)
+        other_month = self._add('家賃', datetime.date(2024, 5, 10),
+                                self.method, StateChoices.DECIDED)
+        other_name = self._add('食費', april, self.method,
+                               StateChoices.DECIDED)
+
+        response = self.client.post('/api/expenses/transition/', {
+            'year': 2024, 'month': 4, 'method': self.method.pk,
+            'name': '代', 'to_state': StateChoices.DONE,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 2)
+
+        states = dict(Expense.objects.values_list('pk', 'state'))
+        self.assertEqual(states[undecided.pk], StateChoices.DONE)
+        self.assertEqual(states[decided.pk], StateChoices.DONE)
+        self.assertEqual(states[done.pk], StateChoices.DONE)
+        self.assertEqual(states[other_method.pk], StateChoices.DECIDED)
+        self.assertEqual(states[other_month.pk], StateChoices.DECIDED)
+        self.assertEqual(states[other_name.pk], StateChoices.DECIDED)
+
+        record = StateTransition.objects.get(pk=response.data['transition'])
+        self.assertEqual(record.count, 2)
+        self.assertEqual(record.actor, 'tester')
+        self.assertEqual(record.changes, {
+            str(StateChoices.UNDECIDED): [undecided.pk],
+            str(StateChoices.DECIDED): [decided.pk],
+        })
+        done_count = ExpenseMonthSummary.objects.filter(
+            month=datetime.date(2024, 4, 1), method=self.method,
+            state=StateChoices.DONE,
+        ).get().count
+        self.assertEqual(done_count, 3)
+
+    def test_from_states_and_no_change(self):
+        april = datetime.date(2024, 4, 10)
+        undecided = self._add('電気代', april, self.method,
+                              StateChoices.UNDECIDED)
+        self._add('ガス代', april, self.method, StateChoices.DECIDED)
+        params = {
+            'date_from': '2024-04-01', 'date_to': '2024-04-30',
+            'from_states': [StateChoices.UNDECIDED],
+            'to_state': StateChoices.DECIDED,
+        }
+
+        response = self.client.post(
+            '/api/expenses/transition/', params, format='json'
+        )
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(
+            Expense.objects.get(pk=undecided.pk).state, StateChoices.DECIDED
+        )
+
+        response = self.client.post(
+            '/api/expenses/transition/', params, format='json'
+        )
+        self.assertEqual(response.data, {'updated': 0, 'transition': None})
+        self.assertEqual(StateTransition.objects.count(), 1)
+
+    def test_period_is_required(self):
+        response = self.client.post('/api/expenses/transition/', {
+            'to_state': StateChoices.DONE,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class InexChangeJournalTests(APITestCase):
+    """変更の記録と、過去の時点の月の再現。"""
+
+    def setUp(self):
+        super().setUp()
+        self.method = create_method()
+        today = timezone.localdate()
+        self.first_date = today.replace(day=1)
+        self.pay_date = today
+
+    def _as_of(self, at):
+        response = self.client.get('/api/expenses/as_of/', {
+            'year': self.first_date.year, 'month': self.first_date.month,
+            'at': at.isoformat(),
+        })
+        self.assertEqual(response.status_code, 200)
+        return {
+            r['id']: (r['name'], r['amount'], r['state'])
+            for r in response.data['results']
+        }
+
+    def test_time_travel(self):
+        expense = Expense.objects.create(
+            name='電気代', pay_date=self.pay_date, method=self.method,
+            amount=100,
+        )
+        created = timezone.now()
+
+        expense = Expense.objects.get(pk=expense.pk)
+        expense.amount = 150
+        expense.save()
+        updated = timezone.now()
+
+        self.client.post('/api/expenses/transition/', {
+            'year': self.first_date.year, 'month': self.first_date.month,
+            'to_state': StateChoices.DONE,
+        }, format='json')
+        done = timezone.now()
+
+        response = self.client.post('/api/expenses/batch/', {
+            'operations': [
+                {'op': 'create', 'data': {
+                    'name': 'ガス代', 'pay_date': self.pay_date.isoformat(),
+                    'method': self.method.pk, 'amount': 200,
+                    'state': StateChoices.UNDECIDED,
+                }},
+                {'op': 'delete', 'id': expense.pk},
+            ],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        added = response.data['results'][0]['id']
+
+        self.assertEqual(self._as_of(created), {
+            expense.pk: ('電気代', 100, StateChoices.UNDECIDED),
+        })
+        self.assertEqual(self._as_of(updated), {
+            expense.pk: ('電気代', 150, StateChoices.UNDECIDED),
+        })
+        self.assertEqual(self._as_of(done), {
+            expense.pk: ('電気代', 150, StateChoices.DONE),
+        })
+        self.assertEqual(self._as_of(timezone.now()), {
+            added: ('ガス代', 200, StateChoices.UNDECIDED),
+        })
+
+        history = self.client.get(
+            '/api/expenses/{0}/history/'.format(expense.pk)
+        ).data
+        self.assertEqual([e['op'] for e in history], ['c', 'u', 'u', 'd'])
+        self.assertEqual(history[1]['data'], {'amount': [100, 150]})
+        self.assertEqual(
+            history[2]['data'],
+            {'state': [StateChoices.UNDECIDED, StateChoices.DONE]},
+        )
+
+    def test_batch_writes_one_insert(self):
+        expenses = [
+            Expense.objects.create(
+                name='支出{0}'.format(i), pay_date=self.pay_date,
+                method=self.method, amount=100,
+            )
+            for i in range(3)
+        ]
+        InexChange.objects.all().delete()
+
+        self.client.post('/api/expenses/batch/', {
+            'operations': [
+                {'op': 'delete', 'id': expense.pk} for expense in expenses
+            ],
+        }, format='json')
+        self.assertEqual(InexChange.objects.filter(op='d').count(), 3)
+        self.assertEqual(
+            InexChange.objects.values('created_at').distinct().count(), 1
+        )
+
+    def test_unchanged_save_is_not_recorded(self):
+        expense = Expense.objects.create(
+            name='電気代', pay_date=self.pay_date, method=self.method,
+            amount=100,
+        )
+        Expense.objects.get(pk=expense.pk).save()
+        self.assertEqual(
+            InexChange.objects.filter(row_id=expense.pk).count(), 1
+        )
+
+
+class AccountLedgerTests(TestCase):
+    """口座別残高台帳の差分による更新。"""
+
+    def setUp(self):
+        self.account = create_account('銀行A')
+        self.other = create_account('銀行B')
+        self.method = create_method('カード', self.account)
+        self.other_method = create_method('振込', self.other)
+        self.d1 = datetime.date(2020, 1, 10)
+        self.d2 = datetime.date(2020, 1, 20)
+        self.d3 = datetime.date(2024, 1, 5)
+
+    def _add(self, model, pay_date, amount, method=None,
+             state=StateChoices.UNDECIDED):
+        return model.objects.create(
+            name='収支', pay_date=pay_date, method=method or self.method,
+            amount=amount, state=state,
+        )
+
+    def _balances(self, account):
+        return list(
+            AccountLedger.objects.filter(account=account)
+            .order_by('date').values_list('date', 'balance', 'balance_done')
+        )
+
+    def test_insert(self):
+        self._add(Income, self.d2, 1000, state=StateChoices.DONE)
+        self._add(Expense, self.d3, 300)
+        self._add(Expense, self.d1, 100)
+        self._add(Expense, self.d2, 50, method=self.other_method)
+
+        self.assertEqual(self._balances(self.account), [
+            (self.d1, -100, 0),
+            (self.d2, 900, 1000),
+            (self.d3, 600, 1000),
+        ])
+        self.assertEqual(self._balances(self.other), [(self.d2, -50, 0)])
+        self.assertEqual(ledger.check(), [])
+
+    def test_update_keeps_later_rows(self):
+        old = self._add(Expense, self.d1, 100)
+        self._add(Expense, self.d3, 300)
+        later_id = AccountLedger.objects.get(date=self.d3).pk
+
+        old = Expense.objects.get(pk=old.pk)
+        old.amount = 150
+        old.state = StateChoices.DONE
+        old.save()
+        self.assertEqual(self._balances(self.account), [
+            (self.d1, -150, -150),
+            (self.d3, -450, -150),
+        ])
+        # 後の日の行は作り直さず、差分を加算する
+        self.assertEqual(AccountLedger.objects.get(date=self.d3).pk, later_id)
+
+        old.pay_date = self.d2
+        old.save()
+        self.assertEqual(self._balances(self.account), [
+            (self.d2, -150, -150),
+            (self.d3, -450, -150),
+        ])
+        self.assertEqual(ledger.check(), [])
+
+    def test_update_across_rows(self):
+        moved = self._add(Expense, self.d1, 100)
+        self._add(Expense, self.d2, 10)
+        self._add(Income, self.d2, 500, method=self.other_method)
+        later = datetime.date(2025, 1, 1)
+        self._add(Expense, later, 1)
+
+        moved.pay_date = self.d3
+        moved.save()
+        self.assertEqual(self._balances(self.account), [
+            (self.d2, -10, 0),
+            (self.d3, -110, 0),
+            (later, -111, 0),
+        ])
+        self.assertEqual(self._balances(self.other), [(self.d2, 500, 0)])
+        self.assertEqual(ledger.check(), [])
+
+    def test_delete(self):
+        self._add(Expense, self.d1, 100)
+        target = self._add(Expense, self.d2, 200)
+        self._add(Expense, self.d2, 10)
+        self._add(Expense, self.d3, 300)
+
+        target.delete()
+        self.assertEqual(self._balances(self.account), [
+            (self.d1, -100, 0),
+            (self.d2, -110, 0),
+            (self.d3, -410, 0),
+        ])
+        Expense.objects.get(pay_date=self.d2).delete()
+        self.assertEqual(self._balances(self.account), [
+            (self.d1, -100, 0),
+            (self.d3, -400, 0),
+        ])
+        self.assertEqual(ledger.check(), [])
+
+    def test_account_move(self):
+        self._add(Expense, self.d1, 100)
+        self._add(Income, self.d3, 500)
+        ids = set(AccountLedger.objects.values_list('pk', flat=True))
+
+        # 名前だけの変更では作り直さない
+        self.method.name = 'クレジットカード'
+        self.method.save()
+        self.assertEqual(
+            set(AccountLedger.objects.values_list('pk', flat=True)), ids
+        )
+
+        self.method.account = self.other
+        self.method.save()
+        self.assertEqual(self._balances(self.account), [])
+        self.assertEqual(self._balances(self.other), [
+            (self.d1, -100, 0),
+            (self.d3, 400, 0),
+        ])
+        self.assertEqual(ledger.check(), [])
+
+
+class StatementImportTests(APITestCase):
+    """明細 CSV の読み込みの誤りを行ごとに返す。"""
+
+    def _read(self, text):
+        return imports.read_statement(
+            io.BytesIO(text.encode('utf-8')), 'date', 'name', 'amount'
+        )
+
+    def _errors(self, text):
+        with self.assertRaises(imports.StatementError) as cm:
+            self._read(text)
+        return cm.exception.errors
+
+    def test_valid_rows(self):
+        rows = self._read(
+            'date,name,amount\n2024-04-01,電気代,"1,200"\n'
+        )
+        self.assertEqual(
+            rows, [(2, datetime.date(2024, 4, 1), '電気代', 1200, None)]
+        )
+
+    def test_short_row(self):
+        errors = self._errors(
+            'date,name,amount\n2024-04-01,電気代\n2024-04-02,ガス代,100\n'
+        )
+        self.assertEqual(errors, [(2, '値がありません: amount')])
+
+    def test_invalid_amounts(self):
+        errors = self._errors(
+            'date,name,amount\n'
+            '2024-04-01,a,Infinity\n'
+            '2024-04-01,b,NaN\n'
+            '2024-04-01,c,99999999999\n'
+            '2024-04-01,d,{0}\n'.format(imports.MAX_AMOUNT)
+        )
+        self.assertEqual([line for line, _ in errors], [2, 3, 4])
+
+    def test_api_reports_short_row(self):
+        method = create_method()
+        upload = io.BytesIO('date,name,amount\n2024-04-01,電気代\n'.encode())
+        upload.name = 'statement.csv'
+        response = self.client.post('/api/expenses/import/', {
+            'file': upload, 'method': method.pk, 'dry_run': 'true',
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error_count'], 1)
+
+    def test_long_name_is_error(self):
+        method = create_method()
+        pay_date = timezone.localdate()
+        Expense.objects.create(
+            name='a' * 50, pay_date=pay_date, method=method, amount=100,
+        )
+        rows = [
+            (2, pay_date, 'a' * 50, 100, None),
+            (3, pay_date, 'a' * 51, 100, None),
+        ]
+        with self.assertRaises(imports.StatementError) as cm:
+            imports.import_statement(
+                Expense, rows, method, StateChoices.UNDECIDED
+            )
+        self.assertEqual(cm.exception.errors, [
+            (3, '名前は50文字以内で指定してください: 51文字'),
+        ])
+        self.assertEqual(Expense.objects.count(), 1)
+
+        upload = io.BytesIO('date,name,amount\n{0},{1},100\n'.format(
+            pay_date.isoformat(), 'a' * 51,
+        ).encode())
+        upload.name = 'statement.csv'
+        response = self.client.post('/api/expenses/import/', {
+            'file': upload, 'method': method.pk, 'dry_run': 'true',
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'][0]['line'], 2)
+
+
+class BatchAPITests(APITestCase):
+    """作成・更新・削除のまとめ実行。"""
+
+    def setUp(self):
+        super().setUp()
+        self.method = create_method()
+        self.pay_date = timezone.localdate()
+
+    def _add(self, name, amount=100):
+        return Expense.objects.create(
+            name=name, pay_date=self.pay_date, method=self.method,
+            amount=amount,
+        )
+
+    def _post(self, operations):
+        return self.client.post(
+            '/api/expenses/batch/', {'operations': operations},
+            format='json',
+        )
+
+    def test_mixed_operations(self):
+        updated = self._add('電気代')
+        deleted = self._add('ガス代')
+        response = self._post([
+            {'op': 'create', 'data': {
+                'name': '水道代', 'pay_date': self.pay_date.isoformat(),
+                'method': self.method.pk, 'amount': 300,
+                'state': StateChoices.UNDECIDED,
+            }},
+            {'op': 'update', 'id': updated.pk, 'data': {'amount': 150}},
+            {'op': 'delete', 'id': deleted.pk},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            dict(Expense.objects.values_list('name', 'amount')),
+            {'電気代': 150, '水道代': 300},
+        )
+        self.assertEqual(response.data['results'][1]['data']['amount'], 150)
+        self.assertEqual(ledger.check(), [])
+        total = ExpenseMonthSummary.objects.get(
+            month=self.pay_date.replace(day=1)
+        ).amount
+        self.assertEqual(total, 450)
+
+    def test_error_changes_nothing(self):
+        expense = self._add('電気代')
+        response = self._post([
+            {'op': 'update', 'id': expense.pk, 'data': {'amount': 150}},
+            {'op': 'delete', 'id': expense.pk + 100},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('errors', response.data['results'][1])
+        self.assertEqual(Expense.objects.get(pk=expense.pk).amount, 100)
+
+    def test_deletes_notify_once(self):
+        expenses = [self._add('支出{0}'.format(i)) for i in range(5)]
+        notified = []
+        deleted = []
+
+        def on_changed(sender, dates, **kwargs):
+            notified.append(dates)
+
+        def on_deleted(sender, instance, **kwargs):
+            deleted.append(instance.pk)
+
+        signals.inex_changed.connect(on_changed)
+        post_delete.connect(on_deleted, sender=Expense)
+        try:
+            response = self._post([
+                {'op': 'delete', 'id': expense.pk} for expense in expenses
+            ])
+        finally:
+            signals.inex_changed.disconnect(on_changed)
+            post_delete.disconnect(on_deleted, sender=Expense)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Expense.objects.exists())
+        self.assertEqual(notified, [{self.pay_date}])
+        # 行ごとの post_delete は送るが、変更の通知は1回にまとめる
+        self.assertCountEqual(deleted, [e.pk for e in expenses])
+        self.assertEqual(InexChange.objects.filter(op='d').count(), 5)
+        self.assertFalse(ExpenseMonthSummary.objects.exists())
+        self.assertEqual(ledger.check(), [])
+
+
+    def test_delete_updates_ledger_summary_and_journal(self):
+        kept = self._add('電気代', 100)
+        deleted = [self._add('ガス代', 200), self._add('水道代', 300)]
+        # 行ごとのシグナルによるクエリはない(件数によらない)
+        with self.assertNumQueries(26):
+            response = self._post([
+                {'op': 'delete', 'id': expense.pk} for expense in deleted
+            ])
+        self.assertEqual(response.status_code, 200)
+
+        first_date = self.pay_date.replace(day=1)
+        self.assertEqual(
+            ExpenseMonthSummary.objects.get(month=first_date).amount, 100
+        )
+        self.assertEqual(
+            list(AccountLedger.objects.values_list('date', 'balance')),
+            [(self.pay_date, -100)],
+        )
+        self.assertEqual(ledger.check(), [])
+        self.assertEqual(
+            sorted(
+                InexChange.objects.filter(op='d')
+                .values_list('row_id', 'data__name')
+            ),
+            sorted((e.pk, e.name) for e in deleted),
+        )
+        self.assertTrue(Expense.objects.filter(pk=kept.pk).exists())
+
+
+class BalanceSnapshotTests(TestCase):
+    """月末残高のスナップショットの再利用と破棄。"""
+
+    def setUp(self):
+        self.method = create_method()
+        self._add(Income, datetime.date(2024, 1, 25), 1000, StateChoices.DONE)
+        self._add(Expense, datetime.date(2024, 2, 10), 300)
+        self._add(Expense, datetime.date(2024, 3, 10), 200, StateChoices.DONE)
+
+    def _add(self, model, pay_date, amount, state=StateChoices.UNDECIDED):
+        return model.objects.create(
+            name='収支', pay_date=pay_date, method=self.method,
+            amount=amount, state=state,
+        )
+
+    def _months(self):
+        return list(
+            BalanceSnapshot.objects.order_by('month')
+            .values_list('month', 'balance', 'balance_done')
+        )
+
+    def test_reuse(self):
+        self.assertEqual(balances.get_balances(2024, 3), (500, 800))
+        self.assertEqual(self._months(), [
+            (datetime.date(2024, 1, 1), 1000, 1000),
+            (datetime.date(2024, 2, 1), 700, 1000),
+            (datetime.date(2024, 3, 1), 500, 800),
+        ])
+        with self.assertNumQueries(1):
+            self.assertEqual(balances.get_balances(2024, 2), (700, 1000))
+        self.assertEqual(balances.check_snapshots(), [])
+
+    def test_far_future_saves_until_last_data_month(self):
+        self.assertEqual(balances.get_balances(9999, 12), (500, 800))
+        self.assertEqual(balances.get_balances(2100, 6), (500, 800))
+        self.assertEqual(
+            [m for m, _, _ in self._months()], [
+                datetime.date(2024, 1, 1),
+                datetime.date(2024, 2, 1),
+                datetime.date(2024, 3, 1),
+            ],
+        )
+        self.assertEqual(balances.get_balances(2023, 12), (0, 0))
+
+        self._add(Income, datetime.date(9999, 12, 31), 50, StateChoices.DONE)
+        self.assertEqual(balances.get_balances(9999, 12), (550, 850))
+        self.assertEqual(balances.get_balances(9999, 11), (500, 800))
+        self.assertEqual(BalanceSnapshot.objects.count(), 4)
+        self.assertEqual(balances.check_snapshots(), [])
+        self.assertEqual(balances.rebuild_snapshots(), 4)
+
+    def test_invalidate(self):
+        balances.get_balances(2024, 3)
+        self._add(Expense, datetime.date(2024, 2, 20), 100)
+        self.assertEqual(
+            [m for m, _, _ in self._months()], [datetime.date(2024, 1, 1)]
+        )
+        self.assertEqual(balances.get_balances(2024, 3), (400, 800))
+        self.assertEqual(balances.check_snapshots(), [])
+
+    def test_change_during_read_is_not_saved(self):
+        month_sums = summaries.month_sums
+
+        def month_sums_with_write(model, start_date, last_date):
+            result = month_sums(model, start_date, last_date)
+            if model is Expense:
+                # 集計した後、保存する前に別の書き込みが確定した場合
+                self._add(Expense, datetime.date(2024, 2, 20), 100)
+            return result
+
+        with mock.patch.object(
+            summaries, 'month_sums', side_effect=month_sums_with_write
+        ):
+            self.assertEqual(balances.get_balances(2024, 3), (500, 800))
+        self.assertEqual(self._months(), [])
+        self.assertEqual(balances.get_balances(2024, 3), (400, 800))
+
+    def test_check_snapshots_detects_mismatch(self):
+        balances.get_balances(2024, 3)
+        BalanceSnapshot.objects.filter(month=datetime.date(2024, 2, 1)).update(
+            balance=0
+        )
+        mismatches = balances.check_snapshots()
+        self.assertEqual(len(mismatches), 1)
+        self.assertEqual(mismatches[0]['month'], datetime.date(2024, 2, 1))
+        self.assertEqual(mismatches[0]['expected_balance'], 700)
+        self.assertEqual(balances.rebuild_snapshots(), 3)
+        self.assertEqual(balances.check_snapshots(), [])
+
+
+class JobTests(APITestCase):
+    """ジョブの取り出し・再実行・戻し、ジョブAPI。"""
+
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        patcher = mock.patch.dict(jobs.HANDLERS, {
+            'ok': self._ok, 'error': self._error, 'failed': self._failed,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _ok(self, name='銀行'):
+        self.calls.append(name)
+        Bank.objects.create(name=name)
+        return {'name': name}
+
+    def _error(self):
+        raise ValueError('一時的な失敗')
+
+    def _failed(self):
+        raise jobs.JobFailed('入力が不正です', {'line': 1})
+
+    def _claim(self, kind, worker='w1', **fields):
+        job = jobs.enqueue(kind, **fields)
+        self.assertEqual(jobs.claim(worker).pk, job.pk)
+        job.refresh_from_db()
+        return job
+
+    def test_claim(self):
+        first = jobs.enqueue('ok')
+        second = jobs.enqueue('ok')
+        Job.objects.filter(pk=second.pk).update(
+            run_after=timezone.now() + datetime.timedelta(minutes=1)
+        )
+
+        job = jobs.claim('w1')
+        self.assertEqual(job.pk, first.pk)
+        self.assertEqual(job.state, JobStateChoices.RUNNING)
+        self.assertEqual(job.worker, 'w1')
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.heartbeat_at)
+        # 実行中と、実行時刻前のジョブは取り出さない
+        self.assertIsNone(jobs.claim('w2'))
+
+        jobs.run(job)
+        job.refresh_from_db()
+        self.assertEqual(job.state, JobStateChoices.DONE)
+        self.assertEqual(job.result, {'name': '銀行'})
+        self.assertEqual(self.calls, ['銀行'])
+
+    def test_retry_backoff(self):
+        job = self._claim('error', max_attempts=2)
+        before = timezone.now()
+        jobs.run(job)
+        job.refresh_from_db()
+        self.assertEqual(job.state, JobStateChoices.QUEUED)
+        self.assertIn('一時的な失敗', job.error)
+        self.assertGreaterEqual(
+            job.run_after,
+            before + datetime.timedelta(seconds=jobs.RETRY_DELAY),
+        )
+        self.assertIsNone(jobs.claim('w1'))
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        job = jobs.claim('w1')
+        self.assertEqual(job.attempts, 2)
+        jobs.run(job)
+        job.refresh_from_db()
+        self.assertEqual(job.state, JobStateChoices.FAILED)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_job_failed_is_not_retried(self):
+        job = self._claim('failed')
+        jobs.run(job)
+        job.refresh_from_db()
+        self.assertEqual(job.state, JobStateChoices.FAILED)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.error, '入力が不正です')
+        self.assertEqual(job.result, {'line': 1})
+
+    def test_requeue_stale(self):
+        old = timezone.now() - datetime.timedelta(hours=2)
+        stale = self._claim('ok')
+        slow = self._claim('ok', worker='w2')
+        Job.objects.filter(pk=stale.pk).update(
+            started_at=old, heartbeat_at=old
+        )
+        # 開始は古いが、ワーカーが動いている
+        Job.objects.filter(pk=slow.pk).update(started_at=old)
+
+        self.assertEqual(jobs.requeue_stale(60), 1)
+        stale.refresh_from_db()
+        slow.refresh_from_db()
+        self.assertEqual(stale.state, JobStateChoices.QUEUED)
+        self.assertEqual(slow.state, JobStateChoices.RUNNING)
+
+    def test_requeued_job_is_not_finished_by_old_worker(self):
+        job = self._claim('ok')
+        # 戻されて他のワーカーが取り出した
+        Job.objects.filter(pk=job.pk).update(worker='w2')
+
+        jobs.run(job)
+        self.assertEqual(self.calls, ['銀行'])
+        self.assertFalse(Bank.objects.exists())
+        self.assertEqual(
+            Job.objects.get(pk=job.pk).state, JobStateChoices.RUNNING
+        )
+
+        # 失敗も上書きしない
+        Job.objects.filter(pk=job.pk).update(kind='error')
+        job.kind = 'error'
+        jobs.run(job)
+        job.refresh_from_db()
+        self.assertEqual(job.state, JobStateChoices.RUNNING)
+        self.assertEqual(job.error, '')
+
+    def test_api(self):
+        done = self._claim('ok')
+        jobs.run(done)
+        failed = self._claim('failed')
+        jobs.run(failed)
+
+        response = self.client.get(
+            '/api/jobs/', {'state': JobStateChoices.FAILED}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([j['id'] for j in response.data], [failed.pk])
+        response = self.client.get('/api/jobs/{0}/'.format(done.pk))
+        self.assertEqual(response.data['result'], {'name': '銀行'})
+
+        response = self.client.post('/api/jobs/{0}/retry/'.format(done.pk))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/jobs/{0}/retry/'.format(failed.pk))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['state'], JobStateChoices.QUEUED)
+        self.assertEqual(response.data['attempts'], 0)
+
+        response = self.client.post(
+            '/api/jobs/maintenance/', {'kind': 'rebuild_month_summaries'}
+        )
+        self.assertEqual(response.status_code, 403)
+        self.login_user.is_staff = True
+        self.login_user.save()
+        response = self.client.post('/api/jobs/maintenance/', {'kind': 'ok'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/jobs/maintenance/', {'kind': 'rebuild_month_summaries'}
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['kind'], 'rebuild_month_summaries')
+
+
+class MetricsTests(APITestCase):
+    """リクエストの計測値と Server-Timing ヘッダー。"""
+
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+        create_method()
+
+    def test_server_timing_only_for_staff(self):
+        response = self.client.get('/api/methods/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+
+        self.login_user.is_staff = True
+        self.login_user.save()
+        response = self.client.get('/api/methods/')
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+
+    def test_serialize_time_is_recorded(self):
+        response = self.client.get('/api/methods/')
+        series = metrics.registry._series['api:method-list', 'GET']
+        serialize = series['inex_request_serialize_seconds']
+        self.assertEqual(sum(serialize.counts), 1)
+        self.assertGreater(serialize.sum, 0)
+        self.assertGreater(series['inex_request_render_seconds'].sum, 0)
+        # シリアライザのクラスは置き換えない
+        self.assertIs(
+            type(response.renderer_context['view'].get_serializer()),
+            MethodSerializer,
+        )
+
+    def test_routes_are_labelled_by_view_name(self):
+        method = Method.objects.get()
+        self.client.get('/api/methods/')
+        self.client.get('/api/accounts/{0}/'.format(method.account_id))
+        self.client.get('/api/accounts/{0}/'.format(method.account_id))
+        self.assertEqual(
+            {
+                route: sum(series['inex_request_duration_seconds'].counts)
+                for (route, _), series in metrics.registry._series.items()
+            },
+            {'api:method-list': 1, 'api:account-detail': 2},
+        )
+
+    def test_browsable_api_is_rendered(self):
+        response = self.client.get('/api/methods/', HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        series = metrics.registry._series['api:method-list', 'GET']
+        self.assertGreater(series['inex_request_render_seconds'].sum, 0)
+
+
+class InexPaginationTests(APITestCase):
+    """収入・支出一覧のキーセットページネーションとカーソルの検証。"""
+
+    def setUp(self):
+        super().setUp()
+        method = create_method()
+        for day in range(1, 6):
+            Expense.objects.create(
+                name='支出', pay_date=datetime.date(2024, 4, day),
+                method=method, amount=100,
+            )
+
+    def _get(self, cursor=None):
+        params = {'year': 2024, 'month': 4, 'page_size': 2}
+        if cursor is not None:
+            params['cursor'] = cursor
+        return self.client.get('/api/expenses/', params)
+
+    def test_pages(self):
+        response = self._get()
+        days = [r['pay_date'] for r in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            days += [r['pay_date'] for r in response.data['results']]
+        self.assertEqual(
+            days, ['2024-04-0{0}'.format(day) for day in range(1, 6)]
+        )
+
+    def test_malformed_cursor(self):
+        def encode(value):
+            raw = json.dumps(value).encode('utf-8')
+            return base64.urlsafe_b64encode(raw).decode('ascii')
+
+        valid = ['ユーザー', 'カード', '銀行', 0, '2024-04-01', '支出', 1]
+        cursors = [
+            'zzz',
+            encode({str(i): i for i in range(7)}),
+            encode(valid[:6]),
+            encode([*valid[:3], '0', *valid[4:]]),
+            encode([*valid[:3], True, *valid[4:]]),
+            encode([*valid[:4], '2024-13-01', *valid[5:]]),
+            encode([*valid[:6], None]),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self._get(cursor)
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._get(encode(valid)).status_code, 200)
+
+
+class CompactInexSerializerTests(TestCase):
+    """CompactInexSerializer が Income / ExpenseSerializer と同じ出力になること。"""
+
+    def setUp(self):
+        self.methods = [
+            create_method('カード', create_account('銀行A', '利用者A')),
+            create_method('振込', create_account('銀行B', '利用者B')),
+        ]
+
+    def test_same_output_as_model_serializers(self):
+        cases = [
+            # (金額, 状態, メモ)
+            (0, StateChoices.UNDECIDED, None),
+            (999, StateChoices.DECIDED, ''),
+            (1000, StateChoices.DONE, 'メモ'),
+            (1234567, StateChoices.UNDECIDED, '改行\nと"引用符"'),
+            (2 ** 31 - 1, StateChoices.DONE, '  '),
+        ]
+        for model, serializer_class in (
+            (Income, IncomeSerializer), (Expense, ExpenseSerializer),
+        ):
+            for i, (amount, state, memo) in enumerate(cases):
+                model.objects.create(
+                    name='{0}{1}'.format(model.__name__, i),
+                    pay_date=datetime.date(2024, 4, i + 1),
+                    method=self.methods[i % 2], amount=amount, state=state,
+                    memo=memo,
+                )
+            qs = model.objects.order_by('id')
+            expected = serializer_class(
+                qs.select_related(
+                    'method__account__user', 'method__account__bank'
+                ),
+                many=True,
+            ).data
+            compact = CompactInexSerializer(
+                qs.values(*CompactInexSerializer.VALUES), many=True
+            ).data
+            self.assertEqual(len(compact), len(cases))
+            for want, got in zip(expected, compact):
+                with self.subTest(model=model.__name__, id=want['id']):
+                    self.assertEqual(list(got), list(want))
+                    for field in want:
+                        self.assertEqual(got[field], want[field], field)
+
+            single = CompactInexSerializer(
+                qs.values(*CompactInexSerializer.VALUES)[0]
+            ).data
+            self.assertEqual(single, dict(expected[0]))
+
+
+class SearchTests(APITestCase):
+    """名前・メモの検索(SQLite の FTS5 と LIKE)。"""
+
+    def setUp(self):
+        super().setUp()
+        method = create_method()
+        self.beans, self.cup, self.tea = [
+            Expense.objects.create(
+                name=name, pay_date=datetime.date(2024, 4, day),
+                method=method, amount=100,
+            )
+            for day, name in ((1, 'コーヒー豆'), (2, 'コーヒーカップ'), (3, '紅茶'))
+        ]
+
+    def _require_fts(self):
+        if not search._has_fts(Expense):
+            self.skipTest('FTS5 の表がない')
+
+    def _ids(self, q):
+        with CaptureQueriesContext(connection) as queries:
+            result = search.search(q, types=['expense'])
+        used_fts = any('MATCH' in query['sql'] for query in queries)
+        return {r['id'] for r in result['results']}, used_fts
+
+    def test_fts(self):
+        self._require_fts()
+        self.assertEqual(
+            self._ids('コーヒー'), ({self.beans.pk, self.cup.pk}, True)
+        )
+        response = self.client.get('/api/search/', {'q': 'コーヒー 豆'})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['id'], self.beans.pk)
+
+    def test_like_fallback(self):
+        # 3文字未満の語は FTS5 を使わない
+        self.assertEqual(self._ids('紅茶'), ({self.tea.pk}, False))
+        with mock.patch.object(search, '_has_fts', return_value=False):
+            self.assertEqual(
+                self._ids('コーヒー'), ({self.beans.pk, self.cup.pk}, False)
+            )
+
+    def test_fts_follows_update_and_delete(self):
+        self._require_fts()
+        # update() / delete() でもトリガーで同期する
+        Expense.objects.filter(pk=self.beans.pk).update(name='ほうじ茶葉')
+        self.assertEqual(self._ids('コーヒー')[0], {self.cup.pk})
+        self.assertEqual(self._ids('ほうじ茶')[0], {self.beans.pk})
+        Expense.objects.filter(pk=self.beans.pk).delete()
+        self.assertEqual(self._ids('ほうじ茶')[0], set())
+
+    def test_table_check_is_cached(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite のみ表を調べる')
+        search._table_names.cache_clear()
+        self.addCleanup(search._table_names.cache_clear)
+        for expected in (True, False):
+            with CaptureQueriesContext(connection) as queries:
+                search.search('コーヒー')
+            self.assertEqual(
+                any('sqlite_master' in q['sql'] for q in queries), expected
+            )
+
+
+class ExportTests(APITestCase):
+    """エクスポートの形式の選択と CSV の数式の無効化。"""
+
+    def setUp(self):
+        super().setUp()
+        method = create_method()
+        Expense.objects.create(
+            name='=HYPERLINK("http://example.com")',
+            pay_date=datetime.date(2024, 4, 1), method=method, amount=100,
+            memo='-1+2',
+        )
+
+    def _body(self, response):
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_accept(self):
+        response = self.client.get(
+            '/api/expenses/export/', HTTP_ACCEPT='text/csv'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+
+        response = self.client.get(
+            '/api/expenses/export/', HTTP_ACCEPT='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 200)
+        row = json.loads(self._body(response))
+        self.assertEqual(row['name'], '=HYPERLINK("http://example.com")')
+
+        response = self.client.get(
+            '/api/loans/export/', HTTP_ACCEPT='text/csv'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_csv_formula_prefix(self):
+        body = self._body(self.client.get('/api/expenses/export/'))
+        lines = body.splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('"\'=HYPERLINK(""http://example.com"")"', lines[1])
+        self.assertTrue(lines[1].endswith(",'-1+2"))
+        # 数値の列はそのまま
+        self.assertIn(',100,', lines[1])
+
+
+class ForecastTests(TestCase):
+    """資金繰り予測の最小残高と初めて負になる日。"""
+
+    def setUp(self):
+        self.today = datetime.date(2024, 4, 10)
+        self.short = create_account('銀行A', balance=-100)
+        self.enough = create_account('銀行B', balance=100)
+        Income.objects.create(
+            name='給与', pay_date=datetime.date(2024, 4, 25),
+            method=create_method('振込', self.short), amount=300,
+        )
+        Expense.objects.create(
+            name='カード', pay_date=datetime.date(2024, 4, 27),
+            method=create_method('カード', self.enough), amount=150,
+        )
+
+    def test_first_negative_date(self):
+        result = forecast.forecast(1, self.today)
+        accounts = {a['id']: a for a in result['accounts']}
+
+        # 起点から負の口座は予測の開始日
+        short = accounts[self.short.pk]
+        self.assertEqual(short['first_negative_date'], self.today)
+        self.assertEqual(short['min_balance'], -100)
+        self.assertEqual(short['closing_balance'], 200)
+
+        enough = accounts[self.enough.pk]
+        self.assertEqual(
+            enough['first_negative_date'], datetime.date(2024, 4, 27)
+        )
+        self.assertEqual(enough['min_balance'], -50)
+
+        # 合計は 0 から始まり、負にならない
+        self.assertIsNone(result['total']['first_negative_date'])
+        self.assertEqual(result['total']['closing_balance'], 150)
+
+
+class MonthSummaryParityTests(TestCase):
+    """月別集計から求めた値と、収支からの直接の集計の一致。"""
+
+    def setUp(self):
+        accounts = [
+            create_account('銀行{0}'.format(b), '利用者{0}'.format(u))
+            for b in range(2) for u in range(2)
+        ]
+        self.methods = [
+            create_method('方法{0}'.format(i), account)
+            for i, account in enumerate(accounts)
+        ]
+        self.months = [datetime.date(2024, m, 1) for m in range(1, 5)]
+
+        rng = random.Random(0)
+        rows = []
+        for i in range(120):
+            model = rng.choice((Income, Expense))
+            if rows and rng.random() < 0.4:
+                obj = rng.choice(rows)
+                if rng.random() < 0.25:
+                    obj.delete()
+                    rows.remove(obj)
+                    continue
+                obj.pay_date = self._date(rng)
+                obj.method = rng.choice(self.methods)
+                obj.amount = rng.randint(1, 10000)
+                obj.state = rng.choice(StateChoices.values)
+                obj.save()
+                continue
+            rows.append(model.objects.create(
+                name='収支{0}'.format(i), pay_date=self._date(rng),
+                method=rng.choice(self.methods),
+                amount=rng.randint(1, 10000),
+                state=rng.choice(StateChoices.values),
+            ))
+        transitions.transition(
+            Expense, StateChoices.DONE, transitions.SOURCE_API,
+            date_from=datetime.date(2024, 2, 1),
+            date_to=datetime.date(2024, 2, 29),
+            method=self.methods[0].pk,
+        )
+        # 支払方法の口座の変更(集計は支払方法ごとのため影響しない)
+        self.methods[1].account = self.methods[2].account
+        self.methods[1].save()
+
+    def _date(self, rng):
+        return rng.choice(self.months) + datetime.timedelta(
+            days=rng.randint(0, 27)
+        )
+
+    def _raw(self, model, **filters):
+        return model.objects.filter(**filters).aggregate(
+            total=Sum('amount'),
+            done=Sum('amount', filter=Q(state=StateChoices.DONE)),
+        )
+
+    def test_check(self):
+        self.assertEqual(summaries.check(), [])
+
+    def test_require_by(self):
+        first, last = self.months[1], datetime.date(2024, 3, 31)
+        for dimension, (key, *_) in aggregations.REQUIRE_DIMENSIONS.items():
+            with self.subTest(dimension=dimension):
+                raw = (
+                    Expense.objects
+                    .filter(pay_date__gte=first, pay_date__lte=last)
+                    .exclude(state=StateChoices.DONE)
+                    .values(key).annotate(total=Sum('amount')).order_by()
+                )
+                self.assertEqual(
+                    aggregations.require_by(dimension, first, last),
+                    {r[key]: r['total'] for r in raw},
+                )
+
+    def test_month_sums(self):
+        for model in (Income, Expense):
+            sums = summaries.month_sums(model, None, self.months[-1])
+            for month in self.months:
+                raw = self._raw(
+                    model, pay_date__gte=month,
+                    pay_date__lt=month + relativedelta(months=1),
+                )
+                self.assertEqual(
+                    sums.get(month, (0, 0)),
+                    (raw['total'] or 0, raw['done'] or 0),
+                )
+                self.assertEqual(
+                    summaries.month_total(model, month), raw['total'] or 0
+                )
+
+    def test_get_balances(self):
+        for month in self.months:
+            last = month + relativedelta(months=1) - datetime.timedelta(days=1)
+            inc = self._raw(Income, pay_date__lte=last)
+            exp = self._raw(Expense, pay_date__lte=last)
+            self.assertEqual(
+                balances.get_balances(month.year, month.month),
+                (
+                    (inc['total'] or 0) - (exp['total'] or 0),
+                    (inc['done'] or 0) - (exp['done'] or 0),
+                ),
+            )
+        self.assertEqual(balances.check_snapshots(), [])
+
+
+class MonthSummaryDeltaTests(TestCase):
+    """収支の変更時に、月を集計し直さず差分で月別集計を更新すること。"""
+
+    def setUp(self):
+        self.method = create_method()
+        self.april = datetime.date(2024, 4, 1)
+        self.may = datetime.date(2024, 5, 1)
+        self.kept = self._add(datetime.date(2024, 4, 3), 100)
+        self.expense = self._add(datetime.date(2024, 4, 10), 200)
+
+    def _add(self, pay_date, amount):
+        return Expense.objects.create(
+            name='支出', pay_date=pay_date, method=self.method, amount=amount
+        )
+
+    def _summary(self):
+        return sorted(
+            ExpenseMonthSummary.objects.values_list(
+                'month', 'state', 'count', 'amount'
+            )
+        )
+
+    def test_writes_do_not_summarize_month(self):
+        with mock.patch.object(
+            summaries, '_summarize', side_effect=AssertionError
+        ):
+            self.expense.amount = 250
+            self.expense.save()
+            self.assertEqual(self._summary(), [
+                (self.april, StateChoices.UNDECIDED, 2, 350),
+            ])
+
+            self.expense.pay_date = datetime.date(2024, 5, 10)
+            self.expense.save()
+            transitions.apply(
+                Expense.objects.filter(pk=self.kept.pk), StateChoices.DONE,
+                transitions.SOURCE_API,
+            )
+            self.assertEqual(self._summary(), [
+                (self.april, StateChoices.DONE, 1, 100),
+                (self.may, StateChoices.UNDECIDED, 1, 250),
+            ])
+
+            # 件数が 0 になった行は削除する
+            self.expense.delete()
+            self.assertEqual(self._summary(), [
+                (self.april, StateChoices.DONE, 1, 100),
+            ])
+        self.assertEqual(summaries.check(), [])
+
+    def test_notify_without_changes_refreshes_month(self):
+        # 変更前後の値のない通知では、月ごと作り直す
+        Expense.objects.filter(pk=self.expense.pk).update(amount=300)
+        signals.notify_inex_changed(Expense, [self.expense.pay_date])
+        self.assertEqual(self._summary(), [
+            (self.april, StateChoices.UNDECIDED, 2, 400),
+        ])
+        self.assertEqual(summaries.check(), [])
+
+
+class MonthTotalCacheTests(TestCase):
+    """月別合計のキャッシュが月の更新バージョンで切り替わること。"""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.method = create_method()
+        self.april = datetime.date(2024, 4, 1)
+        self.may = datetime.date(2024, 5, 1)
+        self.expense = self._add(self.april, 100)
+
+    def _add(self, pay_date, amount):
+        return Expense.objects.create(
+            name='支出', pay_date=pay_date, method=self.method, amount=amount
+        )
+
+    def _totals(self):
+        return trends.month_totals(Expense, self.april, self.may)
+
+    def test_cache_is_used(self):
+        self.assertEqual(self._totals(), {self.april: 100, self.may: 0})
+        # 2回目は月のバージョンの取得だけ
+        with self.assertNumQueries(1):
+            self.assertEqual(self._totals(), {self.april: 100, self.may: 0})
+
+    def test_insert(self):
+        self._totals()
+        self._add(self.april, 50)
+        self.assertEqual(self._totals(), {self.april: 150, self.may: 0})
+
+    def test_update_moves_month(self):
+        self._totals()
+        self.expense.pay_date = datetime.date(2024, 5, 10)
+        self.expense.save()
+        self.assertEqual(self._totals(), {self.april: 0, self.may: 100})
+
+    def test_delete(self):
+        self._totals()
+        self.expense.delete()
+        self.assertEqual(self._totals(), {self.april: 0, self.may: 0})
+
+    def test_write_without_signal_handlers_of_this_process(self):
+        # 他のプロセスの書き込みは、このプロセスのキャッシュを消さない。
+        # 月のバージョンが上がればキーが変わる
+        self._totals()
+        Expense.objects.filter(pk=self.expense.pk).update(amount=300)
+        summaries.refresh_months(Expense, [self.april])
+        self.assertEqual(self._totals()[self.april], 100)
+        versions.bump_months([self.april])
+        self.assertEqual(self._totals()[self.april], 300)
+
+
+class ConditionalResponseTests(APITestCase):
+    """ETag による条件付き GET(304)と、書き込み後の ETag の変化。"""
+
+    def setUp(self):
+        super().setUp()
+        self.method = create_method()
+        self.expense = self._add(datetime.date(2024, 5, 10), 100)
+
+    def _add(self, pay_date, amount):
+        return Expense.objects.create(
+            name='支出', pay_date=pay_date, method=self.method, amount=amount
+        )
+
+    def _get(self, **headers):
+        return self.client.get(
+            '/api/balance/', {'year': 2024, 'month': 6}, **headers
+        )
+
+    def test_matching_etag_returns_304(self):
+        etag = self._get()['ETag']
+        response = self._get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def _assert_etag_changes(self, write):
+        etag = self._get()['ETag']
+        write()
+        response = self._get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_changes_after_insert(self):
+        self._assert_etag_changes(
+            lambda: self._add(datetime.date(2024, 6, 1), 50)
+        )
+
+    def test_etag_changes_after_update_moving_month(self):
+        def move():
+            self.expense.pay_date = datetime.date(2024, 7, 10)
+            self.expense.save()
+        self._assert_etag_changes(move)
+
+    def test_etag_changes_after_delete(self):
+        self._assert_etag_changes(self.expense.delete)
 
-# Create your tests here.
+    def test_write_in_same_second_is_not_304(self):
+        # Last-Modified は秒単位のため、同じ秒の更新後も同じ値になる
+        now = timezone.now().replace(microsecond=0)
+        with mock.patch.object(timezone, 'now', return_value=now):
+            first = self._get()
+            self._add(datetime.date(2024, 6, 1), 50)
+            response = self._get(
+                HTTP_IF_MODIFIED_SINCE=first['Last-Modified']
+            )
+            self.assertEqual(response['Last-Modified'], first['Last-Modified'])
+            self.assertEqual(response.status_code, 200)
+            response = self._get(
+                HTTP_IF_NONE_MATCH=first['ETag'],
+                HTTP_IF_MODIFIED_SINCE=first['Last-Modified'],
+            )
+            self.assertEqual(response.status_code, 200)
@@ -0,0 +1,178 @@
+"""収入・支出の状態の一括変更。
+
+条件(期間、支払方法、口座、名前、変更前の状態)に合う行の状態を、
+PostgreSQL では1回の UPDATE ... FROM ... RETURNING で変更し、変更した行の
+id・支払日・変更前の状態・支払方法・金額を受け取る。変更の記録(StateTransition)は変更前の
+状態ごとの id のリストとして1行で書き、変更のあった月を1回で通知する。
+
+SQLite の RETURNING は FROM の表を参照できないため、それ以外のデータベースでは
+対象を1回読んでから id で1回 UPDATE する。
+
+対象は id で絞り込んだ(結合のない)SELECT ... FOR UPDATE で id 順にロックして
+読むため、同時に変更された行も変更後の状態で読み直され、変更前の状態が
+古い値にならない。支払方法・口座の行はロックしない。
+"""
+import collections
+import datetime
+
+from dateutil.relativedelta import relativedelta
+from django.db import connection, transaction
+from django.db.models import F
+
+from income_and_expense import journal, signals
+from income_and_expense.models import Expense, StateChoices, StateTransition
+
+# 変更の記録の source
+SOURCE_API = 'api'
+SOURCE_ADMIN = 'admin'
+SOURCE_VIEW = 'view'
+SOURCE_JOB = 'job'
+SOURCE_SAMPLEDATA = 'sampledata'
+
+
+def filter_rows(model, date_from=None, date_to=None, method=None,
+                account=None, name=None, from_states=None):
+    """状態を変更する対象の行を絞り込む。
+
+    Parameters
+    ----------
+    model : Model
+        Income または Expense
+    date_from, date_to : date
+        支払日の範囲(省略可)
+    method, account : int
+        支払方法・口座の pk(省略可)
+    name : str
+        名前に含む文字列(省略可、大文字・小文字を区別しない)
+    from_states : list of int
+        変更前の状態(省略時はすべて)
+    """
+    qs = model.objects.all()
+    if date_from is not None:
+        qs = qs.filter(pay_date__gte=date_from)
+    if date_to is not None:
+        qs = qs.filter(pay_date__lte=date_to)
+    if method is not None:
+        qs = qs.filter(method=method)
+    if account is not None:
+        qs = qs.filter(method__account=account)
+    if name:
+        qs = qs.filter(name__icontains=name)
+    if from_states:
+        qs = qs.filter(state__in=from_states)
+    return qs
+
+
+def _update_returning(queryset, to_state):
+    """対象の状態を変更し、(id, 支払日, 変更前の状態, 支払方法ID, 金額) の
+    リストを返す。
+
+    トランザクション内で呼ぶこと(対象の行をロックする)。
+    """
+    model = queryset.model
+    targets = (
+        model.objects.filter(pk__in=queryset.order_by().values('pk'))
+        .exclude(state=to_state)
+        .select_for_update()
+        .order_by('pk')
+    )
+    if connection.vendor != 'postgresql':
+        rows = list(targets.values_list(
+            'pk', 'pay_date', 'state', 'method_id', 'amount'
+        ))
+        model.objects.filter(pk__in=[r[0] for r in rows]).update(
+            state=to_state
+        )
+        return rows
+
+    sql, params = (
+        targets.annotate(old_id=F('pk'), old_state=F('state'))
+        .values('old_id', 'old_state')
+        .query.sql_with_params()
+    )
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'UPDATE {0} SET state = %s FROM ({1}) AS old '
+            'WHERE {0}.id = old.old_id '
+            'RETURNING {0}.id, {0}.pay_date, old.old_state, '
+            '{0}.method_id, {0}.amount'.format(table, sql),
+            [to_state, *params],
+        )
+        return cursor.fetchall()
+
+
+def apply(queryset, to_state, source, actor='', filters=None):
+    """queryset の行の状態を to_state に変更する。
+
+    すでに to_state の行は変更しない(記録にも含めない)。
+
+    Parameters
+    ----------
+    queryset : QuerySet
+        Income または Expense の QuerySet
+    to_state : int
+        変更後の状態
+    source : str
+        変更の経路(SOURCE_*)
+    actor : str
+        変更した利用者名
+    filters : dict
+        記録する絞り込み条件(JSON にできる値)
+
+    Returns
+    -------
+    tuple
+        (変更した件数, StateTransition。変更がなければ None)
+    """
+    model = queryset.model
+    with transaction.atomic():
+        rows = _update_returning(queryset, to_state)
+        if not rows:
+            return 0, None
+        changes = collections.defaultdict(list)
+        for pk, _, old_state, _, _ in rows:
+            changes[str(old_state)].append(pk)
+        record = StateTransition.objects.create(
+            model=model._meta.model_name, to_state=to_state, source=source,
+            actor=actor, filters=filters or {}, count=len(rows),
+            changes={state: sorted(ids) for state, ids in changes.items()},
+        )
+        journal.record_states(model, [r[:3] for r in rows], to_state)
+        signals.notify_inex_changed(
+            model, {r[1] for r in rows},
+            [
+                ((pay_date, method_id, old_state, amount),
+                 (pay_date, method_id, to_state, amount))
+                for _, pay_date, old_state, method_id, amount in rows
+            ],
+        )
+    return len(rows), record
+
+
+def _json_filters(filters):
+    return {
+        key: value.isoformat() if isinstance(value, datetime.date) else value
+        for key, value in filters.items()
+        if value is not None and value != '' and value != []
+    }
+
+
+def transition(model, to_state, source, actor='', **filters):
+    """filter_rows の条件に合う行の状態を変更する。戻り値は apply と同じ。"""
+    return apply(
+        filter_rows(model, **filters), to_state, source, actor,
+        _json_filters(filters),
+    )
+
+
+def mark_method_done(method_id, first_date, source, actor=''):
+    """支払方法の該当月の未完了の支出をすべて完了にし、更新件数を返す。"""
+    last_date = (
+        first_date + relativedelta(months=1) - datetime.timedelta(days=1)
+    )
+    count, _ = transition(
+        Expense, StateChoices.DONE, source, actor,
+        date_from=first_date, date_to=last_date, method=method_id,
+    )
+    return count
@@ -0,0 +1,70 @@
+"""月別の収入・支出合計のキャッシュ。
+
+(モデル, 月, 月の更新バージョン) ごとに合計をキャッシュする。収支が
+変更されると月のバージョン(MonthVersion)が上がってキーが変わるため、
+破棄は行わない。どのプロセス(他の Web ワーカー、run_jobs のワーカー)が
+書き込んでも、キャッシュがプロセスごと(locmem)でも古い値は使われない。
+キャッシュにない月だけを月別集計(summaries)から1回で求めて補う。
+
+バージョンは合計より先に読む。読んだ後に確定した変更の合計を古いキーで
+保存することはあっても、その逆(古い合計を新しいキーで保存)はない。
+ロールバックで戻ったバージョンが別の内容で再び使われても衝突しないよう、
+キーには更新日時も含める。
+"""
+from dateutil.relativedelta import relativedelta
+from django.core.cache import cache
+
+from income_and_expense import summaries
+from income_and_expense.models import MonthVersion
+
+# 古いバージョンのキーは参照されなくなるだけなので、期限は長めでよい
+CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def _key(model, first_date, version):
+    """version は (バージョン, 更新日時)。行のない月は None。"""
+    if version is None:
+        stamp = '0'
+    else:
+        stamp = '{0}.{1}'.format(version[0], version[1].timestamp())
+    return 'income_and_expense:month_total:{0}:{1}:{2}:{3}'.format(
+        model._meta.model_name, first_date.year, first_date.month, stamp
+    )
+
+
+def month_versions(start_first, end_first):
+    """開始月〜終了月の (バージョン, 更新日時) を、月の初日をキーとして返す。"""
+    return {
+        month: (version, updated_at)
+        for month, version, updated_at in MonthVersion.objects.filter(
+            month__gte=start_first, month__lte=end_first
+        ).values_list('month', 'version', 'updated_at')
+    }
+
+
+def month_totals(model, start_first, end_first, versions=None):
+    """開始月〜終了月の月別合計を、月の初日をキーとする辞書で返す。
+
+    versions は month_versions の戻り値(収入・支出で共有する場合に渡す)。
+    """
+    months = []
+    cur = start_first
+    while cur <= end_first:
+        months.append(cur)
+        cur = cur + relativedelta(months=1)
+
+    if versions is None:
+        versions = month_versions(start_first, end_first)
+    keys = {m: _key(model, m, versions.get(m)) for m in months}
+    cached = cache.get_many(keys.values())
+    totals = {m: cached[keys[m]] for m in months if keys[m] in cached}
+
+    missing = [m for m in months if m not in totals]
+    if missing:
+        fresh = summaries.month_totals(model, missing[0], missing[-1])
+        values = {m: fresh.get(m, 0) for m in missing}
+        cache.set_many(
+            {keys[m]: v for m, v in values.items()}, CACHE_TIMEOUT
+        )
+        totals.update(values)
+    return totals
@@ -0,0 +1,103 @@
+"""月別の更新バージョンと、それを使った条件付き GET。
+
+収支の一覧・残高は該当月以前のすべての月の収支に依存するため、
+ETag は「該当月以前の全バージョンの合計」から作る。どの月が更新されても
+合計は必ず増えるので、1回の小さな集計で変更の有無を判定できる。
+"""
+import hashlib
+
+from django.db.models import F, Max, Q, Sum
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from income_and_expense.models import MonthVersion
+
+
+def bump_months(dates):
+    """指定日を含む各月のバージョンを上げる。"""
+    months = {d.replace(day=1) for d in dates}
+    if not months:
+        return
+    now = timezone.now()
+    updated = MonthVersion.objects.filter(month__in=months).update(
+        version=F('version') + 1, updated_at=now
+    )
+    if updated < len(months):
+        existing = set(
+            MonthVersion.objects.filter(month__in=months)
+            .values_list('month', flat=True)
+        )
+        MonthVersion.objects.bulk_create(
+            [
+                MonthVersion(month=m, version=1, updated_at=now)
+                for m in months - existing
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def bump_global():
+    """全月に影響する変更(口座・支払方法等)としてバージョンを上げる。"""
+    bump_months([MonthVersion.GLOBAL_MONTH])
+
+
+def _state(condition):
+    agg = MonthVersion.objects.filter(condition).aggregate(
+        total=Sum('version'), last=Max('updated_at')
+    )
+    return agg['total'] or 0, agg['last']
+
+
+def state_until(first_date):
+    """該当月以前(マスタ変更を含む)のバージョン合計と最終更新日時。"""
+    return _state(Q(month__lte=first_date))
+
+
+def state_between(start_first, end_first):
+    """期間内の月(マスタ変更を含む)のバージョン合計と最終更新日時。"""
+    return _state(
+        Q(month__gte=start_first, month__lte=end_first)
+        | Q(month=MonthVersion.GLOBAL_MONTH)
+    )
+
+
+def conditional_response(request, key, state, build):
+    """ETag / Last-Modified を付けてレスポンスを返す。
+
+    If-None-Match が一致する場合は build を呼ばずに 304 を返す
+    (集計もシリアライズも行わない)。
+
+    Last-Modified は秒単位のため、同じ秒のうちの更新を区別できない。
+    古い内容で 304 を返さないよう、If-Modified-Since は判定に使わず
+    ETag だけで判定する(Last-Modified は参考情報として付ける)。
+
+    Parameters
+    ----------
+    request : Request
+        リクエスト
+    key : str
+        レスポンスを決める条件(対象の年月など)
+    state : tuple
+        state_until / state_between の戻り値
+    build : callable
+        レスポンスを作る関数
+    """
+    total, last_modified = state
+    etag = '"{0}"'.format(hashlib.md5('{0}|{1}|{2}|{3}'.format(
+        request.get_full_path(), key, total, last_modified,
+    ).encode('utf-8')).hexdigest())
+    last_modified_ts = (
+        int(last_modified.timestamp()) if last_modified is not None else None
+    )
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = build()
+    # 304 にも ETag 等の検証用ヘッダーを付ける
+    response['ETag'] = etag
+    if last_modified_ts is not None:
+        response['Last-Modified'] = http_date(last_modified_ts)
+    # キャッシュしてよいが、使う前に必ず再検証させる
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -3,7 +3,6 @@ from django.shortcuts import render
 from django.http import HttpResponse, HttpResponseRedirect
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
-from django.db.models import Sum
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from dateutil.relativedelta import relativedelta
@@ -18,6 +17,7 @@ from .models import (
 )
 from .forms import LoginForm, IncomeForm, ExpenseForm, BalanceForm, LoanForm
 from .const import const_data
+from . import aggregations, balances, defaults, summaries, transitions
 
 def can_add_default_inex(year, month):
     """デフォルトの収支を追加可能か判定する。
@@ -96,40 +96,8 @@ def add_incs_from_default(year, month):
         追加した収入の数
     """
 
-    # 会計開始日と終了日を取得
-    first_date = datetime.date(year, month, 1)
-    last_date = (
-        first_date + relativedelta(months=1) - datetime.timedelta(days=1)
-    )
-
-    add_num = 0
-
-    # デフォルトの収入から収入を追加
-    def_inc_months = DefaultIncomeMonth.objects.filter(month=month)
-    this_month_incs = Income.objects.filter(
-        pay_date__gte=first_date, pay_date__lte=last_date
-    )
-    for def_inc_month in def_inc_months:
-        can_add = True
-        def_inc = def_inc_month.def_inc # 追加対象の収入
-        # 既に登録されているかのチェック
-        for this_month_inc in this_month_incs:
-            if def_inc.name == this_month_inc.name:
-                # 既に登録されている場合
-                can_add = False
-                break
-        # 追加
-        if can_add:
-            # まだ登録されていない場合
-            Income(
-                name=def_inc.name,
-                pay_date=datetime.date(year, month, def_inc.pay_day),
-                method=def_inc.method, amount=def_inc.amount,
-                state=def_inc.state,
-            ).save()
-            add_num += 1
-
-    return add_num
+    # デフォルトの収入から収入を一括追加
+    return defaults.add_incomes_from_default(year, month)
 
 def add_exps_from_default_and_loan(year, month):
     """デフォルトの支出とローンから支出を追加する。
@@ -147,68 +115,8 @@ def add_exps_from_default_and_loan(year, month):
         追加した支出の数
     """
 
-    # 会計開始日と終了日を取得
-    first_date = datetime.date(year, month, 1)
-    last_date = (
-        first_date + relativedelta(months=1) - datetime.timedelta(days=1)
-    )
-
-    add_num = 0
-
-    # デフォルトの支出から支出を追加
-    def_exp_months = DefaultExpenseMonth.objects.filter(month=month)
-    this_month_exps = Expense.objects.filter(
-        pay_date__gte=first_date, pay_date__lte=last_date
-    )
-    for def_exp_month in def_exp_months:
-        can_add = True
-        def_exp = def_exp_month.def_exp # 追加対象の支出
-        # 既に登録されているかのチェック
-        for this_month_exp in this_month_exps:
-            if def_exp.name == this_month_exp.name:
-                # 既に登録されている場合
-                can_add = False
-                break
-        # 追加
-        if can_add:
-            # まだ登録されていない場合
-            Expense(
-                name=def_exp.name,
-                pay_date=datetime.date(year, month, def_exp.pay_day),
-                method=def_exp.method,
-                amount=def_exp.amount, state=def_exp.state,
-            ).save()
-            add_num += 1
-
-    # ローンから支出を追加
-    loans = Loan.objects.filter(
-        (Q(first_year__lt=year) | Q(first_year=year, first_month__lte=month)),
-        (Q(last_year__gt=year) | Q(last_year=year, last_month__gte=month))
-    )
-    for loan in loans:
-        can_add = True
-        # 既に登録されているかのチェック
-        for this_month_exp in this_month_exps:
-            if loan.name == this_month_exp.name:
-                # 既に登録されている場合
-                can_add = False
-                break
-        # 追加
-        if can_add:
-            # まだ登録されていない場合
-            if year == loan.first_year and month == loan.first_month:
-                amount = loan.amount_first
-            else:
-                amount = loan.amount_from_second
-
-            Expense(
-                name=loan.name,
-                pay_date=datetime.date(year, month, loan.pay_day),
-                method=loan.method, amount=amount, state=loan.state,
-            ).save()
-            add_num += 1
-
-    return add_num
+    # デフォルトの支出とローンから支出を一括追加
+    return defaults.add_expenses_from_default_and_loan(year, month)
 
 def get_balance_done(year, month):
     """該当月までの残高（完了分）を取得
@@ -226,35 +134,8 @@ def get_balance_done(year, month):
         該当月までの残高（完了分）
     """
 
-    # 会計開始日と終了日を取得
-    first_date = datetime.date(year, month, 1)
-    last_date = (
-        first_date + relativedelta(months=1) - datetime.timedelta(days=1)
-    )
-
-    # 今月までの収支リストを取得
-    incs_to_this_month = Income.objects.filter(
-        pay_date__lte=last_date
-    )
-    exps_to_this_month = Expense.objects.filter(
-        pay_date__lte=last_date
-    )
-
-    # 残高を計算
-    # 今月までの収入（完了分）の合計
-    done_incs = incs_to_this_month.filter(state=StateChoices.DONE)
-    done_inc_sums = done_incs.aggregate(Sum('amount'))
-    done_inc_sum = done_inc_sums['amount__sum']
-    if done_inc_sum is None:
-        done_inc_sum = 0
-    # 今月の支出（完了分）を減算
-    done_exps = exps_to_this_month.filter(state=StateChoices.DONE)
-    done_exp_sums = done_exps.aggregate(Sum('amount'))
-    done_exp_sum = done_exp_sums['amount__sum']
-    if done_exp_sum is None:
-        done_exp_sum = 0
-
-    return done_inc_sum - done_exp_sum
+    # 直前の月末残高スナップショットと以降の収支から計算
+    return balances.get_balances(year, month)[1]
 
 def get_balance(year, month):
     """該当月までの残高を取得
@@ -272,33 +153,8 @@ def get_balance(year, month):
         該当月までの残高
     """
 
-    # 会計開始日と終了日を取得
-    first_date = datetime.date(year, month, 1)
-    last_date = (
-        first_date + relativedelta(months=1) - datetime.timedelta(days=1)
-    )
-
-    # 今月までの収支リストを取得
-    incs_to_this_month = Income.objects.filter(
-        pay_date__lte=last_date
-    )
-    exps_to_this_month = Expense.objects.filter(
-        pay_date__lte=last_date
-    )
-
-    # 残高を計算
-    # 今月までの収入（完了分）の合計
-    inc_sums = incs_to_this_month.aggregate(Sum('amount'))
-    inc_sum = inc_sums['amount__sum']
-    if inc_sum is None:
-        inc_sum = 0
-    # 今月の支出（完了分）を減算
-    exp_sums = exps_to_this_month.aggregate(Sum('amount'))
-    exp_sum = exp_sums['amount__sum']
-    if exp_sum is None:
-        exp_sum = 0
-
-    return inc_sum - exp_sum
+    # 直前の月末残高スナップショットと以降の収支から計算
+    return balances.get_balances(year, month)[0]
 
 
 # Create your views here.
@@ -654,8 +510,7 @@ def income(request, year, month):
     ).filter(pay_date__gte=first_date, pay_date__lte=last_date)
 
     # 今月の収入の合計を取得
-    inc_sum = (last_mon_balance
-               + (this_month_incs.aggregate(Sum('amount'))['amount__sum'] or 0))
+    inc_sum = last_mon_balance + summaries.month_total(Income, first_date)
 
     return render(request, 'income_and_expense/income.html', {
         'path_name': const_data.const.PATH_NAME_INCOME,
@@ -742,7 +597,7 @@ def expense(request, year, month):
     ).filter(pay_date__gte=first_date, pay_date__lte=last_date)
 
     # 今月の支出の合計を取得
-    exp_sum = this_month_exps.aggregate(Sum('amount'))['amount__sum'] or 0
+    exp_sum = summaries.month_total(Expense, first_date)
 
     # 今月の残高を取得
     balance = get_balance(year, month)
@@ -865,28 +720,17 @@ def account_require(request, year, month):
         first_date + relativedelta(months=1) - datetime.timedelta(days=1)
     )
 
-    # 今月の支出リストを取得
-    this_month_exps = Expense.objects.filter(
-        pay_date__gte=first_date, pay_date__lte=last_date
-    )
-
     # 各口座の必要金額を取得
-    # 全口座
-    accounts = Account.objects.all().order_by(
-        'user__name', 'bank__name'
+    # 全口座と口座別の必要金額(一括集計)
+    account_and_requires = aggregations.require_rows(
+        'account', first_date, last_date
     )
     account_requires = [] # 各口座の必要金額
     require_sum = 0 # 必要金額の合計値
     insufficient_sum = 0 # 不足額の合計値
     is_insufficient = False # 口座残高が不足しているかどうか
     insufficient_amount = 0 # 各口座の不足額
-    for account in accounts:
-        require = this_month_exps.filter(method__account=account).exclude(
-            state=StateChoices.DONE
-        ).aggregate(Sum('amount'))['amount__sum']
-        if require is None:
-            require = 0
-
+    for account, require in account_and_requires:
         require_sum += require
 
         if account.balance < require:
@@ -939,25 +783,14 @@ def method_require(request, year, month):
         first_date + relativedelta(months=1) - datetime.timedelta(days=1)
     )
 
-    # 今月の支出リストを取得
-    this_month_exps = Expense.objects.filter(
-        pay_date__gte=first_date, pay_date__lte=last_date
-    )
-
     # 支払方法別の必要金額を取得
-    # 全支払方法
-    methods = Method.objects.all().order_by(
-        'account__user__name', 'name', 'account__bank__name'
+    # 全支払方法と支払方法別の必要金額(一括集計)
+    method_and_requires = aggregations.require_rows(
+        'method', first_date, last_date
     )
     method_requires = [] # 支払方法別の必要金額
     require_sum = 0 # 必要金額の合計値
-    for method in methods:
-        require = this_month_exps.filter(method=method).exclude(
-            state=StateChoices.DONE
-        ).aggregate(Sum('amount'))['amount__sum']
-        if require is None:
-            require = 0
-
+    for method, require in method_and_requires:
         require_sum += require
 
         method_require = {
@@ -995,19 +828,11 @@ def method_done(request, year, month, pk):
         HttpResponseオブジェクト
     """
 
-    # 会計開始日と終了日を取得
-    first_date = datetime.date(year, month, 1)
-    last_date = (
-            first_date + relativedelta(months=1) - datetime.timedelta(days=1)
-    )
-
     # 該当の支払方法の支出をすべて支払済に変更
-    target_exps = Expense.objects.filter(method__pk=pk,
-        pay_date__gte=first_date, pay_date__lte=last_date
+    transitions.mark_method_done(
+        pk, datetime.date(year, month, 1), transitions.SOURCE_VIEW,
+        request.user.get_username()
     )
-    for target_exp in target_exps:
-        target_exp.state = StateChoices.DONE
-        target_exp.save()
 
     messages.success(request, "成功: 支払済一括登録されました。")
 